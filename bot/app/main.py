@@ -15,6 +15,7 @@
 import asyncio
 import logging
 import os
+import time
 
 import sys
 import yaml
@@ -25,8 +26,10 @@ from aiogram.filters import CommandStart, Command
 from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 
 from qna import get_answer, Answer, like_answer, dislike_answer
-from settings import (init_db, get_pipeline_or_default, get_verbose_or_default,
-                      pipelines, set_verbose, set_pipeline)
+from settings import (init_db, close_db, get_pipeline_or_default, get_verbose_or_default,
+                      get_settings_or_default, pipelines, set_verbose, set_pipeline,
+                      ChatSettings, DEFAULT_PIPELINE, DEFAULT_VERBOSE)
+from tracing import log_trace, stage, start_trace
 
 # Настройка логирования
 logging.basicConfig(
@@ -107,26 +110,35 @@ async def dislike_handler(query: CallbackQuery):
 # Обработчик вопросов
 @dp.message()
 async def question_handler(message: Message) -> None:
+    trace = start_trace()
+    started_at = time.perf_counter()
+    # Настройки по-умолчанию остаются для ответа об ошибке, если их не удалось прочитать
+    settings = ChatSettings(pipeline=DEFAULT_PIPELINE, verbose=DEFAULT_VERBOSE)
     try:
+        # Настройки чата читаются один раз на сообщение, для активного чата - из кэша
+        with stage('settings'):
+            settings = await get_settings_or_default(message.chat.id)
         question = message.text
-        pipeline = await get_pipeline_or_default(message.chat.id)
-        answer_data = await get_answer(question, pipeline)
+        with stage('qna'):
+            answer_data = await get_answer(question, settings.pipeline)
         logger.info(
             f'question={question} answer="{answer_data.answer}" '
             f'user_id="{message.from_user.id}" user_id="{message.from_user.username}" '
             f'first_name="{message.from_user.first_name}" last_name="{message.from_user.last_name}"'
         )
-        if answer_data.answer == NO_ANSWER:
-            await message.reply(bot_messages['answer-no'])
-            return
-        verbose = await get_verbose_or_default(message.chat.id)
-        text = get_answer_text(answer_data, verbose)
-        markup = create_answer_markup(answer_data.id)
-        await message.reply(text, reply_markup=markup)
+        with stage('reply'):
+            if answer_data.answer == NO_ANSWER:
+                await message.reply(bot_messages['answer-no'])
+                return
+            text = get_answer_text(answer_data, settings.verbose)
+            markup = create_answer_markup(answer_data.id)
+            await message.reply(text, reply_markup=markup)
     except Exception as exception:
-        verbose = await get_verbose_or_default(message.chat.id)
-        error_text = bot_messages['error'].format(exception=str(exception) if verbose else '')
+        error_text = bot_messages['error'].format(exception=str(exception) if settings.verbose else '')
         await message.reply(error_text)
+    finally:
+        trace['total'] = (time.perf_counter() - started_at) * 1000
+        log_trace(trace, chat_id=message.chat.id, pipeline=settings.pipeline)
 
 
 # Создание кнопок для сообщения
@@ -191,7 +203,10 @@ async def main() -> None:
     bot_token = os.getenv('BOT_TOKEN')
     bot = Bot(token=bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
     await init_db()
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await close_db()
 
 
 if __name__ == "__main__":
@@ -18,6 +18,8 @@ from typing import Optional, Dict, List
 import aiohttp
 from pydantic import BaseModel
 
+from tracing import REQUEST_ID_HEADER, SERVER_TIMING_HEADER, merge_server_timing, new_request_id
+
 # URL сервиса вопросов и ответов
 QNA_SERVICE_URL = os.getenv('QNA_SERVICE_URL', 'http://qna-service:8080')
 
@@ -41,9 +43,12 @@ class Answer(BaseModel):
 
 # Получение ответа от пайплайна
 async def get_answer(question: str, pipeline: str) -> Answer:
+    # Идентификатор запроса проходит через шлюз в пайплайн, стадии шлюза и пайплайна возвращаются в Server-Timing
+    headers = {REQUEST_ID_HEADER: new_request_id()}
     async with aiohttp.ClientSession() as session:
         request = {'question': question, 'pipeline': pipeline}
-        async with session.post(f'{QNA_SERVICE_URL}/api/answers', json=request) as response:
+        async with session.post(f'{QNA_SERVICE_URL}/api/answers', json=request, headers=headers) as response:
+            merge_server_timing(response.headers.get(SERVER_TIMING_HEADER), 'qna')
             if response.status == 200:
                 json = await response.json()
                 return Answer(**json)  # Возвращаем объект Answer
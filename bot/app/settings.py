@@ -13,11 +13,15 @@
 #  limitations under the License.
 
 import os
+from collections import OrderedDict
+from typing import NamedTuple, Optional
 
 import aiosqlite
 
 # Путь к базе данных
 BOT_DB_PATH = os.getenv('BOT_DB_PATH', 'settings.db')
+# Максимальное число чатов в кэше настроек
+BOT_SETTINGS_CACHE_SIZE = int(os.getenv('BOT_SETTINGS_CACHE_SIZE', '100000'))
 
 # Получение значений переменных окружения с установленными значениями по умолчанию
 DEFAULT_VERBOSE = os.getenv('BOT_DEFAULT_VERBOSE', 'false').lower() in ('true', '1', 't')
@@ -29,64 +33,116 @@ pipelines = {
     "faq": "Поиск по вопросам FAQ",
     "faq_cases": "Поиск по вопросам FAQ+Кейсы",
     "rag_ranker": "Поиск по вопросам FAQ+Кейсы с ранжированием",
+    "ensemble": "Ансамбль всех пайплайнов",
 }
 
 
+# Настройки чата, None - значение не задано
+class ChatSettings(NamedTuple):
+    pipeline: Optional[str] = None
+    verbose: Optional[bool] = None
+
+
+# Единственное соединение с базой данных на всё время работы бота
+db: Optional[aiosqlite.Connection] = None
+
+# Кэш настроек чатов со сквозной записью: чтение из базы только при первом сообщении чата
+settings_cache: "OrderedDict[int, ChatSettings]" = OrderedDict()
+
+
 # Инициализация базы данных
 async def init_db() -> None:
-    async with aiosqlite.connect(BOT_DB_PATH) as db:
-        await db.execute('''
-        CREATE TABLE IF NOT EXISTS chats (
-            chat_id INTEGER,
-            pipeline TEXT,
-            verbose BOOLEAN,
-            PRIMARY KEY (chat_id)
-        )
-        ''')
-        await db.commit()
+    global db
+
+    db = await aiosqlite.connect(BOT_DB_PATH)
+    await db.execute('''
+    CREATE TABLE IF NOT EXISTS chats (
+        chat_id INTEGER,
+        pipeline TEXT,
+        verbose BOOLEAN,
+        PRIMARY KEY (chat_id)
+    )
+    ''')
+    await db.commit()
+
+
+# Закрытие базы данных
+async def close_db() -> None:
+    global db
+
+    if db is not None:
+        await db.close()
+        db = None
+
+
+def cache_settings(chat_id: int, settings: ChatSettings) -> None:
+    settings_cache[chat_id] = settings
+    settings_cache.move_to_end(chat_id)
+    if len(settings_cache) > BOT_SETTINGS_CACHE_SIZE:
+        settings_cache.popitem(last=False)
+
+
+# Получение настроек чата одним запросом, повторно - из кэша
+async def get_settings(chat_id: int) -> ChatSettings:
+    settings = settings_cache.get(chat_id)
+    if settings is not None:
+        settings_cache.move_to_end(chat_id)
+        return settings
+
+    async with db.execute("SELECT pipeline, verbose FROM chats WHERE chat_id = ?", (chat_id,)) as cursor:
+        row = await cursor.fetchone()
+    # Отсутствие настроек тоже кэшируется, чтобы новые чаты не читали базу на каждом сообщении
+    settings = ChatSettings(row[0], None if row[1] is None else bool(row[1])) if row else ChatSettings()
+    cache_settings(chat_id, settings)
+    return settings
+
+
+# Получение настроек чата со значениями по умолчанию
+async def get_settings_or_default(chat_id: int) -> ChatSettings:
+    settings = await get_settings(chat_id)
+    return ChatSettings(
+        pipeline=settings.pipeline or DEFAULT_PIPELINE,
+        verbose=DEFAULT_VERBOSE if settings.verbose is None else settings.verbose,
+    )
 
 
 # Получения пайплайна
 async def get_pipeline(chat_id: int) -> str:
-    async with aiosqlite.connect(BOT_DB_PATH) as db:
-        cursor = await db.execute("SELECT pipeline FROM chats WHERE chat_id = ?", (chat_id,))
-        row = await cursor.fetchone()
-        return row[0] if row else None
+    return (await get_settings(chat_id)).pipeline
 
 
 # Получения пайплайна или значения по умолчанию
 async def get_pipeline_or_default(chat_id: int) -> str:
-    return await get_pipeline(chat_id) or DEFAULT_PIPELINE
+    return (await get_settings_or_default(chat_id)).pipeline
 
 
-# Установки пайплайна
+# Установки пайплайна, значение verbose не затрагивается
 async def set_pipeline(chat_id: int, pipeline: str) -> None:
-    async with aiosqlite.connect(BOT_DB_PATH) as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO chats (chat_id, pipeline) VALUES (?, ?)",
-            (chat_id, pipeline)
-        )
-        await db.commit()
+    await db.execute(
+        "INSERT INTO chats (chat_id, pipeline) VALUES (?, ?) "
+        "ON CONFLICT (chat_id) DO UPDATE SET pipeline = excluded.pipeline",
+        (chat_id, pipeline)
+    )
+    await db.commit()
+    cache_settings(chat_id, (await get_settings(chat_id))._replace(pipeline=pipeline))
 
 
 # Получение значения verbose
 async def get_verbose(chat_id: int) -> bool:
-    async with aiosqlite.connect(BOT_DB_PATH) as db:
-        cursor = await db.execute("SELECT verbose FROM chats WHERE chat_id = ?", (chat_id,))
-        row = await cursor.fetchone()
-        return row[0] if row else None
+    return (await get_settings(chat_id)).verbose
 
 
 # Получение значения verbose или значения по умолчанию
 async def get_verbose_or_default(chat_id: int) -> bool:
-    return await get_verbose(chat_id) or DEFAULT_VERBOSE
+    return (await get_settings_or_default(chat_id)).verbose
 
 
-# Установка значения verbose
+# Установка значения verbose, пайплайн не затрагивается
 async def set_verbose(chat_id: int, verbose: bool) -> None:
-    async with aiosqlite.connect(BOT_DB_PATH) as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO chats (chat_id, verbose) VALUES (?, ?)",
-            (chat_id, verbose)
-        )
-        await db.commit()
+    await db.execute(
+        "INSERT INTO chats (chat_id, verbose) VALUES (?, ?) "
+        "ON CONFLICT (chat_id) DO UPDATE SET verbose = excluded.verbose",
+        (chat_id, verbose)
+    )
+    await db.commit()
+    cache_settings(chat_id, (await get_settings(chat_id))._replace(verbose=verbose))
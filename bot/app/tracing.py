@@ -0,0 +1,115 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import contextlib
+import json
+import logging
+import os
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+# Трассировка сообщения бота. Это не копия app/tracing.py шлюза и пайплайнов: бот только создаёт
+# идентификатор запроса и собирает стадии из Server-Timing шлюза, метрик и заголовков ответа у него нет
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = 'X-Request-Id'
+SERVER_TIMING_HEADER = 'Server-Timing'
+
+# Сообщения, обработанные дольше порога, логируются с деревом стадий бота, шлюза и пайплайна
+BOT_SLOW_REQUEST_MS = float(os.getenv('BOT_SLOW_REQUEST_MS', '3000'))
+
+# Длительности стадий обработки сообщения в миллисекундах и сквозной идентификатор запроса
+_trace: ContextVar[Optional[Dict[str, float]]] = ContextVar('trace', default=None)
+_request_id: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+
+
+def start_trace() -> Dict[str, float]:
+    trace = {}
+    _trace.set(trace)
+    _request_id.set(None)
+    return trace
+
+
+def new_request_id() -> str:
+    request_id = uuid.uuid4().hex
+    _request_id.set(request_id)
+    return request_id
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Замеряет стадию обработки сообщения, без начатой трассировки ничего не делает.
+    """
+    trace = _trace.get()
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace[name] = trace.get(name, 0.0) + (time.perf_counter() - started_at) * 1000
+
+
+def merge_server_timing(header: Optional[str], prefix: str) -> None:
+    """
+    Добавляет стадии сервиса из его `Server-Timing` в трассировку сообщения с префиксом `<prefix>.`.
+    """
+    trace = _trace.get()
+    if trace is None:
+        return
+    for metric in (header or '').split(','):
+        name, *params = [part.strip() for part in metric.split(';')]
+        for param in params:
+            key, _, value = param.partition('=')
+            if name and key.strip() == 'dur':
+                try:
+                    trace[f'{prefix}.{name}'] = float(value)
+                except ValueError:
+                    pass
+
+
+def span_tree(trace: Dict[str, float]) -> str:
+    groups: Dict[str, Dict[str, float]] = {}
+    for key, duration in trace.items():
+        prefix, _, name = key.rpartition('.')
+        groups.setdefault(prefix, {})[name] = duration
+    lines = []
+    for prefix in sorted(groups):
+        depth = prefix.count('.') + 1 if prefix else 0
+        spans = ' '.join(f'{name}={duration:.1f}ms' for name, duration in groups[prefix].items())
+        lines.append('  ' * depth + f'{prefix.rpartition(".")[2] or "bot"}: {spans}')
+    return '\n'.join(lines)
+
+
+def log_trace(trace: Dict[str, float], **fields) -> None:
+    """
+    Логирует трассировку сообщения одной JSON записью, а медленные сообщения - ещё и деревом стадий.
+    """
+    request_id = current_request_id()
+    record = {
+        'request_id': request_id,
+        **fields,
+        'spans': {name: round(duration, 3) for name, duration in trace.items()},
+    }
+    logger.info(f'request trace: {json.dumps(record, ensure_ascii=False)}')
+    total = trace.get('total', 0.0)
+    if total >= BOT_SLOW_REQUEST_MS:
+        logger.warning(f'slow request: request_id="{request_id}" total={total:.1f}ms\n{span_tree(trace)}')
@@ -0,0 +1,145 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Планировщик динамических микро-батчей.
+
+    Собирает одиночные запросы из конкурентных корутин, пока не наберётся `max_batch_size`
+    элементов или не пройдёт `max_wait_ms` миллисекунд с первого из них, выполняет
+    один батчевый вызов `process_batch` в пуле потоков и раздаёт результаты ожидающим.
+    Батчи выполняются строго по одному, поэтому потоки не конкурируют за одну модель: синхронные
+    батчевые вызовы вне цикла событий (пакетная обработка) идут через `run` под той же блокировкой.
+    Вместо общего пула потоков можно передать свой `executor`, чтобы ограничить потоки инференса.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            process_batch: Callable[[List[Any]], List[Any]],
+            max_batch_size: int = 16,
+            max_wait_ms: float = 5,
+            executor: Optional[Executor] = None,
+    ):
+        self.name = name
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.lock = threading.Lock()
+        self.batch_sizes = Counter()
+
+    def run(self, items: List[Any]) -> List[Any]:
+        """
+        Синхронный батчевый вызов `process_batch`, не пересекающийся с батчами микро-батчера.
+        """
+        with self.lock:
+            return self.process_batch(items)
+
+    async def submit(self, item: Any) -> Any:
+        if self.worker is None or self.worker.done():
+            self._restart()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    def _restart(self) -> None:
+        if self.worker is not None and not self.worker.cancelled() and self.worker.exception() is not None:
+            logger.error(f'batcher worker died: batcher="{self.name}" error="{self.worker.exception()!r}"')
+        if self.queue is not None:
+            # Ожидающие в очереди остановленного обработчика иначе не получили бы ответа никогда
+            self._fail([self.queue.get_nowait() for _ in range(self.queue.qsize())],
+                       RuntimeError(f'batcher "{self.name}" worker stopped'))
+        # Очередь создаётся заново: цикл событий мог смениться (asyncio.run в офлайн-прогонах)
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.create_task(self._work())
+
+    @staticmethod
+    def _fail(batch: List[Tuple[Any, asyncio.Future]], exception: BaseException) -> None:
+        for _, future in batch:
+            if future.done():
+                continue
+            try:
+                future.set_exception(exception)
+            except RuntimeError:
+                # Цикл событий ожидающего уже закрыт
+                pass
+
+    async def _collect(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        # Батч заполняется на месте, чтобы при остановке обработчика были известны уже взятые из очереди
+        loop = asyncio.get_running_loop()
+        batch.append(await self.queue.get())
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _work(self) -> None:
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            while True:
+                batch = []
+                await self._collect(batch)
+                # Отменённые клиенты не занимают место в батче
+                batch = [(item, future) for item, future in batch if not future.done()]
+                if not batch:
+                    continue
+                self.batch_sizes[len(batch)] += 1
+                try:
+                    results = await loop.run_in_executor(self.executor, self.run, [item for item, _ in batch])
+                except Exception as exception:
+                    logger.exception(f'batch failed: batcher="{self.name}" size={len(batch)}')
+                    self._fail(batch, exception)
+                    continue
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+        except BaseException as exception:
+            # Обработчик остановлен посреди батча: его ожидающие тоже получают ошибку
+            self._fail(batch, RuntimeError(f'batcher "{self.name}" worker stopped: {exception!r}'))
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        batches = sum(self.batch_sizes.values())
+        items = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'queue': self.queue.qsize() if self.queue is not None else 0,
+            'batches': batches,
+            'items': items,
+            'mean_batch_size': items / batches if batches else 0,
+            'batch_sizes': dict(sorted(self.batch_sizes.items())),
+        }
@@ -12,14 +12,19 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import asyncio
 import logging
 
 import sys
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from app.model import get_answer, Answer
+from app.model import get_answer, answer_batch, Answer, inference_executor, init, search_batcher, startup
+from app.streaming import BatchRequest, NDJSON_MEDIA_TYPE, stream_answers
+from app.telemetry import CONTENT_TYPE, Gauge, TrackedExecutor, render, track_request
+from app.tracing import RequestTracing
 
 logging.basicConfig(
     level=logging.INFO,
@@ -28,6 +33,11 @@ logging.basicConfig(
 )
 
 app = FastAPI()
+app.middleware("http")(track_request)
+app.middleware("http")(RequestTracing())
+
+# Общий пул потоков для asyncio.to_thread и run_in_executor с учётом очереди задач
+default_executor = TrackedExecutor('default')
 
 
 @app.get("/")
@@ -35,14 +45,67 @@ async def root():
     return {"status": "UP"}
 
 
+@app.get("/health/live")
+async def live(response: Response):
+    if startup.failed:
+        response.status_code = 503
+        return {"status": "DOWN", "error": startup.error}
+    return {"status": "UP"}
+
+
+@app.get("/health/ready")
+async def ready(response: Response):
+    if not startup.ready:
+        response.status_code = 503
+    return startup.status()
+
+
+def ensure_ready() -> None:
+    if not startup.ready:
+        raise HTTPException(status_code=503, detail="Сервис ещё инициализируется")
+
+
 class QuestionRequest(BaseModel):
     question: str
 
 
-@app.post("/api/answers", response_model=Answer)
+@app.post("/api/answers", response_model=Answer, dependencies=[Depends(ensure_ready)])
 async def ask(request: QuestionRequest) -> Answer:
     return await get_answer(request.question)
 
 
+@app.get("/stats")
+async def stats():
+    return {"batching": {"search": search_batcher.stats()}}
+
+
+@app.post("/api/answers/batch", dependencies=[Depends(ensure_ready)])
+async def ask_batch(request: BatchRequest) -> StreamingResponse:
+    # Ответы уходят построчно в NDJSON по мере готовности батчей, батчи считаются в пуле потоков инференса
+    return StreamingResponse(
+        stream_answers(request.questions, answer_batch, executor=inference_executor),
+        media_type=NDJSON_MEDIA_TYPE,
+    )
+
+
+# Метрики Prometheus по статистике компонентов, считываются при каждом сборе
+Gauge(
+    'pipeline_batch_queue_depth', 'Запросы, ожидающие микро-батча', ['batcher'],
+    function=lambda: {(search_batcher.name,): search_batcher.stats()['queue']},
+)
+
+
+@app.get("/metrics")
+async def prometheus_metrics() -> Response:
+    return Response(render(), media_type=CONTENT_TYPE)
+
+
+@app.on_event("startup")
+async def startup_event():
+    asyncio.get_running_loop().set_default_executor(default_executor)
+    # Модель загружается в фоне, чтобы сервис сразу отвечал на проверки живости и готовности
+    app.state.init_task = asyncio.get_running_loop().run_in_executor(None, init)
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host='0.0.0.0', port=8088)
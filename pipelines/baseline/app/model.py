@@ -14,11 +14,17 @@
 
 import os
 import warnings
+from typing import List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 from pydantic import BaseModel
 from sentence_transformers import SentenceTransformer
-from sentence_transformers.util import cos_sim
+
+from app.batching import MicroBatcher
+from app.startup import Startup
+from app.telemetry import TrackedExecutor
+from app.tracing import stage
 
 # Отключение предупреждений
 warnings.filterwarnings('ignore')
@@ -26,14 +32,107 @@ warnings.filterwarnings('ignore')
 # Путь к файлу базы знаний из переменной окружения
 KNOWLEDGE_BASE_FILE_PATH = os.getenv('KNOWLEDGE_BASE_FILE_PATH')
 
-# Загрузка данных из Excel в DataFrame
-faq = pd.read_excel(KNOWLEDGE_BASE_FILE_PATH)
+# Число кандидатов в ответе
+TOP_K = int(os.getenv('TOP_K', '3'))
+
+# Батчи вопросов от конкурентных запросов и число потоков инференса
+EMBEDDER_MAX_BATCH_SIZE = int(os.getenv('EMBEDDER_MAX_BATCH_SIZE', '32'))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', '5'))
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '1'))
+
+# Состояние фоновой инициализации
+startup = Startup()
+
+# Заполняются стадиями фоновой инициализации, см. init()
+faq: Optional[pd.DataFrame] = None
+model: Optional[SentenceTransformer] = None
+# Нормализованные эмбеддинги вопросов из БЗ, float32 матрица (вопросы x размерность)
+faq_matrix: Optional[np.ndarray] = None
+# Вопрос, ответ и классификаторы по позиции вопроса в БЗ
+faq_records: List[Tuple[str, str, str, str]] = []
+
+
+def load_knowledge_base() -> None:
+    global faq, faq_records
+
+    # Загрузка данных из Excel в DataFrame
+    faq = pd.read_excel(KNOWLEDGE_BASE_FILE_PATH)
+    faq_records = list(zip(
+        faq['Вопрос из БЗ'],
+        faq['Ответ из БЗ'],
+        faq['Классификатор 1 уровня'],
+        faq['Классификатор 2 уровня'],
+    ))
+
+
+def load_model() -> None:
+    global model
+
+    # Инициализация модели SentenceTransformer для векторного представления текстов
+    model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+
+
+def encode(texts: List[str]) -> np.ndarray:
+    # Нормализованные векторы: косинусное сходство сводится к скалярному произведению
+    return model.encode(
+        texts,
+        batch_size=EMBEDDER_MAX_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    ).astype(np.float32, copy=False)
+
+
+def build_index() -> None:
+    global faq_matrix
 
-# Инициализация модели SentenceTransformer для векторного представления текстов
-model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+    # Кодирование вопросов из базы знаний в векторы
+    faq_matrix = np.ascontiguousarray(encode([question for question, *_ in faq_records]))
 
-# Кодирование вопросов из базы знаний в векторы
-faq_embeddings = model.encode(faq['Вопрос из БЗ'].values)
+
+def init() -> None:
+    """
+    Инициализация по стадиям: загрузка базы знаний, модели и кодирование вопросов.
+    Выполняется в фоне после старта сервиса.
+    """
+    startup.run([
+        ("knowledge_base", load_knowledge_base),
+        ("model", load_model),
+        ("index", build_index),
+    ])
+
+
+# Поиск top-k вопросов из БЗ для батча вопросов: одно кодирование и одно матричное умножение на батч
+def search_batch(questions: List[str]) -> List[List[Tuple[int, float]]]:
+    scores = encode(questions) @ faq_matrix.T
+    k = min(TOP_K, scores.shape[1])
+
+    # argpartition отбирает k лучших без полной сортировки, сортируются только они
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    return [list(zip(positions.tolist(), values.tolist())) for positions, values in zip(top, top_scores)]
+
+
+# Ограниченный пул потоков инференса, цикл событий не блокируется кодированием вопросов
+inference_executor = TrackedExecutor('inference', max_workers=INFERENCE_WORKERS)
+search_batcher = MicroBatcher(
+    "search",
+    search_batch,
+    EMBEDDER_MAX_BATCH_SIZE,
+    BATCH_MAX_WAIT_MS,
+    executor=inference_executor,
+)
+
+
+# Кандидат ответа с оценкой близости вопроса
+class Candidate(BaseModel):
+    question: str
+    answer: str
+    class_1: str
+    class_2: str
+    score: float
 
 
 # Модель ответа с полями ответа и классификаторами
@@ -41,22 +140,33 @@ class Answer(BaseModel):
     answer: str
     class_1: str
     class_2: str
+    score: Optional[float] = None
+    candidates: List[Candidate] = []
 
 
 # Функция для получения ответа на вопрос
 async def get_answer(question: str) -> Answer:
-    # Кодирование заданного вопроса в вектор
-    question_embedding = model.encode(question)
+    # Кодирование вопроса и поиск ближайших вопросов из БЗ в батче с конкурентными запросами
+    with stage("retrieve"):
+        hits = await search_batcher.submit(question)
+
+    # Получение наиболее похожего ответа и кандидатов по позициям в БЗ
+    with stage("lookup"):
+        return answer_by_hits(hits)
+
 
-    # Вычисление косинусного сходства между вопросом и всеми вопросами из БЗ
-    similarities = cos_sim(question_embedding, faq_embeddings)
+# Батчевый ответ на список вопросов для пакетной обработки, модель занимается по очереди с микро-батчами
+def answer_batch(questions: List[str]) -> List[Answer]:
+    return [answer_by_hits(hits) for hits in search_batcher.run(questions)]
 
-    # Получение наиболее похожего ответа по индексу максимального значения сходства
-    answer_data = faq.iloc[similarities.argmax().item()]
 
-    # Формирование объекта ответа с данными из базы
+# Формирование объекта ответа по найденным позициям вопросов в базе знаний
+def answer_by_hits(hits: List[Tuple[int, float]]) -> Answer:
+    candidates = []
+    for position, score in hits:
+        question, answer, class_1, class_2 = faq_records[position]
+        candidates.append(Candidate(question=question, answer=answer, class_1=class_1, class_2=class_2, score=score))
+    best = candidates[0]
     return Answer(
-        answer=answer_data['Ответ из БЗ'],
-        class_1=answer_data['Классификатор 1 уровня'],
-        class_2=answer_data['Классификатор 2 уровня'],
+        answer=best.answer, class_1=best.class_1, class_2=best.class_2, score=best.score, candidates=candidates
     )
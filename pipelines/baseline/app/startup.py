@@ -0,0 +1,74 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Startup:
+    """
+    Состояние фоновой инициализации пайплайна по стадиям.
+
+    Стадии выполняются по порядку в одном потоке, пока сервис уже принимает запросы;
+    готовность наступает после успешного завершения последней стадии.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.ready = False
+        self.error: Optional[str] = None
+        self.lock = threading.Lock()
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+    def run(self, stages: List[Tuple[str, Callable[[], None]]]) -> None:
+        with self.lock:
+            if self.ready:
+                return
+            self.stages = {name: {'status': PENDING} for name, _ in stages}
+            for name, function in stages:
+                stage = self.stages[name]
+                stage['status'] = RUNNING
+                logger.info(f'startup stage: stage="{name}" status="{RUNNING}"')
+                started_at = time.perf_counter()
+                try:
+                    function()
+                except Exception as exception:
+                    stage['status'] = FAILED
+                    stage['duration'] = round(time.perf_counter() - started_at, 3)
+                    self.error = f'{name}: {exception}'
+                    logger.exception(f'startup stage: stage="{name}" status="{FAILED}"')
+                    raise
+                stage['status'] = DONE
+                stage['duration'] = round(time.perf_counter() - started_at, 3)
+                logger.info(f'startup stage: stage="{name}" status="{DONE}" duration={stage["duration"]}')
+            self.ready = True
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'ready': self.ready,
+            'error': self.error,
+            'stages': self.stages,
+        }
@@ -0,0 +1,241 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Офлайн оценка пайплайна в процессе: пропускная способность, задержки по стадиям и качество ответов.
+
+Модуль `app.model` пайплайна импортируется напрямую, без HTTP. Вопросы берутся из текстового файла
+(по вопросу на строку) или из размеченных кейсов xlsx со столбцами `Вопрос пользователя`, `Ответ из БЗ`,
+`Классификатор 1 уровня` и `Классификатор 2 уровня`, тогда считается и точность.
+Запросы идут через `get_answer` с фиксированным числом конкурентных запросов.
+Прогон `cold` начинается с пустыми кэшами, прогон `warm` повторяет вопросы с прогретыми.
+
+Запускается в окружении нужного пайплайна, по-умолчанию берёт данные и конфигурацию из репозитория:
+
+    python pipelines/evaluate.py --pipeline rag_ranker --cases data/cases.xlsx --concurrency 8
+    python pipelines/evaluate.py --pipeline faq --questions tests/questions.txt --runs warm
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import math
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+PIPELINES = ['rag_ranker', 'faq', 'faq_cases', 'baseline']
+
+DEFAULT_ENV = {
+    'KNOWLEDGE_BASE_FILE_PATH': ROOT / 'data' / 'knowledge_base.xlsx',
+    'CASES_FILE_PATH': ROOT / 'data' / 'cases.xlsx',
+    'REPLACEMENTS_FILE_PATH': ROOT / 'config' / 'replacements.json',
+}
+
+
+def read_questions(path: Path) -> List[Dict[str, Optional[str]]]:
+    with open(path, 'r', encoding='utf-8') as file:
+        return [{'question': line.strip()} for line in file if line.strip()]
+
+
+def read_cases(path: Path) -> List[Dict[str, Optional[str]]]:
+    import pandas as pd
+
+    def text(value) -> Optional[str]:
+        return None if pd.isna(value) else str(value).strip()
+
+    df = pd.read_excel(path)
+    return [
+        {
+            'question': text(row['Вопрос пользователя']),
+            'answer': text(row['Ответ из БЗ']),
+            'class_1': text(row['Классификатор 1 уровня']),
+            'class_2': text(row['Классификатор 2 уровня']),
+        }
+        for _, row in df.iterrows()
+        if text(row['Вопрос пользователя'])
+    ]
+
+
+def import_pipeline(name: str):
+    """
+    Импортирует `app.model` пайплайна без инициализации.
+    Рабочий каталог меняется на каталог пайплайна, чтобы кэши эмбеддингов и моделей были общими с сервисом.
+    """
+    for key, value in DEFAULT_ENV.items():
+        os.environ.setdefault(key, str(value))
+
+    pipeline_path = ROOT / 'pipelines' / name
+    sys.path.insert(0, str(pipeline_path))
+    os.chdir(pipeline_path)
+
+    return importlib.import_module('app.model')
+
+
+def load_pipeline(name: str):
+    """
+    Импортирует `app.model` пайплайна и выполняет его инициализацию.
+    """
+    model = import_pipeline(name)
+    try:
+        model.init()
+    except Exception:
+        sys.exit(f'Инициализация пайплайна завершилась ошибкой: {model.startup.error}')
+    return model
+
+
+def reset_caches(model) -> None:
+    """
+    Очищает кэши пайплайна в памяти: ответы, классификаторы и нормальные формы слов.
+    """
+    if hasattr(model, 'answer_cache'):
+        model.answer_cache.invalidate()
+    if hasattr(model, 'classifier'):
+        model.classifier.cache.invalidate()
+    if hasattr(model, 'normalizer'):
+        model.normalizer.lemma.cache_clear()
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, math.ceil(q * len(values)) - 1)]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 0.5),
+        'p95': percentile(values, 0.95),
+        'p99': percentile(values, 0.99),
+    }
+
+
+async def answer_all(model, cases: List[Dict[str, Optional[str]]], concurrency: int) -> Dict[str, Any]:
+    from app.tracing import start_trace
+
+    results: List[Optional[Any]] = [None] * len(cases)
+    traces: List[Dict[str, float]] = [{} for _ in cases]
+    errors = []
+    items = iter(enumerate(cases))
+
+    async def worker() -> None:
+        # Итератор общий: каждый воркер берёт следующий вопрос, пока они не закончатся
+        for position, case in items:
+            trace = start_trace()
+            started_at = time.perf_counter()
+            try:
+                results[position] = await model.get_answer(case['question'])
+            except Exception as exception:
+                errors.append(f'{case["question"]!r}: {exception}')
+            trace['total'] = (time.perf_counter() - started_at) * 1000
+            traces[position] = trace
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - started_at
+
+    stages = {}
+    for trace in traces:
+        for name, value in trace.items():
+            stages.setdefault(name, []).append(value)
+
+    report = {
+        'questions': len(cases),
+        'concurrency': concurrency,
+        'duration': duration,
+        'qps': len(cases) / duration,
+        'errors': len(errors),
+        'latency_ms': {name: summarize(values) for name, values in stages.items()},
+    }
+    for error in errors[:5]:
+        print(f'  error: {error}', file=sys.stderr)
+
+    labelled = [(case, result) for case, result in zip(cases, results) if case.get('answer') is not None]
+    if labelled:
+        report['accuracy'] = {
+            field: sum(
+                result is not None and (getattr(result, field) or '').strip() == (case[field] or '')
+                for case, result in labelled
+            ) / len(labelled)
+            for field in ('answer', 'class_1', 'class_2')
+        }
+    return report
+
+
+def print_report(run: str, report: Dict[str, Any]) -> None:
+    print(
+        f'\n[{run}] questions={report["questions"]} concurrency={report["concurrency"]} '
+        f'duration={report["duration"]:.2f}s qps={report["qps"]:.1f} errors={report["errors"]}'
+    )
+    print(f'{"stage":<12} {"count":>7} {"mean, ms":>10} {"p50, ms":>10} {"p95, ms":>10} {"p99, ms":>10}')
+    latency = report['latency_ms']
+    # Сначала общая задержка, затем стадии в порядке появления
+    for name in ['total'] + [name for name in latency if name != 'total']:
+        values = latency[name]
+        print(
+            f'{name:<12} {values["count"]:>7} {values["mean"]:>10.1f} {values["p50"]:>10.1f} '
+            f'{values["p95"]:>10.1f} {values["p99"]:>10.1f}'
+        )
+    if 'accuracy' in report:
+        accuracy = report['accuracy']
+        print(
+            f'accuracy: answer={accuracy["answer"]:.1%} '
+            f'class_1={accuracy["class_1"]:.1%} class_2={accuracy["class_2"]:.1%}'
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pipeline', choices=PIPELINES, default='rag_ranker')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--questions', type=Path, help='текстовый файл, по вопросу на строку')
+    source.add_argument('--cases', type=Path, help='размеченные кейсы xlsx, по-умолчанию data/cases.xlsx')
+    parser.add_argument('--limit', type=int, help='взять только первые N вопросов')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--runs', nargs='+', choices=['cold', 'warm'], default=['cold', 'warm'])
+    parser.add_argument('--output', type=Path, help='сохранить отчёт в JSON')
+    args = parser.parse_args()
+
+    # Пути из аргументов считаются от текущего каталога, до перехода в каталог пайплайна
+    if args.questions:
+        cases = read_questions(args.questions.resolve())
+    else:
+        cases = read_cases((args.cases or ROOT / 'data' / 'cases.xlsx').resolve())
+    cases = cases[:args.limit] if args.limit else cases
+    output = args.output.resolve() if args.output else None
+
+    model = load_pipeline(args.pipeline)
+    report = {'pipeline': args.pipeline, 'startup': model.startup.status()['stages'], 'runs': {}}
+    print(f'pipeline={args.pipeline} startup: ' + ' '.join(
+        f'{name}={stage["duration"]:.1f}s' for name, stage in report['startup'].items()
+    ))
+
+    for run in args.runs:
+        if run == 'cold':
+            reset_caches(model)
+        report['runs'][run] = asyncio.run(answer_all(model, cases, args.concurrency))
+        print_report(run, report['runs'][run])
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
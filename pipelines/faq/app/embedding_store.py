@@ -0,0 +1,179 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import List, Dict, Tuple
+
+import numpy as np
+from haystack import Document
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_CACHE_PATH = os.getenv('EMBEDDINGS_CACHE_PATH', 'embeddings')
+# Доля строк удалённых документов, после которой сегменты переписываются в один
+EMBEDDINGS_COMPACT_RATIO = float(os.getenv('EMBEDDINGS_COMPACT_RATIO', '0.25'))
+# Число сегментов, после которого они переписываются в один
+EMBEDDINGS_MAX_SEGMENTS = int(os.getenv('EMBEDDINGS_MAX_SEGMENTS', '16'))
+
+SEGMENT_PATTERN = re.compile(r'^(\d+)\.(\d+)\.npy$')
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256((content or '').encode('utf-8')).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Дисковое хранилище эмбеддингов документов.
+
+    Для каждой модели хранятся сегменты: матрица эмбеддингов (`<номер>.<pid>.npy`, открывается через memory-map)
+    и список хэшей содержимого документов (`<номер>.<pid>.json`), соответствующих строкам матрицы.
+    Новые эмбеддинги дописываются отдельным сегментом, существующие файлы не переписываются,
+    поэтому при перезапуске и перезагрузке эмбеддятся и пишутся на диск лишь новые или изменённые документы.
+    Когда строк удалённых документов становится больше доли `compact_ratio` или сегментов больше
+    `max_segments`, живые строки переписываются в один сегмент, а старые сегменты удаляются.
+    """
+
+    def __init__(
+            self,
+            model: str,
+            path: str = EMBEDDINGS_CACHE_PATH,
+            compact_ratio: float = EMBEDDINGS_COMPACT_RATIO,
+            max_segments: int = EMBEDDINGS_MAX_SEGMENTS,
+    ):
+        self.model = model
+        self.path = os.path.join(path, re.sub(r'[^\w.-]+', '_', model))
+        self.compact_ratio = compact_ratio
+        self.max_segments = max_segments
+        self.segments: List[Tuple[str, np.ndarray, List[str]]] = []
+        self.rows: Dict[str, Tuple[int, int]] = {}
+        self._load()
+
+    def _segment_names(self) -> List[str]:
+        if not os.path.isdir(self.path):
+            return []
+        names = []
+        for file_name in os.listdir(self.path):
+            match = SEGMENT_PATTERN.match(file_name)
+            if match:
+                names.append((int(match.group(1)), file_name[:-len('.npy')]))
+        return [name for _, name in sorted(names)]
+
+    def _load(self) -> None:
+        self.segments = []
+        self.rows = {}
+        for name in self._segment_names():
+            ids_path = os.path.join(self.path, name + '.json')
+            if not os.path.exists(ids_path):
+                # Матрица пишется раньше списка хэшей: сегмент без списка не дописан
+                continue
+            try:
+                matrix = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+                with open(ids_path, 'r', encoding='utf-8') as file:
+                    ids = json.load(file)
+            except (OSError, ValueError) as exception:
+                logger.warning(f'embeddings segment is broken, skipping: path="{self.path}" segment="{name}" '
+                               f'error="{exception}"')
+                continue
+            size = min(len(ids), matrix.shape[0])
+            segment = len(self.segments)
+            self.segments.append((name, matrix[:size], ids[:size]))
+            for row, doc_hash in enumerate(ids[:size]):
+                self.rows.setdefault(doc_hash, (segment, row))
+
+    def _next_name(self) -> str:
+        names = self._segment_names()
+        number = int(names[-1].split('.')[0]) + 1 if names else 0
+        return f'{number:06d}.{os.getpid()}'
+
+    def _write_segment(self, ids: List[str], embeddings: np.ndarray) -> str:
+        os.makedirs(self.path, exist_ok=True)
+        name = self._next_name()
+        suffix = '.tmp'
+        matrix_path = os.path.join(self.path, name + '.npy')
+        ids_path = os.path.join(self.path, name + '.json')
+        with open(matrix_path + suffix, 'wb') as file:
+            np.save(file, embeddings)
+        os.replace(matrix_path + suffix, matrix_path)
+        with open(ids_path + suffix, 'w', encoding='utf-8') as file:
+            json.dump(ids, file)
+        os.replace(ids_path + suffix, ids_path)
+        return name
+
+    def _remove_segment(self, name: str) -> None:
+        # Удаление, а не перезапись: уже открытые отображения файлов остаются рабочими
+        for extension in ('.json', '.npy'):
+            try:
+                os.remove(os.path.join(self.path, name + extension))
+            except FileNotFoundError:
+                pass
+
+    def embedding(self, doc_hash: str) -> np.ndarray:
+        segment, row = self.rows[doc_hash]
+        return self.segments[segment][1][row]
+
+    def compact(self, live: List[str]) -> None:
+        """
+        Переписывает эмбеддинги документов `live` в один сегмент и удаляет остальные сегменты.
+        """
+        live = [doc_hash for doc_hash in dict.fromkeys(live) if doc_hash in self.rows]
+        old = [name for name, _, _ in self.segments]
+        embeddings = np.asarray([self.embedding(doc_hash) for doc_hash in live], dtype=np.float32)
+        if live:
+            self._write_segment(live, embeddings)
+        for name in old:
+            self._remove_segment(name)
+        logger.info(f'embeddings cache compacted: model="{self.model}" segments={len(old)} rows={len(live)}')
+        self._load()
+
+    def embed_documents(self, docs: List[Document], doc_embedder) -> List[Document]:
+        """
+        Проставляет документам эмбеддинги из хранилища, досчитывая недостающие.
+
+        Параметры:
+        - docs (List[Document]): Документы для эмбеддинга.
+        - doc_embedder: Эмбеддер документов, прогревается только если есть что досчитать.
+
+        Возвращает:
+        - List[Document]: Те же документы с заполненным полем embedding.
+        """
+        hashes = [content_hash(doc.content) for doc in docs]
+
+        missing: Dict[str, Document] = {}
+        for doc_hash, doc in zip(hashes, docs):
+            if doc_hash not in self.rows and doc_hash not in missing:
+                missing[doc_hash] = Document(content=doc.content)
+
+        logger.info(f'embeddings cache: model="{self.model}" cached={len(docs) - len(missing)} missing={len(missing)}')
+
+        if missing:
+            doc_embedder.warm_up()
+            embedded = doc_embedder.run(list(missing.values()))['documents']
+            embeddings = np.asarray([doc.embedding for doc in embedded], dtype=np.float32)
+            self._write_segment(list(missing.keys()), embeddings)
+            self._load()
+
+        total = sum(len(ids) for _, _, ids in self.segments)
+        stale = total - len(set(hashes))
+        if stale > total * self.compact_ratio or len(self.segments) > self.max_segments:
+            self.compact(hashes)
+
+        for doc_hash, doc in zip(hashes, docs):
+            doc.embedding = self.embedding(doc_hash).tolist()
+
+        return docs
@@ -1,18 +1,24 @@
 import asyncio
-import json
 import os
-import re
 import warnings
+from typing import Optional
 
 import pandas as pd
-import pymorphy2
-from haystack import Document, Pipeline
+from haystack import Document
 from haystack.components.embedders import SentenceTransformersDocumentEmbedder, SentenceTransformersTextEmbedder
 from haystack.components.retrievers.in_memory import InMemoryEmbeddingRetriever
 from haystack.document_stores.in_memory import InMemoryDocumentStore
-from haystack.utils import ComponentDevice
 from pydantic import BaseModel
 
+from app.answers import AnswerTable
+from app.cache import AnswerCache
+from app.embedding_store import EmbeddingStore, content_hash
+from app.inference import embedding_key, get_device, setup_backend
+from app.normalizer import Normalizer
+from app.reload import KnowledgeIndex, Reloader
+from app.startup import Startup
+from app.tracing import stage
+
 NO_ANSWER = "Ответ не найден."
 
 # Отключение предупреждений
@@ -21,79 +27,171 @@ warnings.filterwarnings('ignore')
 # Путь к файлу базы знаний из переменной окружения
 KNOWLEDGE_BASE_FILE_PATH = os.getenv('KNOWLEDGE_BASE_FILE_PATH')
 
-# Загрузка базы знаний
-df = pd.read_excel(KNOWLEDGE_BASE_FILE_PATH)
-# Преобразование данных из DataFrame в список документов
-docs = [Document(content=row['Вопрос из БЗ'], meta={"url": ""}) for _, row in df.iterrows()]
+# Загрузка замен слов на их эквиваленты из файла
+REPLACEMENTS_FILE_PATH = os.getenv('REPLACEMENTS_FILE_PATH')
+normalizer = Normalizer.from_file(REPLACEMENTS_FILE_PATH)
 
-# Настройка устройства и модели для эмбеддинга
-device = ComponentDevice.from_str("cuda:0")
+# Модель для эмбеддинга
 embed_model = "intfloat/e5-large-v2"
 
-# Инициализация эмбеддера для документов
-doc_embedder = SentenceTransformersDocumentEmbedder(model=embed_model, device=device)
-doc_embedder.warm_up()  # Прогрев модели
+# Состояние фоновой инициализации
+startup = Startup()
 
-# Инициализация хранилища документов
-document_store = InMemoryDocumentStore()
-docs_with_embeddings = doc_embedder.run(docs)
-unique_docs = {doc.id: doc for doc in docs_with_embeddings["documents"]}.values()
-document_store.write_documents(list(unique_docs))
+# Заполняются стадиями фоновой инициализации, см. init()
+device = None
+doc_embedder: Optional[SentenceTransformersDocumentEmbedder] = None
+text_embedder: Optional[SentenceTransformersTextEmbedder] = None
+# Текущая версия индекса, подменяется целиком при перезагрузке базы знаний
+knowledge_index: Optional[KnowledgeIndex] = None
 
-# Настройка эмбеддера текста и извлекателя
-text_embedder = SentenceTransformersTextEmbedder(model=embed_model, device=device)
-retriever = InMemoryEmbeddingRetriever(document_store, top_k=1)
+# Кэш ответов по нормализованному вопросу
+answer_cache = AnswerCache()
 
-# Создание и настройка RAG pipeline
-basic_rag_pipeline = Pipeline()
-basic_rag_pipeline.add_component("text_embedder", text_embedder)
-basic_rag_pipeline.add_component("retriever", retriever)
-basic_rag_pipeline.connect("text_embedder.embedding", "retriever.query_embedding")
 
-# Загрузка замен слов на их эквиваленты из файла
-REPLACEMENTS_FILE_PATH = os.getenv('REPLACEMENTS_FILE_PATH')
-with open(REPLACEMENTS_FILE_PATH, 'r', encoding='utf-8') as file:
-    replace_dict = json.load(file)
+def load_knowledge_base() -> pd.DataFrame:
+    # Загрузка базы знаний
+    return pd.read_excel(KNOWLEDGE_BASE_FILE_PATH)
+
+
+def load_models() -> None:
+    global device, doc_embedder, text_embedder
+
+    # Настройка устройства
+    device = get_device()
+
+    # Инициализация эмбеддеров для документов и вопросов
+    doc_embedder = SentenceTransformersDocumentEmbedder(model=embed_model, device=device)
+    text_embedder = SentenceTransformersTextEmbedder(model=embed_model, device=device)
+    # Подключение бэкенда инференса (torch или onnx) до прогрева моделей
+    setup_backend([doc_embedder, text_embedder], device=device)
+    text_embedder.warm_up()
+    # Словари pymorphy2 загружаются один раз на процесс
+    normalizer.warm_up()
+
+
+def build_index(version: str) -> KnowledgeIndex:
+    """
+    Собирает новую версию индекса по файлу базы знаний, не трогая текущую.
+    """
+    df = load_knowledge_base()
+    # Преобразование данных из DataFrame в список документов
+    docs = [Document(content=row['Вопрос из БЗ'], meta={"idx": index}) for index, row in df.iterrows()]
+
+    # Дисковый кэш эмбеддингов, эмбеддятся только новые и изменённые вопросы
+    embedding_store = EmbeddingStore(embedding_key(embed_model))
+
+    # Инициализация хранилища документов
+    document_store = InMemoryDocumentStore()
+    docs_with_embeddings = embedding_store.embed_documents(docs, doc_embedder)
+    unique_docs = list({doc.id: doc for doc in docs_with_embeddings}.values())
+    document_store.write_documents(unique_docs)
+
+    return KnowledgeIndex(
+        version=version,
+        # Таблица ответов с доступом по индексу документа
+        answer_table=AnswerTable(df, 'Вопрос из БЗ'),
+        document_store=document_store,
+        # Настройка извлекателя
+        retriever=InMemoryEmbeddingRetriever(document_store, top_k=1),
+        hashes=frozenset(content_hash(doc.content) for doc in unique_docs),
+    )
+
+
+def swap_index(index: KnowledgeIndex) -> None:
+    global knowledge_index
+
+    knowledge_index = index
+    answer_cache.invalidate()
+
+
+reloader = Reloader([KNOWLEDGE_BASE_FILE_PATH], build_index, swap_index)
+
+
+def init() -> None:
+    """
+    Инициализация пайплайна по стадиям: загрузка моделей, чтение базы знаний и эмбеддинг документов.
+    Выполняется в фоне после старта сервиса.
+    """
+    startup.run([
+        ("models", load_models),
+        ("index", lambda: reloader.reload(force=True)),
+    ])
+    reloader.watch()
 
 
-def get_answer_from_rag(question: str, rag_pipeline, dataframe: pd.DataFrame = df):
+def get_answer_from_rag(question: str, index: Optional[KnowledgeIndex] = None):
     """
-    Обрабатывает вопрос, приводит его к нормализованной форме, заменяет слова и ищет ответ в RAG pipeline.
+    Обрабатывает вопрос, приводит его к нормализованной форме, заменяет слова и ищет ответ в индексе.
 
     Параметры:
     - question (str): Вопрос для поиска.
-    - basic_rag_pipeline: RAG pipeline для поиска.
-    - df (pd.DataFrame, optional): DataFrame с базой знаний.
+    - index (KnowledgeIndex, optional): Версия индекса, по умолчанию текущая.
 
     Возвращает:
     - Tuple[str, str, str]: Ответ и классификаторы. Если ответ не найден, возвращает "Ответ не найден." и пустые строки.
     """
-    morph = pymorphy2.MorphAnalyzer()
+    return search_answer(preprocess_question(question), index)
 
-    # Преобразование вопроса к нижнему регистру и удаление знаков препинания
-    question = re.sub(r'[^\w\s-]', '', question.lower())
 
-    # Замена слов на основании словаря
-    words = question.split()
-    replaced_words = [replace_dict.get(morph.parse(word)[0].normal_form, word) for word in words]
-    question = ' '.join(replaced_words)
+def preprocess_question(question: str) -> str:
+    """
+    Приводит вопрос к нормализованной форме: нижний регистр, без знаков препинания, с заменой слов по словарю.
+    """
+    return normalizer.normalize_question(question)
+
+
+def embed_texts(texts: list[str]) -> list[list[float]]:
+    """
+    Батчевый аналог text_embedder.run: один прямой проход модели на весь список вопросов.
+    """
+    return text_embedder.embedding_backend.embed(
+        [text_embedder.prefix + text + text_embedder.suffix for text in texts],
+        batch_size=text_embedder.batch_size,
+        show_progress_bar=False,
+        normalize_embeddings=text_embedder.normalize_embeddings,
+        precision=text_embedder.precision,
+    )
+
+
+def search_answer(question: str, index: Optional[KnowledgeIndex] = None):
+    """
+    Ищет ответ на нормализованный вопрос в версии индекса.
+    """
+    index = knowledge_index if index is None else index
+    documents = search_documents(question, index)
+    with stage("lookup"):
+        return answer_from_documents(documents, index)
 
-    # Запуск поиска в RAG pipeline
-    response = rag_pipeline.run({"text_embedder": {"text": question}})
 
+def search_documents(question: str, index: KnowledgeIndex) -> list[Document]:
+    """
+    Эмбеддит нормализованный вопрос и ищет ближайшие документы в версии индекса.
+    """
+    with stage("embed"):
+        embedding = text_embedder.run(text=question)['embedding']
+    with stage("retrieve"):
+        return index.retriever.run(query_embedding=embedding)['documents']
+
+
+def top_score(documents: list[Document]) -> Optional[float]:
+    # Оценка близости ближайшего документа, по ней шлюз сравнивает уверенность пайплайнов
+    return documents[0].score if documents else None
+
+
+def answer_from_documents(documents: list[Document], index: KnowledgeIndex):
+    """
+    Возвращает ответ и классификаторы по найденным ретривером документам.
+    """
     try:
-        # Получение текста вопроса из RAG pipeline
-        target_q = response['retriever']['documents'][0].content
+        # Получение индекса найденного вопроса
+        target_idx = documents[0].meta['idx']
     except (IndexError, KeyError):
         return "Документы не найдены в ответе RAG pipeline.", "", ""
 
     try:
         # Поиск ответа в базе знаний
-        target_answer = dataframe.loc[dataframe['Вопрос из БЗ'] == target_q].iloc[0]
-        return target_answer['Ответ из БЗ'], \
-            target_answer['Классификатор 1 уровня'], \
-            target_answer['Классификатор 2 уровня']
-    except IndexError:
+        return index.answer_table.get(target_idx)
+    except KeyError:
         return NO_ANSWER, "", ""
 
 
@@ -101,14 +199,53 @@ class Answer(BaseModel):
     answer: str
     class_1: str
     class_2: str
+    score: Optional[float] = None
 
 
 async def get_answer(question: str) -> Answer:
-    loop = asyncio.get_event_loop()
-    answer_text, class_1, class_2 = await loop.run_in_executor(
-        None,
-        get_answer_from_rag,
-        question,
-        basic_rag_pipeline,
-    )
-    return Answer(answer=answer_text, class_1=class_1 or "", class_2=class_2 or "")
+    # asyncio.to_thread переносит контекст запроса в поток, стадии попадают в его трассировку
+    with stage("preprocess"):
+        question = await asyncio.to_thread(preprocess_question, question)
+    # Версия индекса фиксируется на весь запрос, перезагрузка базы знаний его не задевает
+    index = knowledge_index
+    cache_key = (index.version, question)
+
+    cached_answer = answer_cache.get(cache_key)
+    if cached_answer is not None:
+        return cached_answer
+
+    documents = await asyncio.to_thread(search_documents, question, index)
+    with stage("lookup"):
+        answer_text, class_1, class_2 = answer_from_documents(documents, index)
+    answer = Answer(answer=answer_text, class_1=class_1 or "", class_2=class_2 or "", score=top_score(documents))
+    answer_cache.put(cache_key, answer)
+    return answer
+
+
+def answer_batch(questions: list[str]) -> list[Answer]:
+    """
+    Синхронный батчевый аналог get_answer для офлайн-прогонов и пакетной обработки:
+    новые вопросы эмбеддятся одним вызовом модели, повторы и ответы из кэша повторно не считаются.
+    """
+    # Версия индекса фиксируется на весь батч
+    index = knowledge_index
+    texts = [preprocess_question(question) for question in questions]
+
+    answers = {}
+    for text in dict.fromkeys(texts):
+        cached_answer = answer_cache.get((index.version, text))
+        if cached_answer is not None:
+            answers[text] = cached_answer
+    missing = [text for text in dict.fromkeys(texts) if text not in answers]
+
+    if missing:
+        for text, embedding in zip(missing, embed_texts(missing)):
+            documents = index.retriever.run(query_embedding=embedding)['documents']
+            answer_text, class_1, class_2 = answer_from_documents(documents, index)
+            answer = Answer(
+                answer=answer_text, class_1=class_1 or "", class_2=class_2 or "", score=top_score(documents)
+            )
+            answer_cache.put((index.version, text), answer)
+            answers[text] = answer
+
+    return [answers[text] for text in texts]
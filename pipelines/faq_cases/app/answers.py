@@ -0,0 +1,54 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from typing import Dict, Hashable, Tuple
+
+import pandas as pd
+
+ANSWER_COLUMN = 'Ответ из БЗ'
+CLASS_1_COLUMN = 'Классификатор 1 уровня'
+CLASS_2_COLUMN = 'Классификатор 2 уровня'
+
+
+class AnswerTable:
+    """
+    Предрассчитанная таблица ответов с доступом по индексу документа (meta["idx"]).
+
+    Если один и тот же текст вопроса встречается в нескольких строках с разными ответами,
+    все такие строки указывают на первую из них, как и прежний поиск `df.loc[...].iloc[0]`.
+    Поэтому ответ не зависит от того, какой из одинаковых документов вернул поиск.
+    """
+
+    def __init__(self, df: pd.DataFrame, question_column: str):
+        first_rows: Dict[str, Hashable] = {}
+        rows = dict(zip(df.index, zip(df[ANSWER_COLUMN], df[CLASS_1_COLUMN], df[CLASS_2_COLUMN])))
+
+        self.answers: Dict[Hashable, Tuple[str, str, str]] = {}
+        for idx, question in zip(df.index, df[question_column]):
+            self.answers[idx] = rows[first_rows.setdefault(question, idx)]
+
+    def __len__(self) -> int:
+        return len(self.answers)
+
+    def get(self, idx: Hashable) -> Tuple[str, str, str]:
+        """
+        Возвращает ответ и классификаторы по индексу документа.
+
+        Параметры:
+        - idx (Hashable): Индекс строки, сохранённый в meta документа.
+
+        Возвращает:
+        - Tuple[str, str, str]: Ответ, классификатор 1 уровня и классификатор 2 уровня.
+        """
+        return self.answers[idx]
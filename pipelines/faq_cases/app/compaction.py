@@ -0,0 +1,111 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+import os
+import re
+from collections import defaultdict
+from typing import Dict, Hashable, List, Tuple
+
+import numpy as np
+from haystack import Document
+
+from app.answers import AnswerTable
+
+logger = logging.getLogger(__name__)
+
+COMPACTION_SIMILARITY = float(os.getenv('COMPACTION_SIMILARITY', '0.98'))
+
+
+def normalize_text(text: str) -> str:
+    """
+    Нормализация для поиска точных дублей: нижний регистр, без знаков препинания и лишних пробелов.
+    """
+    return ' '.join(re.sub(r'[^\w\s]', ' ', (text or '').lower()).split())
+
+
+def drop_exact_duplicates(docs: List[Document], answers: AnswerTable) -> Tuple[List[Document], int]:
+    """
+    Оставляет по одному документу на нормализованный текст и ответ, до эмбеддинга.
+
+    Одинаковые после нормализации вопросы с разными ответами или классификаторами остаются
+    отдельными документами, чтобы ни один ответ не пропал из индекса. Из дублей с одним ответом
+    остаётся первый.
+
+    Возвращает:
+    - Tuple[List[Document], int]: Документы без дублей и число отброшенных.
+    """
+    seen = set()
+    unique = []
+    for doc in docs:
+        key = normalize_text(doc.content), answer_key(answers, doc.meta['idx'])
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(doc)
+    return unique, len(docs) - len(unique)
+
+
+def merge_near_duplicates(
+        docs: List[Document],
+        answers: AnswerTable,
+        similarity: float = COMPACTION_SIMILARITY,
+) -> Tuple[List[Document], int]:
+    """
+    Склеивает почти одинаковые документы с одним и тем же ответом в один, после эмбеддинга.
+
+    Внутри группы документов с одинаковым ответом и классификаторами документ присоединяется
+    к первому лидеру, косинусная близость с которым не меньше `similarity`, иначе сам становится лидером.
+    Лидер - первый по порядку документ, то есть вопрос из БЗ раньше пользовательских формулировок,
+    его текст и вектор остаются в индексе. Документы с разными ответами не склеиваются никогда,
+    поэтому ответ на любой вопрос, попавший в кластер, не меняется.
+
+    Возвращает:
+    - Tuple[List[Document], int]: Лидеры кластеров в исходном порядке и число склеенных документов.
+    """
+    if similarity > 1 or len(docs) < 2:
+        return docs, 0
+
+    groups: Dict[Tuple[str, str, str], List[int]] = defaultdict(list)
+    for position, doc in enumerate(docs):
+        groups[answer_key(answers, doc.meta['idx'])].append(position)
+
+    matrix = np.asarray([doc.embedding for doc in docs], dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    leaders = []
+    for positions in groups.values():
+        group_leaders: List[int] = []
+        for position in positions:
+            if group_leaders:
+                scores = matrix[group_leaders] @ matrix[position]
+                if scores.max() >= similarity:
+                    continue
+            group_leaders.append(position)
+        leaders.extend(group_leaders)
+
+    leaders.sort()
+    return [docs[position] for position in leaders], len(docs) - len(leaders)
+
+
+def answer_key(answers: AnswerTable, idx: Hashable) -> Tuple[str, str, str]:
+    return tuple(str(value) for value in answers.get(idx))
+
+
+def log_compaction(total: int, exact: int, near: int) -> Dict[str, int]:
+    stats = {'documents': total, 'exact_duplicates': exact, 'near_duplicates': near, 'indexed': total - exact - near}
+    logger.info(
+        f'compaction: documents={total} exact_duplicates={exact} near_duplicates={near} indexed={stats["indexed"]}'
+    )
+    return stats
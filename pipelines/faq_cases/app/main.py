@@ -1,11 +1,16 @@
+import asyncio
 import logging
 import sys
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from app.model import get_answer, Answer
+from app.model import get_answer, answer_batch, Answer, answer_cache, init, normalizer, reloader, startup
+from app.streaming import BatchRequest, NDJSON_MEDIA_TYPE, stream_answers
+from app.telemetry import CONTENT_TYPE, TrackedExecutor, register_caches, render, track_request
+from app.tracing import RequestTracing
 
 logging.basicConfig(
     level=logging.INFO,
@@ -14,6 +19,11 @@ logging.basicConfig(
 )
 
 app = FastAPI()
+app.middleware("http")(track_request)
+app.middleware("http")(RequestTracing())
+
+# Общий пул потоков для asyncio.to_thread и run_in_executor с учётом очереди задач
+default_executor = TrackedExecutor('default')
 
 
 @app.get("/")
@@ -21,14 +31,78 @@ async def root():
     return {"status": "UP"}
 
 
+@app.get("/health/live")
+async def live(response: Response):
+    if startup.failed:
+        response.status_code = 503
+        return {"status": "DOWN", "error": startup.error}
+    return {"status": "UP"}
+
+
+@app.get("/health/ready")
+async def ready(response: Response):
+    if not startup.ready:
+        response.status_code = 503
+    return startup.status()
+
+
+def ensure_ready() -> None:
+    if not startup.ready:
+        raise HTTPException(status_code=503, detail="Пайплайн ещё инициализируется")
+
+
 class QuestionRequest(BaseModel):
     question: str
 
 
-@app.post("/api/answers", response_model=Answer)
+@app.get("/stats")
+async def stats():
+    return {"answer_cache": answer_cache.stats(), "normalizer": normalizer.stats()}
+
+
+@app.get("/index")
+async def index_status():
+    return reloader.status()
+
+
+@app.post("/index/reload", dependencies=[Depends(ensure_ready)])
+async def reload_index(force: bool = False):
+    # Новый индекс собирается в фоне рядом с текущим, запросы продолжают обслуживаться
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, reloader.reload, force)
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=f"Не удалось перезагрузить базу знаний: {exception}")
+
+
+@app.post("/api/answers", response_model=Answer, dependencies=[Depends(ensure_ready)])
 async def ask(request: QuestionRequest) -> Answer:
     return await get_answer(request.question)
 
 
+@app.post("/api/answers/batch", dependencies=[Depends(ensure_ready)])
+async def ask_batch(request: BatchRequest) -> StreamingResponse:
+    # Ответы уходят построчно в NDJSON по мере готовности батчей
+    return StreamingResponse(stream_answers(request.questions, answer_batch), media_type=NDJSON_MEDIA_TYPE)
+
+
+# Метрики Prometheus по статистике компонентов, считываются при каждом сборе
+register_caches('pipeline', lambda: {
+    'answer': (answer_cache.hits, answer_cache.misses),
+    'lemma': normalizer.lemma.cache_info()[:2],
+})
+
+
+@app.get("/metrics")
+async def prometheus_metrics() -> Response:
+    return Response(render(), media_type=CONTENT_TYPE)
+
+
+@app.on_event("startup")
+async def startup_event():
+    asyncio.get_running_loop().set_default_executor(default_executor)
+    # Модели загружаются в фоне, чтобы сервис сразу отвечал на проверки живости и готовности
+    app.state.init_task = asyncio.get_running_loop().run_in_executor(None, init)
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8082)
@@ -1,21 +1,28 @@
 import asyncio
-import json
 import os
-import re
 import warnings
+from typing import Optional
 
 import pandas as pd
-import pymorphy2
-from haystack import Document, Pipeline
+from haystack import Document
 from haystack.components.embedders import (
     SentenceTransformersDocumentEmbedder,
     SentenceTransformersTextEmbedder,
 )
 from haystack.components.retrievers.in_memory import InMemoryEmbeddingRetriever
 from haystack.document_stores.in_memory import InMemoryDocumentStore
-from haystack.utils import ComponentDevice
 from pydantic import BaseModel
 
+from app.answers import AnswerTable
+from app.cache import AnswerCache
+from app.compaction import drop_exact_duplicates, log_compaction, merge_near_duplicates
+from app.embedding_store import EmbeddingStore, content_hash
+from app.inference import embedding_key, get_device, setup_backend
+from app.normalizer import Normalizer
+from app.reload import KnowledgeIndex, Reloader
+from app.startup import Startup
+from app.tracing import stage
+
 NO_ANSWER = "Ответ не найден."
 
 warnings.filterwarnings('ignore')
@@ -24,81 +31,170 @@ warnings.filterwarnings('ignore')
 KNOWLEDGE_BASE_FILE_PATH = os.getenv('KNOWLEDGE_BASE_FILE_PATH')
 CASES_FILE_PATH = os.getenv('CASES_FILE_PATH')
 
-# Загрузка данных из файлов
-df_base = pd.read_excel(KNOWLEDGE_BASE_FILE_PATH)
-df_case = pd.read_excel(CASES_FILE_PATH)
+# Загрузка замен слов на их эквиваленты из файла
+REPLACEMENTS_FILE_PATH = os.getenv('REPLACEMENTS_FILE_PATH')
+normalizer = Normalizer.from_file(REPLACEMENTS_FILE_PATH)
 
-# Объединение вопросов из БЗ и пользовательских вопросов в один столбец
-combined_column = pd.concat([df_base['Вопрос из БЗ'], df_case['Вопрос пользователя']], ignore_index=True)
+embed_model = "intfloat/e5-large-v2"
 
-# Объединение остальных данных и создание итогового DataFrame
-df_base_rest = df_base.drop(columns=['Вопрос из БЗ'])
-df_case_rest = df_case.drop(columns=['Вопрос пользователя'])
-combined_rest = pd.concat([df_base_rest, df_case_rest], ignore_index=True)
-final_df = combined_rest.copy()
-final_df['Вопрос'] = combined_column
-final_df = final_df[['Вопрос'] + [col for col in final_df.columns if col != 'Вопрос']]
-final_df = final_df.drop(columns=["Тема"])
+startup = Startup()
 
-# Создание документов для RAG pipeline
-docs = [Document(content=row["Вопрос"], meta={"idx": index}) for index, row in final_df.iterrows()]
+# Заполняются стадиями фоновой инициализации, см. init()
+device = None
+doc_embedder: Optional[SentenceTransformersDocumentEmbedder] = None
+text_embedder: Optional[SentenceTransformersTextEmbedder] = None
+# Текущая версия индекса, подменяется целиком при перезагрузке базы знаний
+knowledge_index: Optional[KnowledgeIndex] = None
 
-# Настройка устройства и моделей эмбеддинга
-device = ComponentDevice.from_str("cuda:0")
-embed_model = "intfloat/e5-large-v2"
-doc_embedder = SentenceTransformersDocumentEmbedder(model=embed_model, device=device)
-doc_embedder.warm_up()
-document_store = InMemoryDocumentStore()
-docs_with_embeddings = doc_embedder.run(docs)
-unique_docs = {doc.id: doc for doc in docs_with_embeddings["documents"]}.values()
-document_store.write_documents(list(unique_docs))
-
-# Настройка RAG pipeline
-text_embedder = SentenceTransformersTextEmbedder(model=embed_model, device=device)
-retriever = InMemoryEmbeddingRetriever(document_store, top_k=1)
-basic_rag_pipeline = Pipeline()
-basic_rag_pipeline.add_component("text_embedder", text_embedder)
-basic_rag_pipeline.add_component("retriever", retriever)
-basic_rag_pipeline.connect("text_embedder.embedding", "retriever.query_embedding")
+answer_cache = AnswerCache()
 
-# Загрузка замен слов на их эквиваленты из файла
-REPLACEMENTS_FILE_PATH = os.getenv('REPLACEMENTS_FILE_PATH')
-with open(REPLACEMENTS_FILE_PATH, 'r', encoding='utf-8') as file:
-    replace_dict = json.load(file)
 
+def load_knowledge_base() -> pd.DataFrame:
+    # Загрузка данных из файлов
+    df_base = pd.read_excel(KNOWLEDGE_BASE_FILE_PATH)
+    df_case = pd.read_excel(CASES_FILE_PATH)
 
-def get_answer_from_rag(question: str, rag_pipeline, df: pd.DataFrame = final_df):
+    # Объединение вопросов из БЗ и пользовательских вопросов в один столбец
+    combined_column = pd.concat([df_base['Вопрос из БЗ'], df_case['Вопрос пользователя']], ignore_index=True)
+
+    # Объединение остальных данных и создание итогового DataFrame
+    df_base_rest = df_base.drop(columns=['Вопрос из БЗ'])
+    df_case_rest = df_case.drop(columns=['Вопрос пользователя'])
+    combined_rest = pd.concat([df_base_rest, df_case_rest], ignore_index=True)
+    final_df = combined_rest.copy()
+    final_df['Вопрос'] = combined_column
+    final_df = final_df[['Вопрос'] + [col for col in final_df.columns if col != 'Вопрос']]
+    return final_df.drop(columns=["Тема"])
+
+
+def load_models() -> None:
+    global device, doc_embedder, text_embedder
+
+    # Настройка устройства и моделей эмбеддинга
+    device = get_device()
+    doc_embedder = SentenceTransformersDocumentEmbedder(model=embed_model, device=device)
+    text_embedder = SentenceTransformersTextEmbedder(model=embed_model, device=device)
+    setup_backend([doc_embedder, text_embedder], device=device)
+    text_embedder.warm_up()
+    # Словари pymorphy2 загружаются один раз на процесс
+    normalizer.warm_up()
+
+
+def build_index(version: str) -> KnowledgeIndex:
     """
-    Обрабатывает вопрос, заменяет слова по словарю, запускает поиск через RAG pipeline и возвращает ответ.
+    Собирает новую версию индекса по файлам базы знаний и кейсов, не трогая текущую.
     """
-    morph = pymorphy2.MorphAnalyzer()
+    final_df = load_knowledge_base()
+    answer_table = AnswerTable(final_df, 'Вопрос')
+    docs = [Document(content=row["Вопрос"], meta={"idx": index}) for index, row in final_df.iterrows()]
+
+    # Компакция: точные дубли отбрасываются до эмбеддинга, почти дубли с тем же ответом склеиваются после
+    docs, exact_duplicates = drop_exact_duplicates(docs, answer_table)
+    embedding_store = EmbeddingStore(embedding_key(embed_model))
+    docs_with_embeddings = embedding_store.embed_documents(docs, doc_embedder)
+    unique_docs, near_duplicates = merge_near_duplicates(docs_with_embeddings, answer_table)
+    compaction = log_compaction(len(final_df), exact_duplicates, near_duplicates)
 
-    # Приведение вопроса к нижнему регистру и удаление знаков препинания
-    question = question.lower()
-    question = re.sub(r'[^\w\s-]', '', question)
+    document_store = InMemoryDocumentStore()
+    document_store.write_documents(unique_docs)
 
-    # Замена слов на основе словаря
-    if replace_dict:
-        words = question.split()
-        replaced_words = [replace_dict.get(morph.parse(word)[0].normal_form, word) for word in words]
-        question = ' '.join(replaced_words)
+    return KnowledgeIndex(
+        version=version,
+        answer_table=answer_table,
+        document_store=document_store,
+        retriever=InMemoryEmbeddingRetriever(document_store, top_k=1),
+        hashes=frozenset(content_hash(doc.content) for doc in unique_docs),
+        stats={'compaction': compaction},
+    )
 
-    print(f"Processed question: {question}")
 
-    # Запуск RAG pipeline для поиска ответа
-    response = rag_pipeline.run({"text_embedder": {"text": question}})
+def swap_index(index: KnowledgeIndex) -> None:
+    global knowledge_index
 
+    knowledge_index = index
+    answer_cache.invalidate()
+
+
+reloader = Reloader([KNOWLEDGE_BASE_FILE_PATH, CASES_FILE_PATH], build_index, swap_index)
+
+
+def init() -> None:
+    """
+    Инициализация пайплайна по стадиям: загрузка моделей, чтение базы знаний и кейсов, эмбеддинг документов.
+    Выполняется в фоне после старта сервиса.
+    """
+    startup.run([
+        ("models", load_models),
+        ("index", lambda: reloader.reload(force=True)),
+    ])
+    reloader.watch()
+
+
+def get_answer_from_rag(question: str, index: Optional[KnowledgeIndex] = None):
+    """
+    Обрабатывает вопрос, заменяет слова по словарю, запускает поиск по индексу и возвращает ответ.
+    """
+    return search_answer(preprocess_question(question), index)
+
+
+def preprocess_question(question: str) -> str:
+    """
+    Приводит вопрос к нижнему регистру, удаляет знаки препинания и заменяет слова по словарю.
+    """
+    return normalizer.normalize_question(question)
+
+
+def embed_texts(texts: list[str]) -> list[list[float]]:
+    """
+    Батчевый аналог text_embedder.run: один прямой проход модели на весь список вопросов.
+    """
+    return text_embedder.embedding_backend.embed(
+        [text_embedder.prefix + text + text_embedder.suffix for text in texts],
+        batch_size=text_embedder.batch_size,
+        show_progress_bar=False,
+        normalize_embeddings=text_embedder.normalize_embeddings,
+        precision=text_embedder.precision,
+    )
+
+
+def search_answer(question: str, index: Optional[KnowledgeIndex] = None):
+    """
+    Запускает поиск нормализованного вопроса по версии индекса и возвращает ответ.
+    """
+    index = knowledge_index if index is None else index
+    documents = search_documents(question, index)
+    with stage("lookup"):
+        return answer_from_documents(documents, index)
+
+
+def search_documents(question: str, index: KnowledgeIndex) -> list[Document]:
+    """
+    Эмбеддит нормализованный вопрос и ищет ближайшие документы в версии индекса.
+    """
+    with stage("embed"):
+        embedding = text_embedder.run(text=question)['embedding']
+    with stage("retrieve"):
+        return index.retriever.run(query_embedding=embedding)['documents']
+
+
+def top_score(documents: list[Document]) -> Optional[float]:
+    # Оценка близости ближайшего документа, по ней шлюз сравнивает уверенность пайплайнов
+    return documents[0].score if documents else None
+
+
+def answer_from_documents(documents: list[Document], index: KnowledgeIndex):
+    """
+    Возвращает ответ и классификаторы по найденным ретривером документам.
+    """
     # Извлечение ответа из полученных документов
     try:
-        target_q = response['retriever']['documents'][0].content
+        target_idx = documents[0].meta['idx']
     except (IndexError, KeyError):
         return "Документы не найдены в ответе RAG pipeline.", "", ""
 
     try:
-        target_answer = df.loc[df['Вопрос'] == target_q].iloc[0]
-        return target_answer['Ответ из БЗ'], target_answer['Классификатор 1 уровня'], target_answer[
-            'Классификатор 2 уровня']
-    except IndexError:
+        return index.answer_table.get(target_idx)
+    except KeyError:
         return NO_ANSWER, "", ""
 
 
@@ -106,12 +202,56 @@ class Answer(BaseModel):
     answer: str
     class_1: str
     class_2: str
+    score: Optional[float] = None
 
 
 async def get_answer(question: str) -> Answer:
     """
     Асинхронная функция для получения ответа на вопрос с использованием RAG pipeline.
     """
-    loop = asyncio.get_event_loop()
-    answer_text, class_1, class_2 = await loop.run_in_executor(None, get_answer_from_rag, question, basic_rag_pipeline)
-    return Answer(answer=answer_text, class_1=class_1 or "", class_2=class_2 or "")
+    # asyncio.to_thread переносит контекст запроса в поток, стадии попадают в его трассировку
+    with stage("preprocess"):
+        question = await asyncio.to_thread(preprocess_question, question)
+    # Версия индекса фиксируется на весь запрос, перезагрузка базы знаний его не задевает
+    index = knowledge_index
+    cache_key = (index.version, question)
+
+    cached_answer = answer_cache.get(cache_key)
+    if cached_answer is not None:
+        return cached_answer
+
+    documents = await asyncio.to_thread(search_documents, question, index)
+    with stage("lookup"):
+        answer_text, class_1, class_2 = answer_from_documents(documents, index)
+    answer = Answer(answer=answer_text, class_1=class_1 or "", class_2=class_2 or "", score=top_score(documents))
+    answer_cache.put(cache_key, answer)
+    return answer
+
+
+def answer_batch(questions: list[str]) -> list[Answer]:
+    """
+    Синхронный батчевый аналог get_answer для офлайн-прогонов и пакетной обработки:
+    новые вопросы эмбеддятся одним вызовом модели, повторы и ответы из кэша повторно не считаются.
+    """
+    # Версия индекса фиксируется на весь батч
+    index = knowledge_index
+    texts = [preprocess_question(question) for question in questions]
+
+    answers = {}
+    for text in dict.fromkeys(texts):
+        cached_answer = answer_cache.get((index.version, text))
+        if cached_answer is not None:
+            answers[text] = cached_answer
+    missing = [text for text in dict.fromkeys(texts) if text not in answers]
+
+    if missing:
+        for text, embedding in zip(missing, embed_texts(missing)):
+            documents = index.retriever.run(query_embedding=embedding)['documents']
+            answer_text, class_1, class_2 = answer_from_documents(documents, index)
+            answer = Answer(
+                answer=answer_text, class_1=class_1 or "", class_2=class_2 or "", score=top_score(documents)
+            )
+            answer_cache.put((index.version, text), answer)
+            answers[text] = answer
+
+    return [answers[text] for text in texts]
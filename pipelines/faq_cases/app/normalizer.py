@@ -0,0 +1,127 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import functools
+import json
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, Optional
+
+LEMMA_CACHE_SIZE = int(os.getenv('LEMMA_CACHE_SIZE', '100000'))
+
+# Слово или отдельный знак препинания, за один проход по строке
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+# Всё, кроме букв, цифр, пробелов и дефиса
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s-]')
+# Знаки, которые приклеиваются к предыдущему слову без пробела
+ATTACHED_PUNCTUATION = '.,!?;:'
+
+_morph = None
+_morph_lock = threading.Lock()
+
+
+def morph_analyzer():
+    """
+    Общий на процесс анализатор pymorphy2: словари загружаются с диска один раз.
+    Разбор слова только читает словари, поэтому анализатор безопасно использовать из разных потоков.
+    """
+    global _morph
+
+    if _morph is None:
+        with _morph_lock:
+            if _morph is None:
+                import pymorphy2
+
+                _morph = pymorphy2.MorphAnalyzer()
+    return _morph
+
+
+class Normalizer:
+    """
+    Нормализация вопросов с заменой слов по словарю (config/replacements.json).
+
+    Словарь компилируется один раз, токенизация, замена и расстановка знаков препинания
+    выполняются за один линейный проход. Леммы pymorphy2 кэшируются в ограниченном LRU.
+    """
+
+    def __init__(
+            self,
+            replacements: Dict[str, str],
+            lemmatizer: Optional[Callable[[str], str]] = None,
+            lemma_cache_size: int = LEMMA_CACHE_SIZE,
+    ):
+        """
+        Параметры:
+        - replacements (Dict[str, str]): Замены слов, ключи - слова в нижнем регистре.
+        - lemmatizer (Callable[[str], str], optional): Нормальная форма слова, по умолчанию pymorphy2.
+        - lemma_cache_size (int): Число запоминаемых лемм.
+        """
+        self.replacements = dict(replacements)
+        self._lemmatizer = lemmatizer
+        self.lemma = functools.lru_cache(maxsize=lemma_cache_size)(self._lemma)
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> 'Normalizer':
+        with open(path, 'r', encoding='utf-8') as file:
+            return cls(json.load(file), **kwargs)
+
+    def _lemma(self, word: str) -> str:
+        if self._lemmatizer is not None:
+            return self._lemmatizer(word)
+        return morph_analyzer().parse(word)[0].normal_form
+
+    def warm_up(self) -> None:
+        """
+        Загружает словари pymorphy2 заранее, чтобы первый запрос не платил за это.
+        """
+        if self._lemmatizer is None and self.replacements:
+            morph_analyzer()
+
+    def normalize(self, text: str) -> str:
+        """
+        Нижний регистр, замена слов по словарю как есть, без лемматизации.
+        Знаки `.,!?;:` приклеиваются к предыдущему слову, остальные отделяются пробелами.
+        """
+        replacements = self.replacements
+        parts = []
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            token = replacements.get(token, token)
+            if token in ATTACHED_PUNCTUATION and parts:
+                parts[-1] += token
+            else:
+                parts.append(token)
+        return ' '.join(parts)
+
+    def normalize_question(self, text: str) -> str:
+        """
+        Нижний регистр без знаков препинания (кроме дефиса), замена слов по словарю по нормальной форме слова.
+        """
+        words = PUNCTUATION_PATTERN.sub('', text.lower()).split()
+        if not self.replacements:
+            return ' '.join(words)
+        replacements = self.replacements
+        lemma = self.lemma
+        return ' '.join([replacements.get(lemma(word), word) for word in words])
+
+    def stats(self) -> Dict[str, Any]:
+        info = self.lemma.cache_info()
+        requests = info.hits + info.misses
+        return {
+            'replacements': len(self.replacements),
+            'lemma_cache': {
+                **info._asdict(),
+                'hit_rate': info.hits / requests if requests else 0.0,
+            },
+        }
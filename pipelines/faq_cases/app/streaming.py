@@ -0,0 +1,81 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import Executor
+from typing import AsyncIterator, Callable, List, Optional, Sequence
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+BATCH_CHUNK_SIZE = int(os.getenv('BATCH_CHUNK_SIZE', '64'))
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+
+class BatchRequest(BaseModel):
+    questions: List[str]
+
+
+def ndjson_line(item: dict) -> bytes:
+    return json.dumps(item, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+async def stream_answers(
+        questions: Sequence[str],
+        answer_batch: Callable[[List[str]], List[BaseModel]],
+        chunk_size: int = BATCH_CHUNK_SIZE,
+        executor: Optional[Executor] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Отвечает на вопросы чанками и отдаёт ответы в формате NDJSON по мере готовности.
+
+    Следующий чанк считается в пуле потоков, пока ответы текущего отправляются клиенту,
+    поэтому модели не простаивают, а в памяти одновременно не больше двух чанков.
+    Ошибка чанка не прерывает поток: для его вопросов отдаются строки с полем `error`.
+
+    Параметры:
+    - questions (Sequence[str]): Вопросы в порядке ответов.
+    - answer_batch (Callable): Батчевый ответ пайплайна на список вопросов, выполняется в пуле потоков.
+    - chunk_size (int): Число вопросов в одном батче.
+    - executor (Executor, optional): Пул потоков для батчей, по-умолчанию общий.
+
+    Строка ответа: `{"index": <номер вопроса>, "question": ..., "answer": ..., "class_1": ..., "class_2": ...}`.
+    """
+    loop = asyncio.get_running_loop()
+    chunk_size = max(1, chunk_size)
+
+    def submit(offset: int):
+        if offset >= len(questions):
+            return None
+        chunk = list(questions[offset:offset + chunk_size])
+        return offset, chunk, loop.run_in_executor(executor, answer_batch, chunk)
+
+    pending = submit(0)
+    while pending is not None:
+        offset, chunk, future = pending
+        pending = submit(offset + len(chunk))
+        try:
+            answers = [answer.model_dump() for answer in await future]
+        except Exception as exception:
+            logger.exception(f'batch chunk failed: offset={offset} size={len(chunk)}')
+            answers = [{'error': str(exception)} for _ in chunk]
+        yield b''.join(
+            ndjson_line({'index': offset + position, 'question': question, **answer})
+            for position, (question, answer) in enumerate(zip(chunk, answers))
+        )
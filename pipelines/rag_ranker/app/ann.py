@@ -0,0 +1,198 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import argparse
+import dataclasses
+import json
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+from haystack import Document, component
+
+logger = logging.getLogger(__name__)
+
+CENTROIDS_FILE_NAME = 'centroids.npy'
+VECTORS_FILE_NAME = 'vectors.npy'
+OFFSETS_FILE_NAME = 'offsets.npy'
+DOCUMENTS_FILE_NAME = 'documents.json'
+
+
+class IvfIndex:
+    """
+    Приближённый индекс ближайших соседей IVF-Flat поверх матрицы NumPy.
+
+    Векторы разбиваются k-means на `n_lists` кластеров и хранятся подряд по кластерам.
+    Запрос сравнивается только с векторами `nprobe` ближайших кластеров, близость - скалярное
+    произведение, как у InMemoryDocumentStore по-умолчанию.
+    """
+
+    def __init__(self, centroids: np.ndarray, vectors: np.ndarray, offsets: np.ndarray, documents: List[Document]):
+        self.centroids = centroids
+        self.centroid_norms = (centroids ** 2).sum(axis=1)
+        self.vectors = vectors
+        self.offsets = offsets
+        self.documents = documents
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, documents: List[Document], n_lists: Optional[int] = None, iterations: int = 20,
+              seed: int = 0) -> 'IvfIndex':
+        """
+        Строит индекс по документам с эмбеддингами.
+
+        Параметры:
+        - documents (List[Document]): Документы с заполненным embedding.
+        - n_lists (int, optional): Число кластеров, по-умолчанию около 4 * sqrt(N).
+        - iterations (int): Число итераций k-means.
+        - seed (int): Зерно генератора для воспроизводимости.
+        """
+        documents = [doc for doc in documents if doc.embedding is not None]
+        matrix = np.asarray([doc.embedding for doc in documents], dtype=np.float32)
+        n_lists = min(n_lists or max(1, int(4 * np.sqrt(len(matrix)))), len(matrix))
+
+        rng = np.random.default_rng(seed)
+        centroids = matrix[rng.choice(len(matrix), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = cls._assign(matrix, centroids)
+            for cluster in range(n_lists):
+                members = matrix[assignments == cluster]
+                if len(members):
+                    centroids[cluster] = members.mean(axis=0)
+        assignments = cls._assign(matrix, centroids)
+
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignments, minlength=n_lists))
+        logger.info(f'ivf index built: documents={len(documents)} lists={n_lists}')
+        return cls(centroids, matrix[order], offsets, [documents[i] for i in order])
+
+    @staticmethod
+    def _assign(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        # argmin ||x - c||^2 = argmin (||c||^2 - 2 x.c), ||x||^2 не влияет на выбор
+        return np.argmin((centroids ** 2).sum(axis=1) - 2 * matrix @ centroids.T, axis=1)
+
+    def search(self, query_embedding: List[float], top_k: int, nprobe: int) -> List[Document]:
+        query = np.asarray(query_embedding, dtype=np.float32)
+
+        nprobe = min(nprobe, self.n_lists)
+        distances = self.centroid_norms - 2 * self.centroids @ query
+        lists = np.argpartition(distances, nprobe - 1)[:nprobe] if nprobe < self.n_lists else range(self.n_lists)
+
+        positions = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+        if not len(positions):
+            return []
+        scores = self.vectors[positions] @ query
+
+        top_k = min(top_k, len(positions))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [dataclasses.replace(self.documents[positions[i]], score=float(scores[i])) for i in best]
+
+    def save(self, path: str) -> None:
+        """
+        Сохраняет индекс, не перезаписывая файлы на месте.
+
+        Каждый файл пишется во временный и подменяется через os.replace: vectors.npy текущего индекса
+        открыт через memory-map, и его обрезка уронила бы процесс с SIGBUS на следующем запросе.
+        documents.json подменяется последним, по нему проверяется актуальность индекса.
+        """
+        os.makedirs(path, exist_ok=True)
+        suffix = f'.{os.getpid()}.tmp'
+        for file_name, array in (
+                (CENTROIDS_FILE_NAME, self.centroids),
+                (VECTORS_FILE_NAME, self.vectors),
+                (OFFSETS_FILE_NAME, self.offsets),
+        ):
+            file_path = os.path.join(path, file_name)
+            with open(file_path + suffix, 'wb') as file:
+                np.save(file, array)
+            os.replace(file_path + suffix, file_path)
+        # Эмбеддинги документов хранятся только в vectors.npy
+        documents_path = os.path.join(path, DOCUMENTS_FILE_NAME)
+        with open(documents_path + suffix, 'w', encoding='utf-8') as file:
+            json.dump([{'id': doc.id, 'content': doc.content, 'meta': doc.meta} for doc in self.documents],
+                      file, ensure_ascii=False, default=str)
+        os.replace(documents_path + suffix, documents_path)
+
+    @classmethod
+    def load(cls, path: str) -> 'IvfIndex':
+        with open(os.path.join(path, DOCUMENTS_FILE_NAME), 'r', encoding='utf-8') as file:
+            documents = [Document(**doc) for doc in json.load(file)]
+        return cls(
+            np.load(os.path.join(path, CENTROIDS_FILE_NAME)),
+            np.load(os.path.join(path, VECTORS_FILE_NAME), mmap_mode='r'),
+            np.load(os.path.join(path, OFFSETS_FILE_NAME)),
+            documents,
+        )
+
+    def consistent(self) -> bool:
+        # Файлы от разных сборок (обрыв записи между подменами) не сходятся по размерам
+        return (
+            len(self.vectors) == len(self.documents) == int(self.offsets[-1])
+            and len(self.offsets) == self.n_lists + 1
+        )
+
+    @classmethod
+    def load_or_build(cls, path: str, documents: List[Document], **kwargs) -> 'IvfIndex':
+        """
+        Загружает индекс с диска, если он построен по тем же документам, иначе строит и сохраняет новый.
+        """
+        if os.path.exists(os.path.join(path, DOCUMENTS_FILE_NAME)):
+            index = cls.load(path)
+            same_documents = sorted(doc.id for doc in index.documents) == sorted(doc.id for doc in documents)
+            if index.consistent() and same_documents:
+                logger.info(f'ivf index loaded: path="{path}" documents={len(index)}')
+                return index
+            logger.info(f'ivf index is stale, rebuilding: path="{path}"')
+        index = cls.build(documents, **kwargs)
+        index.save(path)
+        return index
+
+
+@component
+class IvfEmbeddingRetriever:
+    """
+    Замена InMemoryEmbeddingRetriever на приближённом индексе IvfIndex с тем же входом и выходом.
+    """
+
+    def __init__(self, index: IvfIndex, top_k: int = 10, nprobe: int = 16):
+        self.index = index
+        self.top_k = top_k
+        self.nprobe = nprobe
+
+    @component.output_types(documents=List[Document])
+    def run(self, query_embedding: List[float], top_k: Optional[int] = None):
+        return {'documents': self.index.search(query_embedding, top_k or self.top_k, self.nprobe)}
+
+
+if __name__ == '__main__':
+    # Офлайн сборка индекса по документам пайплайна: python -m app.ann --output ann_index
+    parser = argparse.ArgumentParser(description='Сборка IVF индекса по документам пайплайна')
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--lists', type=int, default=None)
+    args = parser.parse_args()
+
+    os.environ['RETRIEVER'] = 'exact'
+    from app import model
+
+    model.init()
+    IvfIndex.build(model.knowledge_index.document_store.filter_documents(), n_lists=args.lists).save(args.output)
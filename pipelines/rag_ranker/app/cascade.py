@@ -0,0 +1,94 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+from collections import Counter
+from typing import Any, Dict, List, Sequence, Tuple
+
+from haystack import Document
+
+CASCADE_ENABLED = os.getenv('CASCADE_ENABLED', 'false').lower() in ('true', '1', 't')
+CASCADE_SKIP_SCORE = float(os.getenv('CASCADE_SKIP_SCORE', '0.95'))
+CASCADE_SKIP_MARGIN = float(os.getenv('CASCADE_SKIP_MARGIN', '0.02'))
+# Порог оценки би-энкодера для ответа без ранкера, на этом пути порог ранкера не применим
+CASCADE_ANSWER_SCORE = float(os.getenv('CASCADE_ANSWER_SCORE', '0.9'))
+CASCADE_FLAT_SPREAD = float(os.getenv('CASCADE_FLAT_SPREAD', '0.05'))
+CASCADE_SIZES = [int(size) for size in os.getenv('CASCADE_SIZES', '5,20,50').split(',')]
+
+SKIP = 'skip'
+
+
+class CascadePolicy:
+    """
+    Каскадная политика ранжирования по оценкам би-энкодера.
+
+    Если top-1 кандидат уверенно лучше остальных (оценка не ниже `skip_score` и отрыв от top-2
+    не меньше `skip_margin`), кросс-энкодер не запускается. Иначе ему отдаётся наименьший из `sizes`
+    префикс кандидатов, за которым оценки падают больше чем на `flat_spread` от top-1:
+    чем площе распределение оценок, тем больше кандидатов уходит на ранжирование.
+    Ответ без ранкера принимается, только если оценка би-энкодера не ниже `answer_score`.
+    """
+
+    def __init__(
+            self,
+            enabled: bool = CASCADE_ENABLED,
+            skip_score: float = CASCADE_SKIP_SCORE,
+            skip_margin: float = CASCADE_SKIP_MARGIN,
+            flat_spread: float = CASCADE_FLAT_SPREAD,
+            sizes: Sequence[int] = CASCADE_SIZES,
+            answer_score: float = CASCADE_ANSWER_SCORE,
+    ):
+        self.enabled = enabled
+        self.skip_score = skip_score
+        self.skip_margin = skip_margin
+        self.flat_spread = flat_spread
+        self.sizes = sorted(sizes)
+        self.answer_score = answer_score
+        self.paths = Counter()
+
+    def select(self, documents: List[Document]) -> Tuple[str, List[Document]]:
+        """
+        Выбирает путь для запроса по отсортированным кандидатам ретривера.
+
+        Возвращает:
+        - Tuple[str, List[Document]]: Путь (`skip` или `rerank_<N>`) и кандидаты для него.
+        """
+        path, candidates = self._select(documents)
+        self.paths[path] += 1
+        return path, candidates
+
+    def _select(self, documents: List[Document]) -> Tuple[str, List[Document]]:
+        if not self.enabled or len(documents) < 2:
+            return f'rerank_{len(documents)}', documents
+
+        top_score = documents[0].score
+        if top_score >= self.skip_score and top_score - documents[1].score >= self.skip_margin:
+            return SKIP, documents[:1]
+
+        for size in self.sizes:
+            if size >= len(documents) or documents[size].score < top_score - self.flat_spread:
+                candidates = documents[:size]
+                return f'rerank_{len(candidates)}', candidates
+        return f'rerank_{len(documents)}', documents
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'skip_score': self.skip_score,
+            'skip_margin': self.skip_margin,
+            'flat_spread': self.flat_spread,
+            'sizes': self.sizes,
+            'answer_score': self.answer_score,
+            'paths': dict(self.paths),
+        }
@@ -0,0 +1,125 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import functools
+import logging
+import os
+import re
+from typing import Any, Dict, List, Tuple
+
+import joblib
+import nltk
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+
+from app.cache import AnswerCache
+
+logger = logging.getLogger(__name__)
+
+CLASSIFIER_CACHE_SIZE = int(os.getenv('CLASSIFIER_CACHE_SIZE', '10000'))
+
+NON_WORD_PATTERN = re.compile(r'\W+')
+
+lemmatizer = WordNetLemmatizer()
+
+
+@functools.lru_cache(maxsize=100_000)
+def lemmatize(word: str) -> str:
+    return lemmatizer.lemmatize(word)
+
+
+class ClassifierEngine:
+    """
+    Классификаторы вопроса по TF-IDF для случаев, когда ранкер не нашёл ответ.
+
+    Вопрос предобрабатывается один раз для всех моделей, модели применяются к батчу вопросов,
+    а результаты последних вопросов запоминаются. Файлы моделей загружаются с memory-map,
+    поэтому массивы, сохранённые `joblib.dump` без сжатия, делят страницы между воркерами.
+    """
+
+    def __init__(self, paths: List[Tuple[str, str, str]], cache_size: int = CLASSIFIER_CACHE_SIZE):
+        """
+        Параметры:
+        - paths (List[Tuple[str, str, str]]): Пути к модели, кодировщику меток и векторизатору для каждого уровня.
+        - cache_size (int): Число запоминаемых вопросов, 0 отключает кэш.
+        """
+        self.paths = paths
+        self.models: List[Tuple[Any, Any, Any]] = []
+        self.stop_words = set()
+        self.cache = AnswerCache(max_size=cache_size, ttl=float('inf'))
+
+    def load(self) -> None:
+        nltk.download('punkt')
+        nltk.download('punkt_tab')
+        nltk.download('wordnet')
+        nltk.download('stopwords')
+
+        self.stop_words = set(stopwords.words('russian'))
+        # Ленивая загрузка wordnet не потокобезопасна, поэтому выполняется здесь, а не в первом запросе
+        lemmatize('warm')
+
+        self.models = []
+        for model_path, encoder_path, vectorizer_path in self.paths:
+            logger.info(f'classifier loading: model="{model_path}"')
+            self.models.append((
+                joblib.load(vectorizer_path, mmap_mode='r'),
+                joblib.load(model_path, mmap_mode='r'),
+                joblib.load(encoder_path, mmap_mode='r'),
+            ))
+
+    def preprocess(self, text: str) -> str:
+        text = NON_WORD_PATTERN.sub(' ', text)
+
+        words = nltk.word_tokenize(text)
+        words = [lemmatize(word) for word in words if word not in self.stop_words]
+
+        return ' '.join(words)
+
+    def classify(self, questions: List[str]) -> List[Tuple[str, ...]]:
+        """
+        Классифицирует батч вопросов всеми моделями.
+
+        Параметры:
+        - questions (List[str]): Вопросы, повторы внутри батча считаются один раз.
+
+        Возвращает:
+        - List[Tuple[str, ...]]: Для каждого вопроса метки всех уровней по порядку моделей.
+        """
+        results = {}
+        missing = []
+        for question in dict.fromkeys(questions):
+            classes = self.cache.get(question)
+            if classes is None:
+                missing.append(question)
+            else:
+                results[question] = classes
+
+        if missing:
+            texts = [self.preprocess(question) for question in missing]
+            labels = [
+                encoder.inverse_transform(model.predict(vectorizer.transform(texts)))
+                for vectorizer, model, encoder in self.models
+            ]
+            for question, classes in zip(missing, zip(*labels)):
+                results[question] = classes
+                self.cache.put(question, classes)
+
+        return [results[question] for question in questions]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'models': len(self.models),
+            'cache': self.cache.stats(),
+            'lemmas': lemmatize.cache_info()._asdict(),
+        }
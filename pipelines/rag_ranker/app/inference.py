@@ -0,0 +1,198 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import logging
+import os
+import re
+from typing import List, Optional, Tuple
+
+import torch
+from haystack.utils import ComponentDevice
+
+logger = logging.getLogger(__name__)
+
+# Устройство для моделей: cuda:0, cpu, ... По-умолчанию выбирается автоматически
+INFERENCE_DEVICE = os.getenv('INFERENCE_DEVICE')
+# Бэкенд инференса: torch или onnx
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'torch')
+ONNX_MODELS_PATH = os.getenv('ONNX_MODELS_PATH', 'onnx')
+ONNX_QUANTIZE = os.getenv('ONNX_QUANTIZE', 'false').lower() in ('true', '1', 't')
+
+FEATURE_EXTRACTION = 'feature-extraction'
+TEXT_CLASSIFICATION = 'text-classification'
+
+ONNX_FILE_NAME = 'model.onnx'
+ONNX_QUANTIZED_FILE_NAME = 'model_quantized.onnx'
+POOLING_FILE_NAME = 'pooling.json'
+
+
+def get_device() -> ComponentDevice:
+    if INFERENCE_DEVICE:
+        return ComponentDevice.from_str(INFERENCE_DEVICE)
+    return ComponentDevice.resolve_device(None)
+
+
+def embedding_key(model: str) -> str:
+    """
+    Ключ эмбеддингов модели с учётом бэкенда: векторы ONNX и int8 моделей не смешиваются с векторами torch.
+    """
+    if INFERENCE_BACKEND == 'torch':
+        return model
+    return f'{model}-{INFERENCE_BACKEND}' + ('-int8' if ONNX_QUANTIZE else '')
+
+
+def _onnx_import_error() -> ImportError:
+    return ImportError("Для INFERENCE_BACKEND=onnx выполните 'pip install optimum[onnxruntime]'")
+
+
+def _onnx_provider(device: ComponentDevice) -> str:
+    return 'CUDAExecutionProvider' if device.to_torch_str().startswith('cuda') else 'CPUExecutionProvider'
+
+
+def export_onnx(model: str, task: str, quantize: bool = ONNX_QUANTIZE, path: str = ONNX_MODELS_PATH) -> Tuple[str, str]:
+    """
+    Экспортирует модель Hugging Face в ONNX и, при необходимости, квантует её динамически в int8.
+    Уже экспортированные модели повторно не собираются.
+
+    Параметры:
+    - model (str): Название модели.
+    - task (str): feature-extraction для эмбеддера или text-classification для кросс-энкодера.
+    - quantize (bool): Нужна ли int8 квантизация.
+    - path (str): Каталог с ONNX моделями.
+
+    Возвращает:
+    - Tuple[str, str]: Каталог модели и имя ONNX файла в нём.
+    """
+    try:
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTModelForSequenceClassification, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    except ImportError as exception:
+        raise _onnx_import_error() from exception
+    from transformers import AutoTokenizer
+
+    model_path = os.path.join(path, re.sub(r'[^\w.-]+', '_', model))
+
+    if not os.path.exists(os.path.join(model_path, ONNX_FILE_NAME)):
+        logger.info(f'exporting onnx: model="{model}" task="{task}" path="{model_path}"')
+        model_class = ORTModelForFeatureExtraction if task == FEATURE_EXTRACTION else ORTModelForSequenceClassification
+        model_class.from_pretrained(model, export=True).save_pretrained(model_path)
+        AutoTokenizer.from_pretrained(model).save_pretrained(model_path)
+        if task == FEATURE_EXTRACTION:
+            _save_pooling(model, model_path)
+
+    if not quantize:
+        return model_path, ONNX_FILE_NAME
+
+    if not os.path.exists(os.path.join(model_path, ONNX_QUANTIZED_FILE_NAME)):
+        logger.info(f'quantizing onnx: model="{model}" path="{model_path}"')
+        quantizer = ORTQuantizer.from_pretrained(model_path, file_name=ONNX_FILE_NAME)
+        quantizer.quantize(
+            save_dir=model_path,
+            quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False),
+        )
+    return model_path, ONNX_QUANTIZED_FILE_NAME
+
+
+def _save_pooling(model: str, model_path: str) -> None:
+    # Пулинг и нормализация берутся из конфигурации sentence-transformers, чтобы векторы совпадали с torch бэкендом
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    sentence_transformer = SentenceTransformer(model, device='cpu')
+    pooling = next(module for module in sentence_transformer if isinstance(module, Pooling))
+    with open(os.path.join(model_path, POOLING_FILE_NAME), 'w', encoding='utf-8') as file:
+        json.dump({
+            'mode': 'cls' if pooling.pooling_mode_cls_token else 'mean',
+            'normalize': any(isinstance(module, Normalize) for module in sentence_transformer),
+            'max_seq_length': sentence_transformer.max_seq_length,
+        }, file)
+
+
+class OnnxEmbeddingBackend:
+    """
+    Бэкенд эмбеддингов на ONNX Runtime с тем же интерфейсом `embed`,
+    что и у бэкенда sentence-transformers в эмбеддерах haystack.
+    """
+
+    def __init__(self, model_path: str, file_name: str, device: ComponentDevice):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_path, file_name=file_name, provider=_onnx_provider(device),
+        )
+        with open(os.path.join(model_path, POOLING_FILE_NAME), 'r', encoding='utf-8') as file:
+            pooling = json.load(file)
+        self.pooling_mode = pooling['mode']
+        self.normalize = pooling['normalize']
+        self.max_seq_length = pooling['max_seq_length']
+
+    def embed(self, data: List[str], batch_size: int = 32, normalize_embeddings: bool = False, **kwargs) -> List[List[float]]:
+        embeddings = []
+        for start in range(0, len(data), batch_size):
+            features = self.tokenizer(
+                data[start:start + batch_size],
+                padding=True, truncation=True, max_length=self.max_seq_length, return_tensors='pt',
+            ).to(self.model.device)
+            with torch.inference_mode():
+                token_embeddings = self.model(**features).last_hidden_state
+            if self.pooling_mode == 'cls':
+                batch_embeddings = token_embeddings[:, 0]
+            else:
+                mask = features['attention_mask'].unsqueeze(-1).to(token_embeddings.dtype)
+                batch_embeddings = (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            if self.normalize or normalize_embeddings:
+                batch_embeddings = torch.nn.functional.normalize(batch_embeddings, p=2, dim=1)
+            embeddings.extend(batch_embeddings.cpu().tolist())
+        return embeddings
+
+
+def setup_backend(embedders: list, ranker=None, device: Optional[ComponentDevice] = None) -> None:
+    """
+    Подключает выбранный бэкенд инференса к компонентам haystack.
+    Для onnx модели экспортируются (при необходимости) и подставляются в компоненты до их warm_up,
+    поэтому haystack уже не загружает torch версии.
+
+    Параметры:
+    - embedders (list): Эмбеддеры документов и текста одной модели.
+    - ranker (TransformersSimilarityRanker, optional): Кросс-энкодер.
+    - device (ComponentDevice, optional): Устройство, по-умолчанию get_device().
+    """
+    if INFERENCE_BACKEND == 'torch':
+        return
+    if INFERENCE_BACKEND != 'onnx':
+        raise ValueError(f'Неизвестный бэкенд инференса: {INFERENCE_BACKEND}')
+
+    device = device or get_device()
+
+    if embedders:
+        model_path, file_name = export_onnx(embedders[0].model, FEATURE_EXTRACTION)
+        embedding_backend = OnnxEmbeddingBackend(model_path, file_name, device)
+        for embedder in embedders:
+            embedder.embedding_backend = embedding_backend
+
+    if ranker is not None:
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from transformers import AutoTokenizer
+
+        model_path, file_name = export_onnx(ranker.model_name_or_path, TEXT_CLASSIFICATION)
+        ranker.tokenizer = AutoTokenizer.from_pretrained(model_path, **ranker.tokenizer_kwargs)
+        ranker.model = ORTModelForSequenceClassification.from_pretrained(
+            model_path, file_name=file_name, provider=_onnx_provider(device),
+        )
+        ranker.device = device
+
+    logger.info(f'inference backend: backend="onnx" quantize="{ONNX_QUANTIZE}" device="{device.to_torch_str()}"')
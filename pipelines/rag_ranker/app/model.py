@@ -1,161 +1,232 @@
 import asyncio
-import json
+import dataclasses
 import logging
 import os
-import re
+from typing import Dict, Optional
 
-import joblib
-import nltk
 import pandas as pd
-import pymorphy2
+import torch
 from haystack import Document
-from haystack import Pipeline
 from haystack.components.embedders import SentenceTransformersDocumentEmbedder
 from haystack.components.embedders import SentenceTransformersTextEmbedder
 from haystack.components.rankers import TransformersSimilarityRanker
 from haystack.components.retrievers.in_memory import InMemoryEmbeddingRetriever
 from haystack.document_stores.in_memory import InMemoryDocumentStore
-from haystack.utils import ComponentDevice
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
 from pydantic import BaseModel
 
+from app.ann import IvfEmbeddingRetriever, IvfIndex
+from app.answers import AnswerTable
+from app.batching import MicroBatcher
+from app.cache import AnswerCache
+from app.compaction import drop_exact_duplicates, log_compaction, merge_near_duplicates
+from app.cascade import CascadePolicy, SKIP
+from app.classifier import ClassifierEngine
+from app.embedding_store import EmbeddingStore, content_hash
+from app.inference import embedding_key, get_device, setup_backend
+from app.normalizer import Normalizer
+from app.reload import KnowledgeIndex, Reloader
+from app.startup import Startup
+from app.tracing import stage
+
 logger = logging.getLogger(__name__)
 
+NO_ANSWER = "Ответ не найден."
+# Порог оценки кросс-энкодера, ниже которого ответ считается ненайденным
+RANKER_THRESHOLD = 0.25
+
 KNOWLEDGE_BASE_FILE_PATH = os.getenv('KNOWLEDGE_BASE_FILE_PATH')
 CASES_FILE_PATH = os.getenv('CASES_FILE_PATH')
 
-df_base = pd.read_excel(KNOWLEDGE_BASE_FILE_PATH)
-df_case = pd.read_excel(CASES_FILE_PATH)
-
-combined_column = pd.concat([
-    df_base['Вопрос из БЗ'],
-    df_case['Вопрос пользователя'],
-    df_base['Ответ из БЗ']],
-    ignore_index=True)
+EMBEDDER_MAX_BATCH_SIZE = int(os.getenv('EMBEDDER_MAX_BATCH_SIZE', '32'))
+RANKER_MAX_BATCH_SIZE = int(os.getenv('RANKER_MAX_BATCH_SIZE', '8'))
+CLASSIFIER_MAX_BATCH_SIZE = int(os.getenv('CLASSIFIER_MAX_BATCH_SIZE', '16'))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', '5'))
 
-df_base_rest = df_base.drop(columns=['Вопрос из БЗ'])
-df_case_rest = df_case.drop(columns=['Вопрос пользователя'])
+# Ретривер: exact - полный перебор, ivf - приближённый индекс IVF-Flat
+RETRIEVER = os.getenv('RETRIEVER', 'exact')
+IVF_INDEX_PATH = os.getenv('IVF_INDEX_PATH', 'ann_index')
+IVF_NPROBE = int(os.getenv('IVF_NPROBE', '16'))
 
-combined_rest = pd.concat([df_base_rest, df_case_rest, df_base_rest], ignore_index=True)
-
-final_df = combined_rest.copy()
-final_df['Вопрос'] = combined_column
+# embed_model = "cointegrated/LaBSE-en-ru"
+embed_model = "intfloat/e5-large-v2"
 
-final_df = final_df[['Вопрос'] + [col for col in final_df.columns if col != 'Вопрос']]
-final_df = final_df.drop(columns=["Тема"])
+startup = Startup()
 
-docs = [Document(content=row["Вопрос"], meta={"idx": index}) for index, row in final_df.iterrows()]
+# Заполняются стадиями фоновой инициализации, см. init()
+device = None
+doc_embedder: Optional[SentenceTransformersDocumentEmbedder] = None
+text_embedder: Optional[SentenceTransformersTextEmbedder] = None
+ranker: Optional[TransformersSimilarityRanker] = None
+# Текущая версия индекса, подменяется целиком при перезагрузке базы знаний
+knowledge_index: Optional[KnowledgeIndex] = None
 
-"""### Инициализируем Трансформер для построения эмбеддинга вопросов"""
+answer_cache = AnswerCache()
 
-device = ComponentDevice.from_str("cuda:0")
 
-# embed_model = "cointegrated/LaBSE-en-ru"
-embed_model = "intfloat/e5-large-v2"
+def load_knowledge_base() -> pd.DataFrame:
+    df_base = pd.read_excel(KNOWLEDGE_BASE_FILE_PATH)
+    df_case = pd.read_excel(CASES_FILE_PATH)
 
-doc_embedder = SentenceTransformersDocumentEmbedder(
-    model=embed_model,
-    device=device,
-    # model_kwargs={"max_length": 512, "do_truncate": True},
-)
+    combined_column = pd.concat([
+        df_base['Вопрос из БЗ'],
+        df_case['Вопрос пользователя'],
+        df_base['Ответ из БЗ']],
+        ignore_index=True)
 
-doc_embedder.warm_up()
+    df_base_rest = df_base.drop(columns=['Вопрос из БЗ'])
+    df_case_rest = df_case.drop(columns=['Вопрос пользователя'])
 
-document_store = InMemoryDocumentStore()
+    combined_rest = pd.concat([df_base_rest, df_case_rest, df_base_rest], ignore_index=True)
 
-docs_with_embeddings = doc_embedder.run(docs)
-unique_docs = {doc.id: doc for doc in docs_with_embeddings["documents"]}.values()
-document_store.write_documents(list(unique_docs))
+    final_df = combined_rest.copy()
+    final_df['Вопрос'] = combined_column
 
-text_embedder = SentenceTransformersTextEmbedder(
-    model=embed_model,
-    device=device,
-    # model_kwargs={"max_length": 512}
-)
+    final_df = final_df[['Вопрос'] + [col for col in final_df.columns if col != 'Вопрос']]
+    final_df = final_df.drop(columns=["Тема"])
 
-retriever = InMemoryEmbeddingRetriever(document_store, top_k=50)
+    return final_df
 
-ranker = TransformersSimilarityRanker(
-    model="DiTy/cross-encoder-russian-msmarco",
-    top_k=1,
-    model_kwargs={"max_length": 512},
-    tokenizer_kwargs={"model_max_length": 512}
-)
 
-basic_rag_pipeline = Pipeline()
-# Add components to your pipeline
-basic_rag_pipeline.add_component("text_embedder", text_embedder)
-basic_rag_pipeline.add_component("retriever", retriever)
-basic_rag_pipeline.add_component("ranker", ranker)
+"""### Инициализируем Трансформер для построения эмбеддинга вопросов"""
 
-# Now, connect the components to each other
-basic_rag_pipeline.connect("text_embedder.embedding", "retriever.query_embedding")
-basic_rag_pipeline.connect("retriever", "ranker")
 
-"""Добавим словарь, по которому будем заменять англицизмы на действительно английские слова (т. к. в базе они хранятся именно на английском)"""
+def load_models() -> None:
+    global device, doc_embedder, text_embedder, ranker
 
-# Загрузка замен слов на их эквиваленты из файла
-REPLACEMENTS_FILE_PATH = os.getenv('REPLACEMENTS_FILE_PATH')
-with open(REPLACEMENTS_FILE_PATH, 'r', encoding='utf-8') as file:
-    replace_dict = json.load(file)
+    device = get_device()
 
-nltk.download('punkt')
-nltk.download('punkt_tab')
-nltk.download('wordnet')
-nltk.download('stopwords')
+    doc_embedder = SentenceTransformersDocumentEmbedder(
+        model=embed_model,
+        device=device,
+        # model_kwargs={"max_length": 512, "do_truncate": True},
+    )
 
-lemmatizer = WordNetLemmatizer()
-stop_words = set(stopwords.words('russian'))
+    text_embedder = SentenceTransformersTextEmbedder(
+        model=embed_model,
+        device=device,
+        # model_kwargs={"max_length": 512}
+    )
 
-loaded_models = {}
-loaded_encoders = {}
-loaded_vectorizers = {}
+    ranker = TransformersSimilarityRanker(
+        model="DiTy/cross-encoder-russian-msmarco",
+        device=device,
+        top_k=1,
+        model_kwargs={"max_length": 512},
+        tokenizer_kwargs={"model_max_length": 512}
+    )
 
+    # Бэкенд инференса (torch или onnx) подключается до прогрева компонентов
+    setup_backend([doc_embedder, text_embedder], ranker, device)
 
-def preprocess(text):
-    text = re.sub(r'\W+', ' ', text)
+    text_embedder.warm_up()
+    ranker.warm_up()
 
-    words = nltk.word_tokenize(text)
-    words = [lemmatizer.lemmatize(word) for word in words if word not in stop_words]
 
-    return ' '.join(words)
+def build_index(version: str) -> KnowledgeIndex:
+    """
+    Собирает новую версию индекса по файлам базы знаний, не трогая текущую.
+    Эмбеддятся только вопросы, которых ещё нет в кэше эмбеддингов.
+    """
+    final_df = load_knowledge_base()
+    answer_table = AnswerTable(final_df, 'Вопрос')
+    docs = [Document(content=row["Вопрос"], meta={"idx": index}) for index, row in final_df.iterrows()]
+
+    # Компакция: точные дубли отбрасываются до эмбеддинга, почти дубли с тем же ответом склеиваются после
+    docs, exact_duplicates = drop_exact_duplicates(docs, answer_table)
+    embedding_store = EmbeddingStore(embedding_key(embed_model))
+    docs_with_embeddings = embedding_store.embed_documents(docs, doc_embedder)
+    unique_docs, near_duplicates = merge_near_duplicates(docs_with_embeddings, answer_table)
+    compaction = log_compaction(len(final_df), exact_duplicates, near_duplicates)
+
+    document_store = InMemoryDocumentStore()
+    document_store.write_documents(unique_docs)
+
+    if RETRIEVER == 'ivf':
+        retriever = IvfEmbeddingRetriever(
+            IvfIndex.load_or_build(IVF_INDEX_PATH, document_store.filter_documents()),
+            top_k=50,
+            nprobe=IVF_NPROBE,
+        )
+    else:
+        retriever = InMemoryEmbeddingRetriever(document_store, top_k=50)
+
+    return KnowledgeIndex(
+        version=version,
+        answer_table=answer_table,
+        document_store=document_store,
+        retriever=retriever,
+        hashes=frozenset(content_hash(doc.content) for doc in unique_docs),
+        stats={'compaction': compaction},
+    )
 
 
-def load_model_and_files(model_name, model_path, encoder_path, vectorizer_path):
-    global loaded_models, loaded_encoders, loaded_vectorizers
+def swap_index(index: KnowledgeIndex) -> None:
+    global knowledge_index
 
-    if model_name not in loaded_models:
-        print(f"Загрузка модели {model_name}...")
-        loaded_models[model_name] = joblib.load(model_path)
-        loaded_encoders[model_name] = joblib.load(encoder_path)
-        loaded_vectorizers[model_name] = joblib.load(vectorizer_path)
-    else:
-        print(f"Модель {model_name} уже загружена.")
+    knowledge_index = index
+    answer_cache.invalidate()
 
 
-def classify_question(
-        question_text: str,
-        model_name: str,
-):
-    global loaded_models, loaded_encoders, loaded_vectorizers
+reloader = Reloader([KNOWLEDGE_BASE_FILE_PATH, CASES_FILE_PATH], build_index, swap_index)
 
-    preprocessed_question = preprocess(question_text)
 
-    # Преобразование вопроса в TF-IDF вектор
-    vectorizer = loaded_vectorizers[model_name]
-    question_tfidf = vectorizer.transform([preprocessed_question])
+def embed_texts(texts: list[str]) -> list[list[float]]:
+    """
+    Батчевый аналог text_embedder.run: один прямой проход модели на весь список вопросов.
+    """
+    return text_embedder.embedding_backend.embed(
+        [text_embedder.prefix + text + text_embedder.suffix for text in texts],
+        batch_size=text_embedder.batch_size,
+        show_progress_bar=False,
+        normalize_embeddings=text_embedder.normalize_embeddings,
+        precision=text_embedder.precision,
+    )
 
-    # Предсказание с помощью модели
-    model = loaded_models[model_name]
-    predicted_label_numeric = model.predict(question_tfidf)
 
-    # Преобразование числовой метки обратно в текстовую метку
-    encoder = loaded_encoders[model_name]
-    predicted_label_text = encoder.inverse_transform(predicted_label_numeric)
+def rank_documents(batch: list[tuple[str, list[Document]]]) -> list[list[Document]]:
+    """
+    Батчевый аналог ranker.run: пары (вопрос, документ) всех вопросов оцениваются за один прямой проход.
+    """
+    pairs = [
+        [ranker.query_prefix + query, ranker.document_prefix + (doc.content or "")]
+        for query, documents in batch
+        for doc in documents
+    ]
+    if not pairs:
+        return [[] for _ in batch]
+
+    features = ranker.tokenizer(pairs, padding=True, truncation=True, return_tensors="pt").to(
+        ranker.device.first_device.to_torch()
+    )
+    with torch.inference_mode():
+        scores = ranker.model(**features).logits.squeeze(dim=1)
+    if ranker.scale_score:
+        scores = torch.sigmoid(scores * ranker.calibration_factor)
+    scores = scores.cpu().tolist()
+
+    ranked_batch = []
+    offset = 0
+    for _, documents in batch:
+        ranked = [
+            dataclasses.replace(doc, score=score)
+            for doc, score in zip(documents, scores[offset:offset + len(documents)])
+        ]
+        offset += len(documents)
+        ranked.sort(key=lambda doc: doc.score, reverse=True)
+        ranked_batch.append(ranked[:ranker.top_k])
+    return ranked_batch
+
+
+embedder_batcher = MicroBatcher("text_embedder", embed_texts, EMBEDDER_MAX_BATCH_SIZE, BATCH_MAX_WAIT_MS)
+ranker_batcher = MicroBatcher("ranker", rank_documents, RANKER_MAX_BATCH_SIZE, BATCH_MAX_WAIT_MS)
+
+cascade_policy = CascadePolicy()
 
-    return predicted_label_text[0]
+"""Добавим словарь, по которому будем заменять англицизмы на действительно английские слова (т. к. в базе они хранятся именно на английском)"""
 
+# Загрузка замен слов на их эквиваленты из файла
+REPLACEMENTS_FILE_PATH = os.getenv('REPLACEMENTS_FILE_PATH')
+normalizer = Normalizer.from_file(REPLACEMENTS_FILE_PATH)
 
 model_path_1 = "/models/model_1/classifier_1.pkl"
 encoder_path_1 = "/models/model_1/label_encoder_1.pkl"
@@ -165,81 +236,83 @@ model_path_2 = "/models/model_2/classifier_2.pkl"
 encoder_path_2 = "/models/model_2/label_encoder_2.pkl"
 vectorizer_path_2 = "/models/model_2/vectorizer_2.pkl"
 
-load_model_and_files('model_1', model_path_1, encoder_path_1, vectorizer_path_1)
-load_model_and_files('model_2', model_path_2, encoder_path_2, vectorizer_path_2)
+# Классификаторы 1 и 2 уровня для вопросов без найденного ответа
+classifier = ClassifierEngine([
+    (model_path_1, encoder_path_1, vectorizer_path_1),
+    (model_path_2, encoder_path_2, vectorizer_path_2),
+])
+classifier_batcher = MicroBatcher("classifier", classifier.classify, CLASSIFIER_MAX_BATCH_SIZE, BATCH_MAX_WAIT_MS)
 
-"""### Интерфейс для получения ответа из RAG пайплайна"""
 
-morph = pymorphy2.MorphAnalyzer()
+def load_classifiers() -> None:
+    classifier.load()
 
 
+"""### Интерфейс для получения ответа из RAG пайплайна"""
+
 def preprocess_text(text):
     """
-    Функция предобработки текста: приведение к нижнему регистру, удаление лишних символов,
-    лемматизация и замена слов по словарю, с сохранением знаков препинания.
-    Если слово не найдено в replace_dict, оно остаётся в исходной форме.
+    Функция предобработки текста: приведение к нижнему регистру и замена слов по словарю,
+    с сохранением знаков препинания. Если слово не найдено в словаре, оно остаётся в исходной форме.
     """
-    # Токенизация: разделяем слова и знаки препинания
-    tokens = re.findall(r'\w+|[^\w\s]', text.lower())
-    processed_tokens = []
-
-    for token in tokens:
-        if re.match(r'\w+', token):  # Если это слово
-            if replace_dict and token in replace_dict:
-                # Заменяем слово, если оно есть в словаре
-                processed_tokens.append(replace_dict[token])
-            else:
-                # Если нет в словаре замен, оставляем слово как есть
-                processed_tokens.append(token)
-        else:
-            # Знак препинания остаётся без изменений
-            processed_tokens.append(token)
-
-    # Восстановление текста с правильным расположением знаков препинания
-    processed_text = ''
-    for i, token in enumerate(processed_tokens):
-        if token in '.,!?;:':
-            # Прикрепляем знак препинания к предыдущему слову без пробела
-            processed_text = processed_text.rstrip() + token + ' '
-        else:
-            processed_text += token + ' '
-
-    return processed_text.strip()
+    return normalizer.normalize(text)
 
 
 def get_answer_from_rag(
         question_text: str,
-        rag_pipeline,
-        threshold: float = 0.25,
-        df: pd.DataFrame = final_df,
+        threshold: float = RANKER_THRESHOLD,
+        index: Optional[KnowledgeIndex] = None,
 ):
+    index = knowledge_index if index is None else index
     question_text = preprocess_text(question_text)
 
-    response = rag_pipeline.run({"text_embedder": {"text": question_text}, "ranker": {"query": question_text}})
+    # Синхронные вызовы моделей идут под блокировками микро-батчеров, как и батчи конкурентных запросов
+    embedding = embedder_batcher.run([question_text])[0]
+    documents = index.retriever.run(query_embedding=embedding)['documents']
+    ranked = ranker_batcher.run([(question_text, documents)])[0]
 
-    document = response['ranker']['documents'][0]
+    return resolve_answer(question_text, ranked[0] if ranked else None, threshold, index.answer_table)
 
-    target_q = document.content
-    score = document.score
 
-    if score < threshold:
-        answer_text = "Ответ не найден."
-        class_1 = classify_question(question_text, "model_1")
-        class_2 = classify_question(question_text, "model_2")
-    else:
-        target_answer = df.loc[df['Вопрос'] == target_q].iloc[0]
+def resolve_answer(
+        question_text: str,
+        document: Optional[Document],
+        threshold: float = RANKER_THRESHOLD,
+        answers: Optional[AnswerTable] = None,
+):
+    answers = knowledge_index.answer_table if answers is None else answers
 
-        answer_text = target_answer['Ответ из БЗ']
-        class_1 = target_answer['Классификатор 1 уровня']
-        class_2 = target_answer['Классификатор 2 уровня']
+    # Без кандидатов (пустой индекс) ответа нет, вопрос только классифицируется
+    if document is None or document.score < threshold:
+        answer_text = NO_ANSWER
+        class_1, class_2 = classifier_batcher.run([question_text])[0]
+    else:
+        answer_text, class_1, class_2 = answers.get(document.meta['idx'])
 
     return answer_text, class_1, class_2
 
 
+def init() -> None:
+    """
+    Инициализация пайплайна по стадиям: загрузка классификаторов и моделей,
+    чтение базы знаний, эмбеддинг документов и сборка индекса. Выполняется в фоне после старта сервиса.
+    """
+    startup.run([
+        ("classifiers", load_classifiers),
+        ("models", load_models),
+        ("index", lambda: reloader.reload(force=True)),
+    ])
+    reloader.watch()
+
+
 class Answer(BaseModel):
     answer: str
     class_1: str
     class_2: str
+    # Оценка кросс-энкодера, а на пути `skip` (см. extra_fields.rerank) - косинусная близость би-энкодера;
+    # None, если ретривер не вернул кандидатов
+    score: Optional[float] = None
+    extra_fields: Optional[Dict[str, str]] = None
 
 
 async def get_answer(question: str) -> Answer:
@@ -249,8 +322,6 @@ async def get_answer(question: str) -> Answer:
 
     Параметры:
     - question (str): Вопрос, который нужно обработать.
-    - basic_rag_pipeline: RAG pipeline для обработки запроса.
-    - replace_dict (dict, optional): Словарь для замены слов в вопросе.
     - df (pd.DataFrame, optional): DataFrame, содержащий столбцы 'Вопрос из БЗ', 'Ответ из БЗ',
                                     'Классификатор 1 уровня' и 'Классификатор 2 уровня'.
 
@@ -258,17 +329,130 @@ async def get_answer(question: str) -> Answer:
     - AnswerModel: Объект с полями answer, class_1 и class_2.
     """
     loop = asyncio.get_event_loop()
-    answer_text, class_1, class_2 = await loop.run_in_executor(
-        None,
-        get_answer_from_rag,
-        question,
-        basic_rag_pipeline,
-    )
+    with stage("preprocess"):
+        question_text = preprocess_text(question)
+    # Версия индекса фиксируется на весь запрос, перезагрузка базы знаний его не задевает
+    index = knowledge_index
+    cache_key = (index.version, question_text)
+
+    cached_answer = answer_cache.get(cache_key)
+    if cached_answer is not None:
+        logger.info(f'question="{question}" answer="{cached_answer.answer}" cached="true"')
+        return cached_answer
+
+    # Эмбеддинг и ранжирование идут через микро-батчи, общие для конкурентных запросов
+    with stage("embed"):
+        embedding = await embedder_batcher.submit(question_text)
+    with stage("retrieve"):
+        documents = await loop.run_in_executor(
+            None, lambda: index.retriever.run(query_embedding=embedding)['documents']
+        )
+
+    # Каскад: при уверенном би-энкодере кросс-энкодер пропускается, иначе ранжируется часть кандидатов
+    path, candidates = cascade_policy.select(documents)
+    if not candidates:
+        # Пустой или отфильтрованный индекс: ответа нет
+        document, threshold = None, None
+    elif path == SKIP:
+        # Оценка би-энкодера в другой шкале, чем у ранкера, поэтому и порог у неё свой
+        document, threshold = candidates[0], cascade_policy.answer_score
+    else:
+        with stage("rerank"):
+            document, threshold = (await ranker_batcher.submit((question_text, candidates)))[0], RANKER_THRESHOLD
+
+    if document is None or document.score < threshold:
+        # Классификация вопросов без ответа тоже собирается в батчи по конкурентным запросам
+        answer_text = NO_ANSWER
+        with stage("classify"):
+            class_1, class_2 = await classifier_batcher.submit(question_text)
+    else:
+        with stage("lookup"):
+            answer_text, class_1, class_2 = index.answer_table.get(document.meta['idx'])
 
-    logger.info(f'question="{question}" answer="{answer_text}" class_1="{class_1}" class_2="{class_2}"')
+    logger.info(
+        f'question="{question}" answer="{answer_text}" class_1="{class_1}" class_2="{class_2}" rerank="{path}"'
+    )
 
-    return Answer(
+    answer = Answer(
         answer=answer_text,
         class_1=class_1 if class_1 else "",
         class_2=class_2 if class_2 else "",
+        score=document.score if document is not None else None,
+        extra_fields={"rerank": path},
     )
+    answer_cache.put(cache_key, answer)
+    return answer
+
+
+def answer_batch(questions: list[str]) -> list[Answer]:
+    """
+    Синхронный батчевый аналог get_answer для офлайн-прогонов и пакетной обработки.
+
+    Все вопросы эмбеддятся одним вызовом модели, кандидаты ранжируются батчами по RANKER_MAX_BATCH_SIZE
+    вопросов, вопросы без ответа классифицируются одним вызовом. Вызовы моделей идут через `run`
+    микро-батчеров и не пересекаются с батчами одиночных запросов. Повторы внутри батча и ответы
+    из кэша повторно не считаются.
+
+    Параметры:
+    - questions (list[str]): Исходные вопросы.
+
+    Возвращает:
+    - list[Answer]: Ответы в порядке вопросов.
+    """
+    index = knowledge_index
+    texts = [preprocess_text(question) for question in questions]
+
+    answers = {}
+    missing = []
+    for text in dict.fromkeys(texts):
+        cached_answer = answer_cache.get((index.version, text))
+        if cached_answer is None:
+            missing.append(text)
+        else:
+            answers[text] = cached_answer
+
+    if missing:
+        selections = [
+            cascade_policy.select(index.retriever.run(query_embedding=embedding)['documents'])
+            for embedding in embedder_batcher.run(missing)
+        ]
+        reranked = [
+            (text, candidates) for text, (path, candidates) in zip(missing, selections) if path != SKIP and candidates
+        ]
+        ranked = []
+        for start in range(0, len(reranked), RANKER_MAX_BATCH_SIZE):
+            ranked.extend(ranker_batcher.run(reranked[start:start + RANKER_MAX_BATCH_SIZE]))
+        ranked = iter(ranked)
+
+        found = {}
+        for text, (path, candidates) in zip(missing, selections):
+            if not candidates:
+                found[text] = path, None, None
+            elif path == SKIP:
+                found[text] = path, candidates[0], cascade_policy.answer_score
+            else:
+                found[text] = path, next(ranked)[0], RANKER_THRESHOLD
+
+        unanswered = [
+            text for text, (_, document, threshold) in found.items()
+            if document is None or document.score < threshold
+        ]
+        classes = dict(zip(unanswered, classifier_batcher.run(unanswered)))
+
+        for text, (path, document, _) in found.items():
+            if text in classes:
+                answer_text, (class_1, class_2) = NO_ANSWER, classes[text]
+            else:
+                answer_text, class_1, class_2 = index.answer_table.get(document.meta['idx'])
+            answer = Answer(
+                answer=answer_text,
+                class_1=class_1 if class_1 else "",
+                class_2=class_2 if class_2 else "",
+                score=document.score if document is not None else None,
+                extra_fields={"rerank": path},
+            )
+            answer_cache.put((index.version, text), answer)
+            answers[text] = answer
+
+    logger.info(f'batch: questions={len(questions)} unique={len(answers)} computed={len(missing)}')
+    return [answers[text] for text in texts]
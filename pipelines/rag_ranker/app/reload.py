@@ -0,0 +1,187 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import dataclasses
+import datetime
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, FrozenSet, List, Optional
+
+from app.answers import AnswerTable
+
+logger = logging.getLogger(__name__)
+
+KB_WATCH_INTERVAL = float(os.getenv('KB_WATCH_INTERVAL', '0'))
+
+
+def files_version(paths: List[str]) -> str:
+    """
+    Версия базы знаний - хэш содержимого её файлов.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as file:
+            digest.update(hashlib.sha256(file.read()).digest())
+    return digest.hexdigest()[:12]
+
+
+@dataclasses.dataclass(frozen=True)
+class KnowledgeIndex:
+    """
+    Неизменяемая версия индекса: документы, таблица ответов и ретривер по ним.
+
+    Запрос берёт ссылку на текущую версию один раз и работает с ней до конца,
+    поэтому подмена версии не задевает запросы, которые уже выполняются.
+    """
+
+    version: str
+    answer_table: AnswerTable
+    document_store: Any
+    retriever: Any
+    hashes: FrozenSet[str]
+    stats: Dict[str, Any] = dataclasses.field(default_factory=dict)
+    loaded_at: float = dataclasses.field(default_factory=time.time)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            'version': self.version,
+            'documents': self.document_store.count_documents(),
+            'loaded_at': datetime.datetime.fromtimestamp(self.loaded_at).isoformat(timespec='seconds'),
+            **self.stats,
+        }
+
+
+class Reloader:
+    """
+    Перезагрузка базы знаний с атомарной подменой индекса.
+
+    Новая версия собирается рядом с текущей функцией `build(version)`,
+    эмбеддятся только новые и изменённые вопросы (см. EmbeddingStore), затем `on_swap` публикует её.
+    Если содержимое файлов не изменилось, перезагрузка пропускается.
+    """
+
+    def __init__(
+            self,
+            paths: List[str],
+            build: Callable[[str], KnowledgeIndex],
+            on_swap: Callable[[KnowledgeIndex], None],
+    ):
+        self.paths = paths
+        self.build = build
+        self.on_swap = on_swap
+        self.lock = threading.Lock()
+        self.current: Optional[KnowledgeIndex] = None
+        self.previous: Optional[Dict[str, Any]] = None
+        self.building: Optional[str] = None
+        self.last_reload: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+        self.watcher: Optional[threading.Thread] = None
+
+    def reload(self, force: bool = False) -> Dict[str, Any]:
+        """
+        Пересобирает индекс, если изменились файлы базы знаний.
+
+        Параметры:
+        - force (bool): Собрать индекс, даже если версия файлов не изменилась.
+
+        Возвращает:
+        - Dict[str, Any]: Результат перезагрузки со статусом `reloaded`, `unchanged` или `in_progress`.
+        """
+        if not self.lock.acquire(blocking=False):
+            return {'status': 'in_progress', 'version': self.building}
+        try:
+            version = files_version(self.paths)
+            current = self.current
+            if not force and current is not None and current.version == version:
+                return {'status': 'unchanged', 'version': version}
+
+            self.building = version
+            logger.info(f'knowledge base reload: version="{version}" status="building"')
+            started_at = time.perf_counter()
+            try:
+                index = self.build(version)
+            except Exception as exception:
+                self.last_error = f'{version}: {exception}'
+                logger.exception(f'knowledge base reload: version="{version}" status="failed"')
+                raise
+
+            old_hashes = current.hashes if current is not None else frozenset()
+            result = {
+                'status': 'reloaded',
+                'version': version,
+                'previous_version': current.version if current is not None else None,
+                'added': len(index.hashes - old_hashes),
+                'removed': len(old_hashes - index.hashes),
+                'unchanged': len(index.hashes & old_hashes),
+                'duration': round(time.perf_counter() - started_at, 3),
+            }
+
+            # Старая версия остаётся жива, пока её держат выполняющиеся запросы
+            self.previous = current.info() if current is not None else None
+            self.current = index
+            self.on_swap(index)
+            self.last_reload = result
+            self.last_error = None
+            logger.info(
+                f'knowledge base reload: version="{version}" status="swapped" '
+                f'added={result["added"]} removed={result["removed"]} duration={result["duration"]}'
+            )
+            return result
+        finally:
+            self.building = None
+            self.lock.release()
+
+    def watch(self, interval: float = KB_WATCH_INTERVAL) -> None:
+        """
+        Запускает фоновую проверку файлов базы знаний раз в `interval` секунд, 0 отключает проверку.
+        """
+        if interval <= 0 or self.watcher is not None:
+            return
+        self.watcher = threading.Thread(target=self._watch, args=(interval,), name='kb-watcher', daemon=True)
+        self.watcher.start()
+
+    def _watch(self, interval: float) -> None:
+        stamps = self._stamps()
+        while True:
+            time.sleep(interval)
+            try:
+                new_stamps = self._stamps()
+                if new_stamps == stamps:
+                    continue
+                if self.reload()['status'] != 'in_progress':
+                    stamps = new_stamps
+            except Exception:
+                # Файл мог быть дописан не до конца: текущая версия продолжает работать,
+                # перезагрузка повторится на следующей проверке
+                logger.warning('knowledge base watcher: reload skipped', exc_info=True)
+
+    def _stamps(self) -> List[tuple]:
+        stamps = []
+        for path in self.paths:
+            stat = os.stat(path)
+            stamps.append((stat.st_mtime_ns, stat.st_size))
+        return stamps
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'current': self.current.info() if self.current is not None else None,
+            'previous': self.previous,
+            'building': self.building,
+            'last_reload': self.last_reload,
+            'last_error': self.last_error,
+            'watch_interval': KB_WATCH_INTERVAL,
+        }
@@ -0,0 +1,169 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import contextlib
+import json
+import logging
+import os
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from app.telemetry import Histogram
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = 'X-Request-Id'
+SERVER_TIMING_HEADER = 'Server-Timing'
+
+# Запросы дольше порога логируются с деревом стадий
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '1000'))
+
+# Длительности стадий текущего запроса в миллисекундах, None - запрос не трассируется
+_trace: ContextVar[Optional[Dict[str, float]]] = ContextVar('trace', default=None)
+# Идентификатор запроса, сквозной для бота, шлюза и пайплайна
+_request_id: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+
+STAGE_SECONDS = Histogram('request_stage_seconds', 'Длительность стадии обработки запроса', ['stage'])
+
+
+def start_trace() -> Dict[str, float]:
+    """
+    Начинает трассировку стадий для текущего запроса (задачи asyncio).
+
+    Возвращает:
+    - Dict[str, float]: Словарь, куда стадии запроса записывают свои длительности в миллисекундах.
+      Код в пуле потоков пишет в него же, если запущен через `asyncio.to_thread`, который копирует контекст.
+    """
+    trace = {}
+    _trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Dict[str, float]]:
+    return _trace.get()
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Замеряет стадию запроса в гистограмму `request_stage_seconds` и в трассировку, если она начата.
+    Повторные замеры одной стадии в запросе складываются.
+    """
+    trace = _trace.get()
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started_at
+        STAGE_SECONDS.observe(duration, stage=name)
+        if trace is not None:
+            trace[name] = trace.get(name, 0.0) + duration * 1000
+
+
+def format_server_timing(trace: Dict[str, float]) -> str:
+    return ', '.join(f'{name};dur={duration:.3f}' for name, duration in trace.items())
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """
+    Разбирает заголовок `Server-Timing`, метрики без `dur` пропускаются.
+    """
+    trace = {}
+    for metric in (header or '').split(','):
+        name, *params = [part.strip() for part in metric.split(';')]
+        for param in params:
+            key, _, value = param.partition('=')
+            if name and key.strip() == 'dur':
+                try:
+                    trace[name] = float(value)
+                except ValueError:
+                    pass
+    return trace
+
+
+def merge_server_timing(header: Optional[str], prefix: str) -> None:
+    """
+    Добавляет стадии нижестоящего сервиса из его `Server-Timing` в трассировку текущего запроса
+    с префиксом `<prefix>.`. Повторный ответ того же сервиса (повтор запроса) заменяет прежние стадии.
+    """
+    trace = _trace.get()
+    if trace is not None:
+        for name, duration in parse_server_timing(header).items():
+            trace[f'{prefix}.{name}'] = duration
+
+
+def span_tree(trace: Dict[str, float]) -> str:
+    """
+    Стадии запроса деревом по префиксам: стадии нижестоящих сервисов вложены под их именем.
+    """
+    groups: Dict[str, Dict[str, float]] = {}
+    for key, duration in trace.items():
+        prefix, _, name = key.rpartition('.')
+        groups.setdefault(prefix, {})[name] = duration
+    lines = []
+    for prefix in sorted(groups):
+        depth = prefix.count('.') + 1 if prefix else 0
+        spans = ' '.join(f'{name}={duration:.1f}ms' for name, duration in groups[prefix].items())
+        lines.append('  ' * depth + f'{prefix.rpartition(".")[2] or "request"}: {spans}')
+    return '\n'.join(lines)
+
+
+class RequestTracing:
+    """
+    HTTP middleware сквозной трассировки.
+
+    Берёт идентификатор запроса из `X-Request-Id` или создаёт новый, начинает трассировку стадий
+    и возвращает их длительности с общим временем `total` в `Server-Timing`, а идентификатор - в `X-Request-Id`.
+    Запрос дольше `slow_ms` логируется деревом стадий. С `log_records` каждый трассированный запрос
+    логируется одной JSON записью со всеми стадиями, включая стадии нижестоящих сервисов.
+    Для потоковых ответов время считается до начала ответа.
+    """
+
+    def __init__(self, slow_ms: float = SLOW_REQUEST_MS, log_records: bool = False):
+        self.slow_ms = slow_ms
+        self.log_records = log_records
+
+    async def __call__(self, request, call_next):
+        request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        _request_id.set(request_id)
+        # Обработчик выполняется в копии контекста, словарь трассировки у них общий
+        trace = start_trace()
+        started_at = time.perf_counter()
+        response = await call_next(request)
+        trace['total'] = (time.perf_counter() - started_at) * 1000
+        response.headers[SERVER_TIMING_HEADER] = format_server_timing(trace)
+        response.headers[REQUEST_ID_HEADER] = request_id
+
+        # Служебные запросы без стадий не логируются
+        if self.log_records and len(trace) > 1:
+            record = {
+                'request_id': request_id,
+                'method': request.method,
+                'path': request.url.path,
+                'status': response.status_code,
+                'spans': {name: round(duration, 3) for name, duration in trace.items()},
+            }
+            logger.info(f'request trace: {json.dumps(record, ensure_ascii=False)}')
+        if trace['total'] >= self.slow_ms:
+            logger.warning(
+                f'slow request: request_id="{request_id}" path="{request.url.path}" '
+                f'total={trace["total"]:.1f}ms\n{span_tree(trace)}'
+            )
+        return response
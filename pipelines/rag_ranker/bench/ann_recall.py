@@ -0,0 +1,105 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Бенчмарк recall@k и задержки IVF ретривера против точного InMemoryEmbeddingRetriever.
+
+Векторы базы берутся из кэша эмбеддингов пайплайна (--embeddings), а без него генерируются
+синтетически. Увеличенные базы получаются размножением векторов с шумом,
+запросы - зашумлённые векторы базы, как перефразированные вопросы.
+
+Запуск из каталога пайплайна:
+
+    python -m bench.ann_recall --embeddings embeddings/intfloat_e5-large-v2/embeddings.npy --sizes 0 100000
+"""
+
+import argparse
+import time
+
+import numpy as np
+from haystack import Document
+from haystack.components.retrievers.in_memory import InMemoryEmbeddingRetriever
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+
+from app.ann import IvfIndex
+
+
+def synthetic_embeddings(size: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    topics = rng.normal(size=(max(1, size // 20), dim)).astype(np.float32)
+    return topics[rng.integers(len(topics), size=size)] + 0.5 * rng.normal(size=(size, dim)).astype(np.float32)
+
+
+def enlarge(base: np.ndarray, size: int, rng: np.random.Generator) -> np.ndarray:
+    if size <= len(base):
+        return base
+    scale = 0.1 * float(np.abs(base).mean())
+    extra = base[rng.integers(len(base), size=size - len(base))]
+    return np.concatenate([base, extra + scale * rng.normal(size=extra.shape).astype(np.float32)])
+
+
+def measure(search, queries: np.ndarray):
+    results = []
+    started_at = time.perf_counter()
+    for query in queries:
+        results.append(search(query))
+    return results, (time.perf_counter() - started_at) / len(queries) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--embeddings', default=None, help='матрица .npy из EMBEDDINGS_CACHE_PATH')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[0, 30_000, 100_000],
+                        help='размеры базы, 0 - текущая база без увеличения')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=50)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--haystack-max-size', type=int, default=30_000,
+                        help='выше этого размера InMemoryEmbeddingRetriever не замеряется, слишком долго')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    if args.embeddings:
+        base = np.asarray(np.load(args.embeddings, mmap_mode='r'), dtype=np.float32)
+    else:
+        base = synthetic_embeddings(3_000, 1024, rng)
+
+    print(f'{"size":>8} {"retriever":<16} {"latency, ms":>12} {f"recall@{args.top_k}":>10} {"recall@1":>9}')
+    for size in args.sizes:
+        matrix = enlarge(base, size or len(base), rng)
+        queries = matrix[rng.integers(len(matrix), size=args.queries)]
+        queries = queries + 0.05 * float(np.abs(matrix).mean()) * rng.normal(size=queries.shape).astype(np.float32)
+
+        # Точный ответ для recall считается прямым перемножением матриц
+        exact = np.argsort(-(queries @ matrix.T), axis=1)[:, :args.top_k]
+        documents = [Document(content=str(i), meta={'idx': i}, embedding=row.tolist()) for i, row in enumerate(matrix)]
+
+        def report(name, results, latency):
+            found = [[doc.meta['idx'] for doc in docs] for docs in results]
+            recall = np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, exact)])
+            recall_1 = np.mean([bool(f) and f[0] == e[0] for f, e in zip(found, exact)])
+            print(f'{len(matrix):>8} {name:<16} {latency:>12.2f} {recall:>10.3f} {recall_1:>9.3f}')
+
+        if len(matrix) <= args.haystack_max_size:
+            document_store = InMemoryDocumentStore()
+            document_store.write_documents(documents)
+            retriever = InMemoryEmbeddingRetriever(document_store, top_k=args.top_k)
+            report('exact', *measure(lambda q: retriever.run(query_embedding=q.tolist())['documents'], queries))
+
+        index = IvfIndex.build(documents)
+        for nprobe in args.nprobe:
+            report(f'ivf nprobe={nprobe}', *measure(lambda q: index.search(q, args.top_k, nprobe), queries))
+
+
+if __name__ == '__main__':
+    main()
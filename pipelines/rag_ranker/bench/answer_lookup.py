@@ -0,0 +1,69 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Микро-бенчмарк поиска ответа: скан DataFrame по тексту вопроса против AnswerTable по индексу.
+
+Запуск из каталога пайплайна:
+
+    python -m bench.answer_lookup --sizes 1000 10000 100000 1000000
+"""
+
+import argparse
+import random
+import timeit
+
+import pandas as pd
+
+from app.answers import AnswerTable
+
+
+def make_dataframe(size: int) -> pd.DataFrame:
+    # Вопросы повторяются, как в БЗ+кейсах, где у одного вопроса бывает несколько строк
+    return pd.DataFrame({
+        'Вопрос': [f'Как сменить пароль на RUTUBE, вариант {i % (size // 2 or 1)}?' for i in range(size)],
+        'Ответ из БЗ': [f'Ответ {i}' for i in range(size)],
+        'Классификатор 1 уровня': [f'Класс {i % 10}' for i in range(size)],
+        'Классификатор 2 уровня': [f'Подкласс {i % 100}' for i in range(size)],
+    })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f'{"rows":>10} {"df scan, us":>14} {"table, us":>12} {"speedup":>10}')
+    for size in args.sizes:
+        df = make_dataframe(size)
+        table = AnswerTable(df, 'Вопрос')
+        targets = random.Random(42).sample(range(size), min(args.lookups, size))
+
+        def scan():
+            for idx in targets:
+                target_answer = df.loc[df['Вопрос'] == df.at[idx, 'Вопрос']].iloc[0]
+                target_answer['Ответ из БЗ']
+
+        def lookup():
+            for idx in targets:
+                table.get(idx)
+
+        scan_us = min(timeit.repeat(scan, number=1, repeat=3)) / len(targets) * 1e6
+        lookup_us = min(timeit.repeat(lookup, number=1, repeat=3)) / len(targets) * 1e6
+        print(f'{size:>10} {scan_us:>14.1f} {lookup_us:>12.3f} {scan_us / lookup_us:>9.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Офлайн оценка каскадного ранжирования на реальных вопросах.
+
+Для каждого набора порогов считается распределение путей, среднее время стадии ранжирования
+и доля вопросов, где ответ совпал с полным ранжированием всех кандидатов.
+Переменные KNOWLEDGE_BASE_FILE_PATH, CASES_FILE_PATH и REPLACEMENTS_FILE_PATH должны быть заданы.
+
+Запуск из каталога пайплайна:
+
+    python -m bench.cascade_eval --questions ../../data/prep/real_questions.txt
+"""
+
+import argparse
+import itertools
+import time
+from collections import Counter
+
+from app import model
+from app.cascade import CascadePolicy, SKIP
+from app.model import embed_texts, preprocess_text, rank_documents, resolve_answer
+
+
+def read_questions(path: str) -> list[str]:
+    with open(path, 'r', encoding='utf-8') as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', default='../../data/prep/real_questions.txt')
+    parser.add_argument('--skip-scores', type=float, nargs='+', default=[0.9, 0.95, 0.98])
+    parser.add_argument('--skip-margins', type=float, nargs='+', default=[0.02])
+    parser.add_argument('--flat-spreads', type=float, nargs='+', default=[0.02, 0.05, 0.1])
+    args = parser.parse_args()
+
+    model.init()
+    texts = [preprocess_text(question) for question in read_questions(args.questions)]
+    embeddings = embed_texts(texts)
+    retrieved = [model.knowledge_index.retriever.run(query_embedding=embedding)['documents'] for embedding in embeddings]
+
+    def rerank(text, candidates):
+        started_at = time.perf_counter()
+        document = rank_documents([(text, candidates)])[0][0]
+        return document, time.perf_counter() - started_at
+
+    # Эталон - полное ранжирование всех кандидатов
+    reference, reference_time = [], 0.0
+    for text, documents in zip(texts, retrieved):
+        document, elapsed = rerank(text, documents)
+        reference_time += elapsed
+        reference.append(resolve_answer(text, document))
+
+    print(f'{"policy":<32} {"rerank, ms":>10} {"agreement":>10}  paths')
+    print(f'{"full":<32} {reference_time / len(texts) * 1000:>10.1f} {1:>10.1%}  rerank_{len(retrieved[0])}')
+
+    for skip_score, skip_margin, flat_spread in itertools.product(
+            args.skip_scores, args.skip_margins, args.flat_spreads):
+        policy = CascadePolicy(enabled=True, skip_score=skip_score, skip_margin=skip_margin, flat_spread=flat_spread)
+        total_time, agreed, paths = 0.0, 0, Counter()
+        for text, documents, expected in zip(texts, retrieved, reference):
+            path, candidates = policy.select(documents)
+            paths[path] += 1
+            if path == SKIP:
+                answer = resolve_answer(text, candidates[0], policy.answer_score)
+            else:
+                document, elapsed = rerank(text, candidates)
+                total_time += elapsed
+                answer = resolve_answer(text, document)
+            agreed += answer[0] == expected[0]
+
+        name = f'skip>={skip_score} margin>={skip_margin} spread={flat_spread}'
+        distribution = ' '.join(f'{path}={count}' for path, count in sorted(paths.items()))
+        print(f'{name:<32} {total_time / len(texts) * 1000:>10.1f} {agreed / len(texts):>10.1%}  {distribution}')
+
+
+if __name__ == '__main__':
+    main()
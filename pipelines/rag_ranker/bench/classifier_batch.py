@@ -0,0 +1,71 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Пропускная способность классификаторов: по одному вопросу против батчей и повторный прогон из кэша.
+
+Запуск из каталога пайплайна (нужны файлы моделей в /models или пути через аргументы):
+
+    python -m bench.classifier_batch --questions ../../data/prep/real_questions.txt
+"""
+
+import argparse
+import time
+
+from app.classifier import ClassifierEngine
+
+
+def read_questions(path: str) -> list[str]:
+    with open(path, 'r', encoding='utf-8') as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def measure(engine: ClassifierEngine, questions: list[str], batch_size: int) -> float:
+    started_at = time.perf_counter()
+    for start in range(0, len(questions), batch_size):
+        engine.classify(questions[start:start + batch_size])
+    return time.perf_counter() - started_at
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', default='../../data/prep/real_questions.txt')
+    parser.add_argument('--models', default='/models')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    args = parser.parse_args()
+
+    paths = [
+        (f'{args.models}/model_{level}/classifier_{level}.pkl',
+         f'{args.models}/model_{level}/label_encoder_{level}.pkl',
+         f'{args.models}/model_{level}/vectorizer_{level}.pkl')
+        for level in (1, 2)
+    ]
+    questions = read_questions(args.questions)
+
+    print(f'{"variant":<12} {"total, ms":>10} {"per question, ms":>17}')
+    for batch_size in args.batch_sizes:
+        engine = ClassifierEngine(paths, cache_size=0)
+        engine.load()
+        elapsed = measure(engine, questions, batch_size)
+        print(f'{f"batch={batch_size}":<12} {elapsed * 1000:>10.1f} {elapsed / len(questions) * 1000:>17.3f}')
+
+    engine = ClassifierEngine(paths)
+    engine.load()
+    measure(engine, questions, 1)
+    elapsed = measure(engine, questions, 1)
+    print(f'{"cached":<12} {elapsed * 1000:>10.1f} {elapsed / len(questions) * 1000:>17.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Оценка компакции индекса на реальных вопросах.
+
+Для каждого порога близости считается размер индекса, время ранжирования кандидатов
+и доля вопросов, где ответ совпал с индексом без компакции.
+Переменные KNOWLEDGE_BASE_FILE_PATH, CASES_FILE_PATH и REPLACEMENTS_FILE_PATH должны быть заданы.
+
+Запуск из каталога пайплайна:
+
+    python -m bench.compaction_eval --questions ../../data/prep/real_questions.txt
+"""
+
+import argparse
+import time
+
+from haystack import Document
+from haystack.components.retrievers.in_memory import InMemoryEmbeddingRetriever
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+
+from app import model
+from app.compaction import drop_exact_duplicates, merge_near_duplicates
+from app.embedding_store import EmbeddingStore
+from app.inference import embedding_key
+from app.model import embed_texts, preprocess_text, rank_documents, resolve_answer
+
+
+def read_questions(path: str) -> list[str]:
+    with open(path, 'r', encoding='utf-8') as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def evaluate(docs, texts, embeddings, answers):
+    document_store = InMemoryDocumentStore()
+    document_store.write_documents(docs)
+    retriever = InMemoryEmbeddingRetriever(document_store, top_k=50)
+
+    results, rerank_time = [], 0.0
+    for text, embedding in zip(texts, embeddings):
+        candidates = retriever.run(query_embedding=embedding)['documents']
+        started_at = time.perf_counter()
+        document = rank_documents([(text, candidates)])[0][0]
+        rerank_time += time.perf_counter() - started_at
+        results.append(resolve_answer(text, document, answers=answers)[0])
+    return results, rerank_time / len(texts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', default='../../data/prep/real_questions.txt')
+    parser.add_argument('--similarities', type=float, nargs='+', default=[0.99, 0.98, 0.95, 0.9])
+    args = parser.parse_args()
+
+    model.init()
+    answers = model.knowledge_index.answer_table
+    final_df = model.load_knowledge_base()
+    docs = [Document(content=row["Вопрос"], meta={"idx": index}) for index, row in final_df.iterrows()]
+    docs = EmbeddingStore(embedding_key(model.embed_model)).embed_documents(docs, model.doc_embedder)
+
+    texts = [preprocess_text(question) for question in read_questions(args.questions)]
+    embeddings = embed_texts(texts)
+
+    reference, reference_time = evaluate(docs, texts, embeddings, answers)
+    print(f'{"variant":<16} {"documents":>10} {"rerank, ms":>10} {"agreement":>10}')
+    print(f'{"none":<16} {len(docs):>10} {reference_time * 1000:>10.1f} {1:>10.1%}')
+
+    exact_docs, _ = drop_exact_duplicates(docs, answers)
+    variants = [('exact', exact_docs)]
+    variants += [
+        (f'near>={similarity}', merge_near_duplicates(exact_docs, answers, similarity)[0])
+        for similarity in args.similarities
+    ]
+    for name, variant_docs in variants:
+        results, rerank_time = evaluate(variant_docs, texts, embeddings, answers)
+        agreement = sum(result == expected for result, expected in zip(results, reference)) / len(texts)
+        print(f'{name:<16} {len(variant_docs):>10} {rerank_time * 1000:>10.1f} {agreement:>10.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Сравнение общего нормализатора с прежними реализациями пайплайнов: совпадение результатов и скорость.
+
+Прежние функции скопированы ниже как эталон: `preprocess_text` из rag_ranker
+и `preprocess_question` из faq/faq_cases (новый MorphAnalyzer на каждый вопрос).
+Скрипт завершается с ошибкой, если хотя бы один результат отличается.
+Отдельно печатается задержка стадии предобработки faq: анализатор pymorphy2 на каждый вопрос,
+общий анализатор и общий анализатор с кэшем лемм.
+
+Запуск из каталога пайплайна:
+
+    python -m bench.normalizer_compare --questions ../../data/prep/real_questions.txt
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+
+import pymorphy2
+
+from app.normalizer import Normalizer
+
+
+def reference_preprocess_text(text, replace_dict):
+    tokens = re.findall(r'\w+|[^\w\s]', text.lower())
+    processed_tokens = []
+
+    for token in tokens:
+        if re.match(r'\w+', token):
+            if replace_dict and token in replace_dict:
+                processed_tokens.append(replace_dict[token])
+            else:
+                processed_tokens.append(token)
+        else:
+            processed_tokens.append(token)
+
+    processed_text = ''
+    for i, token in enumerate(processed_tokens):
+        if token in '.,!?;:':
+            processed_text = processed_text.rstrip() + token + ' '
+        else:
+            processed_text += token + ' '
+
+    return processed_text.strip()
+
+
+def reference_preprocess_question(question, replace_dict):
+    morph = pymorphy2.MorphAnalyzer()
+
+    question = re.sub(r'[^\w\s-]', '', question.lower())
+
+    words = question.split()
+    replaced_words = [replace_dict.get(morph.parse(word)[0].normal_form, word) for word in words]
+    return ' '.join(replaced_words)
+
+
+def read_questions(path: str) -> list[str]:
+    with open(path, 'r', encoding='utf-8') as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def compare(name, reference, candidate, questions, repeat):
+    mismatches = [
+        (question, expected, actual)
+        for question in questions
+        if (expected := reference(question)) != (actual := candidate(question))
+    ]
+    for question, expected, actual in mismatches[:10]:
+        print(f'  mismatch: {question!r}\n    expected: {expected!r}\n    actual:   {actual!r}')
+
+    timings = []
+    for function in (reference, candidate):
+        started_at = time.perf_counter()
+        for _ in range(repeat):
+            for question in questions:
+                function(question)
+        timings.append((time.perf_counter() - started_at) / (repeat * len(questions)) * 1e6)
+
+    print(
+        f'{name:<20} {timings[0]:>14.1f} {timings[1]:>14.1f} {timings[0] / timings[1]:>8.1f}x '
+        f'{len(mismatches):>10}'
+    )
+    return len(mismatches)
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def preprocess_latency(questions: list[str], replace_dict: dict) -> None:
+    """
+    Задержка стадии предобработки faq по вопросам: анализатор на каждый вопрос (как было),
+    общий анализатор без кэша лемм и общий анализатор с LRU кэшем лемм.
+    """
+    cached = Normalizer(replace_dict)
+    variants = [
+        ('per-request morph', lambda question: reference_preprocess_question(question, replace_dict)),
+        ('shared morph', Normalizer(replace_dict, lemma_cache_size=0).normalize_question),
+        ('shared morph + lru', cached.normalize_question),
+    ]
+
+    print(f'\n{"faq preprocess":<20} {"p50, us":>10} {"p95, us":>10} {"mean, us":>10}')
+    for name, function in variants:
+        function(questions[0])
+        latencies = []
+        for question in questions:
+            started_at = time.perf_counter()
+            function(question)
+            latencies.append((time.perf_counter() - started_at) * 1e6)
+        print(
+            f'{name:<20} {percentile(latencies, 0.5):>10.1f} {percentile(latencies, 0.95):>10.1f} '
+            f'{sum(latencies) / len(latencies):>10.1f}'
+        )
+    print(f'lemma cache: {cached.stats()["lemma_cache"]}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', default='../../data/prep/real_questions.txt')
+    parser.add_argument('--replacements', default='../../config/replacements.json')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions)
+    with open(args.replacements, 'r', encoding='utf-8') as file:
+        replace_dict = json.load(file)
+    normalizer = Normalizer(replace_dict)
+
+    print(f'{"normalizer":<20} {"before, us":>14} {"after, us":>14} {"speedup":>9} {"mismatches":>10}')
+    mismatches = compare(
+        'rag_ranker',
+        lambda question: reference_preprocess_text(question, replace_dict),
+        normalizer.normalize,
+        questions,
+        args.repeat,
+    )
+    # Прежняя реализация faq создаёт анализатор на каждый вопрос, поэтому один прогон
+    mismatches += compare(
+        'faq',
+        lambda question: reference_preprocess_question(question, replace_dict),
+        normalizer.normalize_question,
+        questions,
+        1,
+    )
+    preprocess_latency(questions, replace_dict)
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
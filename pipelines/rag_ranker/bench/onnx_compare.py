@@ -0,0 +1,111 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Сравнение бэкендов инференса по точности и задержке: torch, onnx и onnx с int8 квантизацией.
+
+Каждый вариант запускается в отдельном процессе с нужными переменными окружения,
+точность считается как совпадение top-1 ответа и классов с вариантом torch.
+Переменные KNOWLEDGE_BASE_FILE_PATH, CASES_FILE_PATH и REPLACEMENTS_FILE_PATH должны быть заданы.
+
+Запуск из каталога пайплайна:
+
+    python -m bench.onnx_compare --questions ../../tests/questions.txt --device cpu
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+VARIANTS = {
+    'torch': {'INFERENCE_BACKEND': 'torch'},
+    'onnx': {'INFERENCE_BACKEND': 'onnx', 'ONNX_QUANTIZE': 'false'},
+    'onnx-int8': {'INFERENCE_BACKEND': 'onnx', 'ONNX_QUANTIZE': 'true'},
+}
+
+
+def read_questions(path: str) -> list[str]:
+    with open(path, 'r', encoding='utf-8') as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def run_worker(questions_path: str, output_path: str) -> None:
+    from app import model
+
+    model.init()
+    questions = read_questions(questions_path)
+    # Прогрев, чтобы первая загрузка не попадала в задержки
+    model.get_answer_from_rag(questions[0])
+
+    answers, latencies = [], []
+    for question in questions:
+        started_at = time.perf_counter()
+        answers.append(list(model.get_answer_from_rag(question)))
+        latencies.append(time.perf_counter() - started_at)
+
+    with open(output_path, 'w', encoding='utf-8') as file:
+        json.dump({'answers': answers, 'latencies': latencies}, file, ensure_ascii=False, default=str)
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', default='../../tests/questions.txt')
+    parser.add_argument('--device', default=None, help='значение INFERENCE_DEVICE для всех вариантов')
+    parser.add_argument('--variants', nargs='+', default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument('--worker', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.questions, args.worker)
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for variant in args.variants:
+            output_path = os.path.join(tmp, f'{variant}.json')
+            env = {**os.environ, **VARIANTS[variant]}
+            if args.device:
+                env['INFERENCE_DEVICE'] = args.device
+            print(f'running {variant}...', file=sys.stderr)
+            subprocess.run(
+                [sys.executable, '-m', 'bench.onnx_compare', '--questions', args.questions, '--worker', output_path],
+                env=env, check=True,
+            )
+            with open(output_path, 'r', encoding='utf-8') as file:
+                results[variant] = json.load(file)
+
+    reference = results.get('torch') or results[args.variants[0]]
+    print(f'{"variant":<10} {"mean, ms":>9} {"p50, ms":>9} {"p95, ms":>9} {"top-1":>7} {"class_1":>8} {"class_2":>8}')
+    for variant, result in results.items():
+        latencies = [latency * 1000 for latency in result['latencies']]
+        pairs = list(zip(result['answers'], reference['answers']))
+        agreement = [sum(answer[i] == expected[i] for answer, expected in pairs) / len(pairs) for i in range(3)]
+        print(
+            f'{variant:<10} {statistics.mean(latencies):>9.1f} {percentile(latencies, 0.5):>9.1f} '
+            f'{percentile(latencies, 0.95):>9.1f} {agreement[0]:>7.1%} {agreement[1]:>8.1%} {agreement[2]:>8.1%}'
+        )
+
+
+if __name__ == '__main__':
+    main()
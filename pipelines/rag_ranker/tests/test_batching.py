@@ -0,0 +1,93 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.batching import MicroBatcher
+
+
+class Model:
+    """
+    Модель, которая запоминает размеры батчей и замечает одновременные вызовы.
+    """
+
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.batches = []
+        self.active = 0
+        self.overlaps = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, items):
+        with self.lock:
+            self.active += 1
+            self.overlaps += self.active > 1
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        self.batches.append(len(items))
+        return [item * 2 for item in items]
+
+
+def test_concurrent_submits_share_one_batch():
+    model = Model()
+    batcher = MicroBatcher('model', model, max_batch_size=8, max_wait_ms=50)
+
+    async def main():
+        return await asyncio.gather(*(batcher.submit(item) for item in range(5)))
+
+    assert asyncio.run(main()) == [0, 2, 4, 6, 8]
+    assert model.batches == [5]
+
+
+def test_sync_run_does_not_overlap_batches():
+    model = Model(delay=0.02)
+    batcher = MicroBatcher('model', model, max_batch_size=2, max_wait_ms=1)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        sync_calls = [loop.run_in_executor(None, batcher.run, [item]) for item in range(4)]
+        submits = [batcher.submit(item) for item in range(8)]
+        return await asyncio.gather(*sync_calls, *submits)
+
+    asyncio.run(main())
+    assert model.overlaps == 0
+
+
+def test_waiters_of_dead_worker_fail_instead_of_hanging():
+    batcher = MicroBatcher('model', Model(), max_batch_size=8, max_wait_ms=1000)
+
+    async def main():
+        first = asyncio.ensure_future(batcher.submit(1))
+        await asyncio.sleep(0.01)
+        # Обработчик останавливается, пока собирает батч
+        batcher.worker.cancel()
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(first, 1)
+
+        # Ожидающий, оставшийся в очереди остановленного обработчика
+        queued = asyncio.get_running_loop().create_future()
+        batcher.queue.put_nowait((2, queued))
+
+        # Следующий запрос перезапускает обработчик, а оставшиеся в старой очереди получают ошибку
+        batcher.max_wait = 0.001
+        assert await asyncio.wait_for(batcher.submit(3), 1) == 6
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(queued, 1)
+
+    asyncio.run(main())
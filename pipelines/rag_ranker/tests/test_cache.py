@@ -0,0 +1,73 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import pytest
+
+from app import cache
+from app.cache import AnswerCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    answers = AnswerCache(max_size=2, ttl=60)
+    answers.put('a', 1)
+    answers.put('b', 2)
+    # Чтение делает запись свежей, вытесняется давно не читанная
+    assert answers.get('a') == 1
+    answers.put('c', 3)
+
+    assert answers.get('b') is None
+    assert answers.get('a') == 1
+    assert answers.get('c') == 3
+    assert answers.stats()['evictions'] == 1
+
+
+def test_entry_expires_after_ttl(clock):
+    answers = AnswerCache(max_size=10, ttl=60)
+    answers.put('a', 1)
+
+    clock[0] += 59
+    assert answers.get('a') == 1
+    clock[0] += 2
+    assert answers.get('a') is None
+    assert answers.stats()['size'] == 0
+    assert answers.stats()['misses'] == 1
+
+
+def test_rewrite_refreshes_ttl(clock):
+    answers = AnswerCache(max_size=10, ttl=60)
+    answers.put('a', 1)
+    clock[0] += 50
+    answers.put('a', 2)
+    clock[0] += 50
+
+    assert answers.get('a') == 2
+
+
+def test_invalidate_and_disabled_cache(clock):
+    answers = AnswerCache(max_size=10, ttl=60)
+    answers.put('a', 1)
+    answers.invalidate()
+    assert answers.get('a') is None
+
+    disabled = AnswerCache(max_size=0, ttl=60)
+    disabled.put('a', 1)
+    assert disabled.get('a') is None
+    assert disabled.stats()['size'] == 0
@@ -0,0 +1,57 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import pandas as pd
+from haystack import Document
+
+from app.answers import AnswerTable
+from app.compaction import drop_exact_duplicates
+
+
+def answer_table(rows):
+    return AnswerTable(
+        pd.DataFrame(rows, columns=['Вопрос', 'Ответ из БЗ', 'Классификатор 1 уровня', 'Классификатор 2 уровня']),
+        'Вопрос',
+    )
+
+
+def documents(questions):
+    return [Document(content=question, meta={'idx': idx}) for idx, question in enumerate(questions)]
+
+
+def test_same_question_with_different_answers_is_kept():
+    questions = ['Как удалить канал?', 'как удалить канал']
+    table = answer_table([
+        (questions[0], 'Откройте настройки канала', 'Канал', 'Удаление'),
+        (questions[1], 'Напишите в поддержку', 'Поддержка', 'Обращение'),
+    ])
+
+    unique, dropped = drop_exact_duplicates(documents(questions), table)
+
+    assert dropped == 0
+    assert {table.get(doc.meta['idx'])[0] for doc in unique} == {'Откройте настройки канала', 'Напишите в поддержку'}
+
+
+def test_same_question_with_same_answer_is_dropped():
+    questions = ['Как удалить канал?', 'как  удалить канал', 'Как сменить пароль?']
+    table = answer_table([
+        (questions[0], 'Откройте настройки канала', 'Канал', 'Удаление'),
+        (questions[1], 'Откройте настройки канала', 'Канал', 'Удаление'),
+        (questions[2], 'Нажмите «Забыли пароль»', 'Аккаунт', 'Пароль'),
+    ])
+
+    unique, dropped = drop_exact_duplicates(documents(questions), table)
+
+    assert dropped == 1
+    assert [doc.content for doc in unique] == [questions[0], questions[2]]
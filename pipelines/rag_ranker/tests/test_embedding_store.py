@@ -0,0 +1,86 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+
+from haystack import Document
+
+from app.embedding_store import EmbeddingStore
+
+
+class CountingEmbedder:
+    """
+    Эмбеддер документов, который запоминает, какие тексты ему передали.
+    """
+
+    def __init__(self):
+        self.texts = []
+
+    def warm_up(self) -> None:
+        pass
+
+    def run(self, documents):
+        self.texts.extend(document.content for document in documents)
+        return {
+            'documents': [
+                Document(content=document.content, embedding=[float(len(document.content)), 1.0])
+                for document in documents
+            ],
+        }
+
+
+def documents(*questions):
+    return [Document(content=question) for question in questions]
+
+
+def segment_files(store):
+    return sorted(name for name in os.listdir(store.path) if name.endswith('.npy'))
+
+
+def test_only_new_documents_are_embedded_and_appended(tmp_path):
+    embedder = CountingEmbedder()
+    EmbeddingStore('model', str(tmp_path)).embed_documents(documents('a', 'bb'), embedder)
+
+    store = EmbeddingStore('model', str(tmp_path), compact_ratio=1.0)
+    first_segment = segment_files(store)
+    docs = store.embed_documents(documents('a', 'bb', 'ccc'), embedder)
+
+    assert embedder.texts == ['a', 'bb', 'ccc']
+    assert [doc.embedding for doc in docs] == [[1.0, 1.0], [2.0, 1.0], [3.0, 1.0]]
+    # Старый сегмент не переписывается, новые эмбеддинги ложатся рядом
+    assert len(segment_files(store)) == 2
+    assert segment_files(store)[0] == first_segment[0]
+
+
+def test_removed_documents_are_compacted_away(tmp_path):
+    embedder = CountingEmbedder()
+    EmbeddingStore('model', str(tmp_path)).embed_documents(documents('a', 'bb', 'ccc', 'dddd'), embedder)
+
+    store = EmbeddingStore('model', str(tmp_path), compact_ratio=0.25)
+    docs = store.embed_documents(documents('a', 'eeeee'), embedder)
+
+    assert [doc.embedding for doc in docs] == [[1.0, 1.0], [5.0, 1.0]]
+    assert len(segment_files(store)) == 1
+    assert set(EmbeddingStore('model', str(tmp_path)).rows) == set(store.rows)
+    assert len(store.rows) == 2
+
+
+def test_segments_are_merged_above_limit(tmp_path):
+    embedder = CountingEmbedder()
+    for count in range(1, 5):
+        store = EmbeddingStore('model', str(tmp_path), compact_ratio=1.0, max_segments=2)
+        store.embed_documents(documents(*('x' * length for length in range(1, count + 1))), embedder)
+
+    assert len(segment_files(store)) <= 2
+    assert embedder.texts == ['x', 'xx', 'xxx', 'xxxx']
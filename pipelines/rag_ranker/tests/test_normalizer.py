@@ -0,0 +1,75 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('pymorphy2')
+
+from app.normalizer import Normalizer, morph_analyzer  # noqa: E402
+from bench import normalizer_compare  # noqa: E402
+from bench.normalizer_compare import reference_preprocess_question, reference_preprocess_text  # noqa: E402
+
+ROOT = Path(__file__).resolve().parents[3]
+
+# Граничные случаи токенизации и расстановки знаков препинания
+EDGE_CASES = [
+    '',
+    '   ',
+    '...',
+    '?!',
+    ', начало с запятой',
+    'Как смотреть Рутуб на Смарт ТВ?',
+    'рутубе,ютубе;шортс:урл!',
+    'Что такое "шортс" (короткие видео)?',
+    'кто-то  где-то   как-то - 10 раз...',
+    'Самсунг ТВ , не работает !',
+    'email: user@example.com, сайт https://rutube.ru/video/123',
+    'ЁЛКА ёлка Ёлка',
+]
+
+
+@pytest.fixture(scope='module')
+def replacements():
+    with open(ROOT / 'config' / 'replacements.json', 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+@pytest.fixture(scope='module')
+def questions():
+    lines = []
+    for path in (ROOT / 'data' / 'prep' / 'real_questions.txt', ROOT / 'tests' / 'questions.txt'):
+        with open(path, 'r', encoding='utf-8') as file:
+            lines.extend(line.strip() for line in file if line.strip())
+    return EDGE_CASES + lines
+
+
+def test_normalize_matches_rag_ranker_preprocess_text(replacements, questions):
+    normalizer = Normalizer(replacements)
+
+    for question in questions:
+        assert normalizer.normalize(question) == reference_preprocess_text(question, replacements), question
+
+
+def test_normalize_question_matches_faq_preprocess_question(replacements, questions, monkeypatch):
+    # Прежняя реализация создаёт анализатор на каждый вопрос, на результат разбора это не влияет
+    morph = morph_analyzer()
+    monkeypatch.setattr(normalizer_compare.pymorphy2, 'MorphAnalyzer', lambda: morph)
+    normalizer = Normalizer(replacements)
+
+    for question in questions:
+        assert normalizer.normalize_question(question) == reference_preprocess_question(question, replacements), \
+            question
@@ -0,0 +1,415 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import contextlib
+import logging
+import math
+import os
+import random
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+import aiohttp
+
+from app.telemetry import Histogram
+from app.tracing import REQUEST_ID_HEADER, SERVER_TIMING_HEADER, current_request_id, merge_server_timing
+
+logger = logging.getLogger(__name__)
+
+QNA_POOL_LIMIT = int(os.getenv('QNA_POOL_LIMIT', '100'))
+QNA_KEEPALIVE_TIMEOUT = float(os.getenv('QNA_KEEPALIVE_TIMEOUT', '30'))
+QNA_CONNECT_TIMEOUT = float(os.getenv('QNA_CONNECT_TIMEOUT', '5'))
+QNA_READ_TIMEOUT = float(os.getenv('QNA_READ_TIMEOUT', '60'))
+QNA_RETRIES = int(os.getenv('QNA_RETRIES', '2'))
+QNA_RETRY_BACKOFF_MS = float(os.getenv('QNA_RETRY_BACKOFF_MS', '100'))
+
+QNA_HEALTH_INTERVAL = float(os.getenv('QNA_HEALTH_INTERVAL', '5'))
+QNA_HEALTH_TIMEOUT = float(os.getenv('QNA_HEALTH_TIMEOUT', '2'))
+QNA_BREAKER_FAILURES = int(os.getenv('QNA_BREAKER_FAILURES', '5'))
+QNA_BREAKER_OPEN_SECONDS = float(os.getenv('QNA_BREAKER_OPEN_SECONDS', '10'))
+QNA_BREAKER_SLOW_MS = float(os.getenv('QNA_BREAKER_SLOW_MS', '30000'))
+QNA_BREAKER_HALF_OPEN_RATIO = float(os.getenv('QNA_BREAKER_HALF_OPEN_RATIO', '0.1'))
+QNA_HEDGE_PERCENTILE = float(os.getenv('QNA_HEDGE_PERCENTILE', '0'))
+
+# Сколько последних задержек хранится и сколько нужно для расчёта задержки хеджирования
+LATENCY_WINDOW = 1000
+HEDGE_MIN_SAMPLES = 20
+
+UPSTREAM_SECONDS = Histogram(
+    'qna_upstream_seconds', 'Время ответа реплики пайплайна на одиночный вопрос', ['pipeline', 'outcome']
+)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class PipelineError(Exception):
+    def __init__(self, status: int, text: str):
+        super().__init__(f'Ошибка получения ответа: {status} {text}')
+        self.status = status
+
+
+def is_retryable(exception: BaseException) -> bool:
+    """
+    Повторяются ошибки соединения и 503 (реплика ещё не готова): запрос не дошёл до пайплайна
+    или соединение из пула оказалось закрытым. Таймаут чтения не повторяется, пайплайн мог уже считать ответ.
+    """
+    if isinstance(exception, PipelineError):
+        return exception.status == 503
+    return (
+            isinstance(exception, aiohttp.ClientConnectionError)
+            and not isinstance(exception, aiohttp.ServerTimeoutError)
+    )
+
+
+def is_replica_failure(exception: BaseException) -> bool:
+    # Ошибки запроса (4xx) говорят о запросе, а не о реплике
+    if isinstance(exception, PipelineError):
+        return exception.status >= 500
+    return isinstance(exception, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+class Replica:
+    """
+    Реплика пайплайна с автоматом размыкания цепи.
+
+    После `QNA_BREAKER_FAILURES` ошибок или медленных ответов подряд реплика исключается на
+    `QNA_BREAKER_OPEN_SECONDS` секунд, затем получает долю `QNA_BREAKER_HALF_OPEN_RATIO` запросов,
+    доля удваивается с каждым успешным ответом до полного возвращения. Ошибка в это время снова исключает реплику.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.healthy = True
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.admit_ratio = 1.0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+
+    def available(self, now: float) -> bool:
+        if not self.healthy:
+            return False
+        if self.state == OPEN:
+            if now - self.opened_at < QNA_BREAKER_OPEN_SECONDS:
+                return False
+            self.state = HALF_OPEN
+            self.admit_ratio = QNA_BREAKER_HALF_OPEN_RATIO
+            logger.info(f'replica half-open: url="{self.url}"')
+        if self.state == HALF_OPEN:
+            return random.random() < self.admit_ratio
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        if self.state == HALF_OPEN:
+            self.admit_ratio = min(1.0, self.admit_ratio * 2)
+            if self.admit_ratio >= 1.0:
+                self.state = CLOSED
+                logger.info(f'replica closed: url="{self.url}"')
+
+    def record_failure(self, now: float) -> None:
+        self.failures += 1
+        self.errors += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= QNA_BREAKER_FAILURES):
+            self.state = OPEN
+            self.opened_at = now
+            self.ejections += 1
+            logger.warning(f'replica ejected: url="{self.url}" failures={self.failures}')
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'state': self.state,
+            'admit_ratio': self.admit_ratio if self.state == HALF_OPEN else None,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'errors': self.errors,
+            'ejections': self.ejections,
+        }
+
+
+class PipelineClient:
+    """
+    HTTP клиент пайплайна с несколькими репликами и одной сессией на всё время работы приложения.
+
+    Соединения переиспользуются через keep-alive и ограничены общим пулом `limit`.
+    Запрос уходит доступной реплике с наименьшим числом запросов в работе. Реплики
+    периодически проверяются через `/health/ready`, не готовые и исключённые автоматом
+    размыкания не получают запросов, пока есть другие. При ошибке соединения запрос повторяется
+    на другой реплике до `retries` раз с экспоненциальной задержкой и случайным разбросом.
+    Если задан `hedge_percentile`, запрос, не получивший ответ за этот перцентиль задержек,
+    дублируется на другую реплику, используется первый ответ.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            urls: List[str],
+            limit: int = QNA_POOL_LIMIT,
+            keepalive_timeout: float = QNA_KEEPALIVE_TIMEOUT,
+            connect_timeout: float = QNA_CONNECT_TIMEOUT,
+            read_timeout: float = QNA_READ_TIMEOUT,
+            retries: int = QNA_RETRIES,
+            retry_backoff_ms: float = QNA_RETRY_BACKOFF_MS,
+            health_interval: float = QNA_HEALTH_INTERVAL,
+            hedge_percentile: float = QNA_HEDGE_PERCENTILE,
+    ):
+        self.name = name
+        self.replicas = [Replica(url) for url in urls]
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout)
+        self.retries = retries
+        self.retry_backoff = retry_backoff_ms / 1000
+        self.health_interval = health_interval
+        self.hedge_percentile = hedge_percentile
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.prober: Optional[asyncio.Task] = None
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.retried = 0
+        self.failed = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    async def start(self) -> None:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=self.keepalive_timeout)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        if self.health_interval > 0 and self.prober is None:
+            self.prober = asyncio.create_task(self._probe_forever())
+
+    async def close(self) -> None:
+        if self.prober is not None:
+            self.prober.cancel()
+            self.prober = None
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _probe_forever(self) -> None:
+        while True:
+            await asyncio.gather(*(self._probe(replica) for replica in self.replicas))
+            await asyncio.sleep(self.health_interval)
+
+    async def _probe(self, replica: Replica) -> None:
+        try:
+            timeout = aiohttp.ClientTimeout(total=QNA_HEALTH_TIMEOUT)
+            async with self.session.get(f'{replica.url}/health/ready', timeout=timeout) as response:
+                healthy = response.status == 200
+        except Exception:
+            healthy = False
+        if healthy != replica.healthy:
+            logger.warning(f'replica health changed: pipeline="{self.name}" url="{replica.url}" healthy={healthy}')
+        replica.healthy = healthy
+
+    def choose(self, tried: Set[Replica]) -> Replica:
+        """
+        Реплика с наименьшим числом запросов в работе среди доступных и ещё не опробованных.
+        Если таких нет, выбор идёт среди всех не опробованных, затем среди всех реплик.
+        """
+        now = time.monotonic()
+        candidates = [replica for replica in self.replicas if replica not in tried and replica.available(now)]
+        if not candidates:
+            candidates = [replica for replica in self.replicas if replica not in tried] or self.replicas
+        fewest = min(replica.outstanding for replica in candidates)
+        return random.choice([replica for replica in candidates if replica.outstanding == fewest])
+
+    @staticmethod
+    def headers() -> Dict[str, str]:
+        request_id = current_request_id()
+        return {REQUEST_ID_HEADER: request_id} if request_id else {}
+
+    def hedge_delay(self) -> Optional[float]:
+        if self.hedge_percentile <= 0 or len(self.replicas) < 2 or len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, math.ceil(self.hedge_percentile * len(latencies)) - 1)]
+
+    @contextlib.asynccontextmanager
+    async def _track(self) -> AsyncIterator[None]:
+        if self.session is None:
+            await self.start()
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    async def _retry_delay(self, attempt: int, exception: BaseException) -> None:
+        self.retried += 1
+        delay = random.uniform(0, self.retry_backoff * 2 ** (attempt - 1))
+        logger.warning(
+            f'pipeline request retry: pipeline="{self.name}" attempt={attempt} '
+            f'delay={delay:.3f} error="{exception!r}"'
+        )
+        await asyncio.sleep(delay)
+
+    async def _call(self, replica: Replica, path: str, payload: Any) -> Any:
+        replica.outstanding += 1
+        replica.requests += 1
+        started_at = time.monotonic()
+        try:
+            async with self.session.post(f'{replica.url}{path}', json=payload, headers=self.headers()) as response:
+                # Стадии пайплайна попадают в трассировку запроса шлюза с префиксом пайплайна
+                merge_server_timing(response.headers.get(SERVER_TIMING_HEADER), self.name)
+                if response.status != 200:
+                    raise PipelineError(response.status, await response.text())
+                body = await response.json()
+        except Exception as exception:
+            UPSTREAM_SECONDS.observe(time.monotonic() - started_at, pipeline=self.name, outcome='error')
+            if is_replica_failure(exception):
+                replica.record_failure(time.monotonic())
+            raise
+        finally:
+            replica.outstanding -= 1
+
+        latency = time.monotonic() - started_at
+        UPSTREAM_SECONDS.observe(latency, pipeline=self.name, outcome='ok')
+        self.latencies.append(latency)
+        # Медленный ответ для автомата размыкания считается ошибкой
+        if latency * 1000 > QNA_BREAKER_SLOW_MS:
+            replica.record_failure(time.monotonic())
+        else:
+            replica.record_success()
+        return body
+
+    async def _call_with_retries(self, path: str, payload: Any, tried: Set[Replica]) -> Any:
+        attempt = 0
+        while True:
+            replica = self.choose(tried)
+            tried.add(replica)
+            try:
+                return await self._call(replica, path, payload)
+            except Exception as exception:
+                if not is_retryable(exception) or attempt >= self.retries:
+                    raise
+                attempt += 1
+                await self._retry_delay(attempt, exception)
+
+    async def request_json(self, path: str, payload: Any) -> Any:
+        """
+        POST запрос к пайплайну с ответом в JSON.
+
+        Параметры:
+        - path (str): Путь относительно адреса реплики.
+        - payload (Any): Тело запроса в JSON.
+
+        Возвращает:
+        - Any: Разобранный JSON ответа, при статусе не 200 - исключение PipelineError.
+        """
+        self.requests += 1
+        async with self._track():
+            tried: Set[Replica] = set()
+            first = asyncio.ensure_future(self._call_with_retries(path, payload, tried))
+            pending = {first}
+            try:
+                delay = self.hedge_delay()
+                if delay is not None:
+                    done, _ = await asyncio.wait(pending, timeout=delay)
+                    if not done:
+                        # Дубль уходит на реплику, которую первый запрос ещё не пробовал
+                        self.hedged += 1
+                        pending.add(asyncio.ensure_future(self._call_with_retries(path, payload, tried)))
+
+                error = None
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        error = task.exception() or error
+                    winners = [task for task in done if task.exception() is None]
+                    if winners:
+                        self.hedge_wins += winners[0] is not first
+                        return winners[0].result()
+                self.failed += 1
+                raise error
+            finally:
+                for task in pending:
+                    task.cancel()
+
+    @contextlib.asynccontextmanager
+    async def post(
+            self,
+            path: str,
+            payload: Any,
+            timeout: Optional[aiohttp.ClientTimeout] = None,
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        POST запрос к пайплайну без хеджирования, ответ доступен внутри контекста и освобождает соединение
+        при выходе. Для потоковых ответов.
+
+        Параметры:
+        - path (str): Путь относительно адреса реплики.
+        - payload (Any): Тело запроса в JSON.
+        - timeout (aiohttp.ClientTimeout, optional): Таймауты запроса вместо таймаутов сессии.
+        """
+        self.requests += 1
+        async with self._track():
+            tried: Set[Replica] = set()
+            attempt = 0
+            while True:
+                replica = self.choose(tried)
+                tried.add(replica)
+                try:
+                    response = await self.session.post(
+                        f'{replica.url}{path}', json=payload, timeout=timeout or self.timeout, headers=self.headers()
+                    )
+                    if response.status == 503:
+                        raise PipelineError(response.status, await response.text())
+                    break
+                except Exception as exception:
+                    if is_replica_failure(exception):
+                        replica.record_failure(time.monotonic())
+                    if not is_retryable(exception) or attempt >= self.retries:
+                        self.failed += 1
+                        raise
+                    attempt += 1
+                    await self._retry_delay(attempt, exception)
+
+            replica.outstanding += 1
+            replica.requests += 1
+            try:
+                async with response:
+                    yield response
+            finally:
+                replica.outstanding -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        # Запросы сверх лимита пула ждут свободного соединения
+        active = min(self.in_flight, self.limit) if self.limit else self.in_flight
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'waiting': self.in_flight - active,
+            'peak_in_flight': self.peak_in_flight,
+            'utilization': active / self.limit if self.limit else 0.0,
+            'requests': self.requests,
+            'retries': self.retried,
+            'failures': self.failed,
+            'hedge_delay': self.hedge_delay(),
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+            'replicas': [replica.stats() for replica in self.replicas],
+        }
@@ -0,0 +1,92 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+QNA_COALESCING_ENABLED = os.getenv('QNA_COALESCING_ENABLED', 'true').lower() in ('true', '1', 't')
+
+T = TypeVar('T')
+
+
+def normalize_question(question: str) -> str:
+    # Регистр и пробелы не меняют ответ пайплайна
+    return ' '.join(question.lower().split())
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых запросов, выполняющихся одновременно.
+
+    Первый запрос с ключом выполняется, остальные запросы с тем же ключом, пришедшие до его
+    завершения, ждут тот же результат или ту же ошибку. Выполнение идёт отдельной задачей,
+    поэтому отмена первого запроса (клиент ушёл) не отменяет ожидающих. Выполнение отменяется,
+    только когда отменены все ожидающие его запросы.
+    """
+
+    def __init__(self, enabled: bool = QNA_COALESCING_ENABLED):
+        self.enabled = enabled
+        self.calls: Dict[Hashable, asyncio.Future] = {}
+        self.waiters: Dict[asyncio.Future, int] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, function: Callable[[], Awaitable[T]]) -> T:
+        if not self.enabled:
+            self.executed += 1
+            return await function()
+
+        future = self.calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await self._wait(key, future)
+
+        future = asyncio.ensure_future(function())
+        self.calls[key] = future
+        self.executed += 1
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return await self._wait(key, future)
+
+    async def _wait(self, key: Hashable, future: asyncio.Future) -> T:
+        self.waiters[future] = self.waiters.get(future, 0) + 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self.waiters[future] -= 1
+            if not self.waiters[future]:
+                del self.waiters[future]
+                # Ключ снимается до отмены: новый запрос с тем же ключом не должен присоединиться
+                # к отменённому выполнению, пока колбэк _forget ещё не отработал
+                if self.calls.get(key) is future:
+                    del self.calls[key]
+                # Результат больше никому не нужен
+                future.cancel()
+
+    def _forget(self, key: Hashable, future: asyncio.Future) -> None:
+        if self.calls.get(key) is future:
+            del self.calls[key]
+        # Ошибку могли не забрать, если все ожидающие отменены
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.executed + self.coalesced
+        return {
+            'enabled': self.enabled,
+            'in_flight': len(self.calls),
+            'upstream_calls': self.executed,
+            'coalesced': self.coalesced,
+            'saved_ratio': self.coalesced / total if total else 0.0,
+        }
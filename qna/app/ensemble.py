@@ -0,0 +1,212 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import logging
+import os
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.service import PipelineAnswer
+
+logger = logging.getLogger(__name__)
+
+# Название режима в поле pipeline запроса
+ENSEMBLE = 'ensemble'
+# Ответ пайплайнов, которые не нашли ответа в базе знаний
+NO_ANSWER = 'Ответ не найден.'
+# Ответы пайплайнов без найденного ответа: faq отвечает так, если ретривер не вернул документов
+NOT_FOUND_ANSWERS = {NO_ANSWER, 'Документы не найдены в ответе RAG pipeline.'}
+
+
+# Пайплайны через запятую
+def parse_pipelines(value: str) -> List[str]:
+    return [pipeline.strip() for pipeline in value.split(',') if pipeline.strip()]
+
+
+# Пороги уверенности в формате `pipeline:score` через запятую
+def parse_scores(value: str) -> Dict[str, float]:
+    scores = {}
+    for item in parse_pipelines(value):
+        pipeline, score = item.split(':')
+        scores[pipeline.strip()] = float(score)
+    return scores
+
+
+QNA_ENSEMBLE_PIPELINES = parse_pipelines(os.getenv('QNA_ENSEMBLE_PIPELINES', 'rag_ranker,faq_cases,faq,baseline'))
+QNA_ENSEMBLE_DEADLINE_MS = float(os.getenv('QNA_ENSEMBLE_DEADLINE_MS', '3000'))
+QNA_ENSEMBLE_CONFIDENT_SCORES = parse_scores(
+    os.getenv('QNA_ENSEMBLE_CONFIDENT_SCORES', 'rag_ranker:0.9,faq_cases:0.95,faq:0.95,baseline:0.9')
+)
+
+CONFIDENT = 'confident'
+MAJORITY = 'majority'
+VOTE = 'vote'
+DEADLINE = 'deadline'
+
+
+def answer_key(answer: PipelineAnswer) -> str:
+    # Ответы из базы знаний сравниваются без учёта регистра и лишних пробелов
+    return ' '.join(answer.answer.lower().split())
+
+
+NOT_FOUND_KEYS = {' '.join(answer.lower().split()) for answer in NOT_FOUND_ANSWERS}
+
+
+def found(answer: PipelineAnswer) -> bool:
+    return answer_key(answer) not in NOT_FOUND_KEYS
+
+
+class Ensemble:
+    """
+    Ансамбль пайплайнов: вопрос отправляется во все пайплайны одновременно.
+
+    Ответы "Ответ не найден." не голосуют. Ответ выбирается, как только он однозначен:
+    - уверенный: оценка ответа пайплайна не ниже его порога из `confident_scores`,
+      из нескольких уверенных выбирается с наибольшей оценкой;
+    - большинство: одинаковый ответ дали больше половины пайплайнов ансамбля.
+    Иначе ответы собираются до `deadline_ms` и выбираются голосованием, при равенстве голосов
+    побеждает ответ с большей оценкой, затем пайплайн, стоящий раньше в списке. Не успевшие запросы отменяются.
+    Если ответ не нашёл ни один пайплайн, возвращается "Ответ не найден." первого пайплайна в списке.
+    Срок действует всегда: если к нему не ответил ни один пайплайн, возвращается "Ответ не найден."
+    без выигравшего пайплайна.
+    """
+
+    def __init__(
+            self,
+            pipelines: List[str] = QNA_ENSEMBLE_PIPELINES,
+            deadline_ms: float = QNA_ENSEMBLE_DEADLINE_MS,
+            confident_scores: Dict[str, float] = QNA_ENSEMBLE_CONFIDENT_SCORES,
+    ):
+        self.pipelines = pipelines
+        self.deadline = deadline_ms / 1000
+        self.confident_scores = confident_scores
+        self.requests = 0
+        self.wins = Counter()
+        self.decisions = Counter()
+        self.errors = Counter()
+        self.cancelled = 0
+
+    async def answer(
+            self,
+            question: str,
+            ask: Callable[[str, str], Awaitable[PipelineAnswer]],
+    ) -> Tuple[Optional[str], PipelineAnswer]:
+        """
+        Параметры:
+        - question (str): Вопрос пользователя.
+        - ask (Callable): Запрос ответа у пайплайна по вопросу и названию пайплайна.
+
+        Возвращает:
+        - Tuple[Optional[str], PipelineAnswer]: Выигравший пайплайн и его ответ, None - если к сроку ответов нет.
+        """
+        self.requests += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        tasks = {asyncio.ensure_future(ask(question, pipeline)): pipeline for pipeline in self.pipelines}
+        pending = set(tasks)
+        answers: Dict[str, PipelineAnswer] = {}
+        error: Optional[BaseException] = None
+        decision = VOTE
+        winner = None
+        try:
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    decision = DEADLINE
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pipeline = tasks[task]
+                    if task.exception() is not None:
+                        error = task.exception()
+                        self.errors[pipeline] += 1
+                        logger.warning(f'ensemble pipeline failed: pipeline="{pipeline}" error="{error!r}"')
+                    else:
+                        answers[pipeline] = task.result()
+                winner, decision = self.early_winner(answers) or (None, decision)
+                if winner is not None:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            self.cancelled += len(pending)
+
+        if not answers and decision == DEADLINE:
+            # Ни один пайплайн не успел: запрос не ждёт дольше срока ансамбля
+            self.decisions[decision] += 1
+            logger.info(f'ensemble answer: question="{question}" winner="" decision="{decision}" '
+                        f'answered= cancelled={len(pending)}')
+            return None, PipelineAnswer(answer=NO_ANSWER, class_1='', class_2='')
+        if not answers:
+            raise error
+        if winner is None:
+            winner = self.vote(answers)
+        self.wins[winner] += 1
+        self.decisions[decision] += 1
+        logger.info(
+            f'ensemble answer: question="{question}" winner="{winner}" decision="{decision}" '
+            f'answered={",".join(answers)} cancelled={len(pending)}'
+        )
+        return winner, answers[winner]
+
+    def early_winner(self, answers: Dict[str, PipelineAnswer]) -> Optional[Tuple[str, str]]:
+        confident = [
+            pipeline for pipeline, answer in answers.items()
+            if found(answer) and pipeline in self.confident_scores
+            and answer.score is not None and answer.score >= self.confident_scores[pipeline]
+        ]
+        if confident:
+            return max(confident, key=lambda pipeline: answers[pipeline].score), CONFIDENT
+
+        # Ответ большинства ансамбля уже не перевесить оставшимися голосами
+        votes = Counter(answer_key(answer) for answer in answers.values() if found(answer))
+        key, count = votes.most_common(1)[0] if votes else (None, 0)
+        if count * 2 > len(self.pipelines):
+            return self.first(pipeline for pipeline, answer in answers.items() if answer_key(answer) == key), MAJORITY
+        return None
+
+    def vote(self, answers: Dict[str, PipelineAnswer]) -> str:
+        candidates = [pipeline for pipeline, answer in answers.items() if found(answer)]
+        if not candidates:
+            return self.first(answers)
+        votes = Counter(answer_key(answers[pipeline]) for pipeline in candidates)
+
+        # Больше голосов, затем большая оценка ответа, затем пайплайн выше в списке ансамбля
+        def rank(pipeline: str) -> Tuple[int, float, int]:
+            answer = answers[pipeline]
+            score = answer.score if answer.score is not None else float('-inf')
+            return -votes[answer_key(answer)], -score, self.priority(pipeline)
+
+        return min(candidates, key=rank)
+
+    def priority(self, pipeline: str) -> int:
+        return self.pipelines.index(pipeline)
+
+    def first(self, pipelines) -> str:
+        return min(pipelines, key=self.priority)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pipelines': self.pipelines,
+            'deadline_ms': self.deadline * 1000,
+            'requests': self.requests,
+            'wins': dict(self.wins),
+            'decisions': dict(self.decisions),
+            'errors': dict(self.errors),
+            'cancelled': self.cancelled,
+        }
+
+
+ensemble = Ensemble()
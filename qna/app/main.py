@@ -12,17 +12,25 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import json
 import logging
+import os
 import uuid
-from typing import Optional, Dict
+from typing import AsyncIterator, Dict, List, Optional
 
 import sys
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from app.metrics import set_feedback, init_db, save_answer
-from app.service import get_answer
+from app.ensemble import ENSEMBLE, ensemble
+from app.metrics import set_feedback, init_db, close_db, save_answer, save_answers, writer
+from app.service import (
+    get_answer, get_client, stream_answers, start_clients, close_clients, clients, clients_stats, single_flight,
+)
+from app.telemetry import CONTENT_TYPE, Counter, Gauge, register_caches, render, track_request
+from app.tracing import RequestTracing, stage
 
 logging.basicConfig(
     level=logging.INFO,
@@ -30,7 +38,14 @@ logging.basicConfig(
     handlers=[logging.StreamHandler(sys.stdout)]
 )
 
+# Сколько ответов пакетного запроса передаётся на запись в базу одной пачкой
+QNA_BATCH_SAVE_SIZE = int(os.getenv('QNA_BATCH_SAVE_SIZE', '64'))
+# Запросы дольше порога логируются с деревом стадий шлюза и пайплайнов
+QNA_SLOW_REQUEST_MS = float(os.getenv('QNA_SLOW_REQUEST_MS', '2000'))
+
 app = FastAPI()
+app.middleware("http")(track_request)
+app.middleware("http")(RequestTracing(QNA_SLOW_REQUEST_MS, log_records=True))
 
 
 @app.get("/")
@@ -53,16 +68,21 @@ class Answer(BaseModel):
 
 @app.post("/api/answers", response_model=Answer)
 async def ask(request: QuestionRequest) -> Answer:
-    answer_data = await get_answer(request.question, request.pipeline)
+    if request.pipeline == ENSEMBLE:
+        winner, answer_data = await ensemble.answer(request.question, get_answer)
+    else:
+        winner, answer_data = None, await get_answer(request.question, request.pipeline)
     answer_id = str(uuid.uuid4())
-    await save_answer(
-        answer_id=answer_id,
-        question=request.question,
-        pipeline=request.pipeline,
-        answer=answer_data.answer,
-        class_1=answer_data.class_1,
-        class_2=answer_data.class_2,
-    )
+    with stage('save'):
+        await save_answer(
+            answer_id=answer_id,
+            question=request.question,
+            pipeline=request.pipeline,
+            answer=answer_data.answer,
+            class_1=answer_data.class_1,
+            class_2=answer_data.class_2,
+            winner=winner,
+        )
     return Answer(
         id=answer_id,
         answer=answer_data.answer,
@@ -72,6 +92,43 @@ async def ask(request: QuestionRequest) -> Answer:
     )
 
 
+class BatchQuestionRequest(BaseModel):
+    questions: List[str]
+    pipeline: Optional[str] = None
+
+
+# Ответы пайплайна с идентификаторами: отдаются построчно в NDJSON сразу, сохраняются пачками
+async def answer_lines(questions: List[str], pipeline: Optional[str]) -> AsyncIterator[bytes]:
+    rows = []
+    try:
+        async for item in stream_answers(questions, pipeline):
+            if 'error' not in item:
+                item['id'] = str(uuid.uuid4())
+                rows.append(
+                    (item['id'], item['question'], pipeline, item['answer'], item['class_1'], item['class_2'], None)
+                )
+                if len(rows) >= QNA_BATCH_SAVE_SIZE:
+                    await save_answers(rows)
+                    rows = []
+            yield json.dumps(item, ensure_ascii=False).encode('utf-8') + b'\n'
+    finally:
+        # Отданные клиенту ответы сохраняются, даже если он отключился до конца потока
+        if rows:
+            await save_answers(rows)
+
+
+@app.post("/api/answers/batch")
+async def ask_batch(request: BatchQuestionRequest) -> StreamingResponse:
+    # Неизвестный пайплайн проверяется до начала потока
+    if request.pipeline == ENSEMBLE:
+        raise HTTPException(status_code=400, detail='Пакетные запросы ансамбль не поддерживает')
+    try:
+        get_client(request.pipeline)
+    except ValueError as exception:
+        raise HTTPException(status_code=400, detail=str(exception))
+    return StreamingResponse(answer_lines(request.questions, request.pipeline), media_type='application/x-ndjson')
+
+
 @app.post("/api/answers/{answer_id}/liking")
 async def like(answer_id: str) -> None:
     await set_feedback(answer_id, 1)
@@ -82,9 +139,59 @@ async def dislike(answer_id: str) -> None:
     await set_feedback(answer_id, -1)
 
 
+@app.get("/stats")
+async def stats():
+    return {
+        "pipelines": clients_stats(),
+        "coalescing": single_flight.stats(),
+        "ensemble": ensemble.stats(),
+        "metrics_writer": writer.stats(),
+    }
+
+
+# Метрики Prometheus по статистике компонентов, считываются при каждом сборе
+Gauge(
+    'qna_upstream_in_flight', 'Запросы к пайплайну в работе', ['pipeline'],
+    function=lambda: {(pipeline,): client.in_flight for pipeline, client in clients.items()},
+)
+Gauge(
+    'qna_replica_outstanding', 'Запросы к реплике пайплайна в работе', ['pipeline', 'replica'],
+    function=lambda: {
+        (pipeline, replica.url): replica.outstanding
+        for pipeline, client in clients.items() for replica in client.replicas
+    },
+)
+Gauge(
+    'qna_replica_up', 'Реплика готова и не исключена автоматом размыкания', ['pipeline', 'replica'],
+    function=lambda: {
+        (pipeline, replica.url): float(replica.healthy and replica.state != 'open')
+        for pipeline, client in clients.items() for replica in client.replicas
+    },
+)
+Gauge('qna_write_queue_depth', 'Метрики в очереди на запись в SQLite', function=lambda: writer.queue.qsize())
+# Объединённый запрос - попадание, запрос в пайплайн - промах
+register_caches('qna', lambda: {'coalescing': (single_flight.coalesced, single_flight.executed)})
+Counter(
+    'qna_ensemble_wins_total', 'Ответы ансамбля по выигравшему пайплайну', ['pipeline'],
+    function=lambda: {(pipeline,): count for pipeline, count in ensemble.wins.items()},
+)
+
+
+@app.get("/metrics")
+async def prometheus_metrics() -> Response:
+    return Response(render(), media_type=CONTENT_TYPE)
+
+
 @app.on_event("startup")
 async def startup_event():
     await init_db()
+    await start_clients()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_clients()
+    await close_db()
 
 
 if __name__ == "__main__":
@@ -11,20 +11,65 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+import asyncio
 import logging
 import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
 import aiosqlite
 
+from app.telemetry import Histogram
+
 logger = logging.getLogger(__name__)
 
 QNA_DB_PATH = os.getenv('QNA_DB_PATH', 'metrics.db')
+QNA_WRITE_QUEUE_SIZE = int(os.getenv('QNA_WRITE_QUEUE_SIZE', '10000'))
+QNA_WRITE_BATCH_SIZE = int(os.getenv('QNA_WRITE_BATCH_SIZE', '500'))
+QNA_WRITE_CLOSE_TIMEOUT = float(os.getenv('QNA_WRITE_CLOSE_TIMEOUT', '10'))
 
+SQLITE_WRITE_SECONDS = Histogram('qna_sqlite_write_seconds', 'Время записи пачки метрик в SQLite')
 
-# Инициализация базы данных
-async def init_db() -> None:
-    async with aiosqlite.connect(QNA_DB_PATH) as db:
-        await db.execute('''
+INSERT_ANSWER = '''
+    INSERT INTO answers (answer_id, question, pipeline, answer, class_1, class_2, winner) 
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+UPDATE_FEEDBACK = '''
+    UPDATE answers 
+    SET feedback = ? 
+    WHERE answer_id = ?
+'''
+
+
+class MetricsWriter:
+    """
+    Отложенная запись метрик в SQLite из фоновой задачи.
+
+    Запросы только кладут операции в ограниченную очередь и не ждут диска. Фоновая задача
+    забирает из очереди до `batch_size` операций, записывает их через `executemany` и фиксирует
+    одной транзакцией в единственном долгоживущем соединении в режиме WAL.
+    Если пачка не записалась, она повторяется по одной операции, и теряются только ошибочные.
+    Если очередь заполнена, запрос ждёт свободного места, такие ожидания попадают в статистику.
+    """
+
+    def __init__(self, path: str, queue_size: int = QNA_WRITE_QUEUE_SIZE, batch_size: int = QNA_WRITE_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.db: Optional[aiosqlite.Connection] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.full_waits = 0
+        self.full_wait_time = 0.0
+
+    async def start(self) -> None:
+        self.db = await aiosqlite.connect(self.path)
+        # WAL: чтение не блокируется записью, fsync только на контрольных точках
+        await self.db.execute('PRAGMA journal_mode=WAL')
+        await self.db.execute('PRAGMA synchronous=NORMAL')
+        await self.db.execute('''
             CREATE TABLE IF NOT EXISTS answers (
                 answer_id TEXT PRIMARY KEY,
                 question TEXT,
@@ -33,33 +78,155 @@ async def init_db() -> None:
                 class_1 TEXT,
                 class_2 TEXT,
                 answered_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                feedback INTEGER DEFAULT 0
+                feedback INTEGER DEFAULT 0,
+                winner TEXT
             )
         ''')
-        await db.commit()
+        # Базы, созданные до появления ансамбля, дополняются столбцом выигравшего пайплайна
+        async with self.db.execute('PRAGMA table_info(answers)') as cursor:
+            columns = [row[1] for row in await cursor.fetchall()]
+        if 'winner' not in columns:
+            await self.db.execute('ALTER TABLE answers ADD COLUMN winner TEXT')
+        await self.db.commit()
+        self.worker = asyncio.create_task(self._work())
+
+    async def put(self, statement: str, params: Tuple) -> None:
+        if self.queue.full():
+            self.full_waits += 1
+            started_at = time.perf_counter()
+            await self.queue.put((statement, params))
+            self.full_wait_time += time.perf_counter() - started_at
+        else:
+            self.queue.put_nowait((statement, params))
+
+    async def close(self, timeout: float = QNA_WRITE_CLOSE_TIMEOUT) -> None:
+        """
+        Дописывает всё, что осталось в очереди, но не дольше `timeout` секунд, и закрывает соединение.
+        """
+        if self.worker is not None:
+            # Упавшая фоновая задача очередь уже не разберёт, ждать её нельзя
+            if not self.worker.done():
+                try:
+                    await asyncio.wait_for(self.queue.join(), timeout)
+                except asyncio.TimeoutError:
+                    logger.warning(f'metrics writer close timed out: queue={self.queue.qsize()}')
+            self.worker.cancel()
+            self.worker = None
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
+        logger.info(f'metrics writer closed: written={self.written} failed={self.failed}')
+
+    async def _work(self) -> None:
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self._write(batch)
+                self.written += len(batch)
+            except Exception:
+                logger.warning(f'metrics batch write failed, retrying by one: operations={len(batch)}', exc_info=True)
+                await self._rollback()
+                await self._write_one_by_one(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _write_one_by_one(self, batch: List[Tuple[str, Tuple]]) -> None:
+        # Каждая операция в своей транзакции: ошибочная откатывается, остальные записываются
+        for statement, params in batch:
+            try:
+                await self.db.execute(statement, params)
+                await self.db.commit()
+                self.written += 1
+            except Exception:
+                self.failed += 1
+                logger.exception(f'metrics write failed: statement="{" ".join(statement.split())}" params={params}')
+                await self._rollback()
+
+    async def _rollback(self) -> None:
+        try:
+            await self.db.rollback()
+        except Exception:
+            logger.exception('metrics rollback failed')
+
+    async def _write(self, batch: List[Tuple[str, Tuple]]) -> None:
+        with SQLITE_WRITE_SECONDS.time():
+            await self._write_batch(batch)
+        self.batches += 1
+
+    async def _write_batch(self, batch: List[Tuple[str, Tuple]]) -> None:
+        # Подряд идущие операции одного вида пишутся одним executemany, порядок операций сохраняется
+        group_statement, group = None, []
+        for statement, params in batch:
+            if statement != group_statement and group:
+                await self.db.executemany(group_statement, group)
+                group = []
+            group_statement = statement
+            group.append(params)
+        await self.db.executemany(group_statement, group)
+        await self.db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queue': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            'written': self.written,
+            'failed': self.failed,
+            'batches': self.batches,
+            'mean_batch_size': self.written / self.batches if self.batches else 0,
+            'full_waits': self.full_waits,
+            'full_wait_time': self.full_wait_time,
+        }
+
+
+writer = MetricsWriter(QNA_DB_PATH)
+
+
+# Инициализация базы данных и фоновой записи
+async def init_db() -> None:
+    await writer.start()
+
+
+# Запись оставшихся метрик и закрытие базы данных
+async def close_db() -> None:
+    await writer.close()
 
 
 # Сохранить ответ
-async def save_answer(answer_id: str, question: str, pipeline: str, answer: str, class_1: str, class_2: str) -> None:
-    async with aiosqlite.connect(QNA_DB_PATH) as db:
-        await db.execute('''
-            INSERT INTO answers (answer_id, question, pipeline, answer, class_1, class_2) 
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (answer_id, question, pipeline, answer, class_1, class_2))
-        await db.commit()
-        logger.info(
-            f'saved answer: answer_id="{answer_id}" question="{question}" pipeline="{pipeline}" '
-            f'answer="{answer}" class_1="{class_1}" class_2="{class_2}"'
-        )
+async def save_answer(
+        answer_id: str,
+        question: str,
+        pipeline: str,
+        answer: str,
+        class_1: str,
+        class_2: str,
+        winner: Optional[str] = None,
+) -> None:
+    """
+    Параметры:
+    - winner (str, optional): Пайплайн, чей ответ выбран в режиме ансамбля.
+    """
+    await writer.put(INSERT_ANSWER, (answer_id, question, pipeline, answer, class_1, class_2, winner))
+    logger.info(
+        f'saved answer: answer_id="{answer_id}" question="{question}" pipeline="{pipeline}" '
+        f'answer="{answer}" class_1="{class_1}" class_2="{class_2}" winner="{winner}"'
+    )
+
+
+# Сохранить пачку ответов
+async def save_answers(answers: List[Tuple[str, str, str, str, str, str, Optional[str]]]) -> None:
+    """
+    Параметры:
+    - answers: Кортежи (answer_id, question, pipeline, answer, class_1, class_2, winner).
+    """
+    for answer in answers:
+        await writer.put(INSERT_ANSWER, answer)
+    logger.info(f'saved answers: count={len(answers)}')
 
 
 # Проставить фидбек
 async def set_feedback(answer_id: str, feedback: int) -> None:
-    async with aiosqlite.connect(QNA_DB_PATH) as db:
-        await db.execute('''
-            UPDATE answers 
-            SET feedback = ? 
-            WHERE answer_id = ?
-        ''', (feedback, answer_id))
-        await db.commit()
-        logger.info(f'set feedback: answer_id="{answer_id}" feedback="{feedback}"')
+    await writer.put(UPDATE_FEEDBACK, (feedback, answer_id))
+    logger.info(f'set feedback: answer_id="{answer_id}" feedback="{feedback}"')
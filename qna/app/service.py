@@ -12,44 +12,100 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import asyncio
+import json
 import os
-from typing import Optional, Dict
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 import aiohttp
 from pydantic import BaseModel
 
+from app.client import PipelineClient, QNA_CONNECT_TIMEOUT
+from app.coalescing import SingleFlight, normalize_question
+from app.tracing import stage
+
 QNA_SERVICE_DEFAULT_PIPELINE = os.getenv('QNA_SERVICE_DEFAULT_PIPELINE', 'rag_ranker')
+QNA_BATCH_READ_TIMEOUT = float(os.getenv('QNA_BATCH_READ_TIMEOUT', '300'))
+
+
+# Адреса реплик пайплайна через запятую
+def parse_urls(value: str) -> List[str]:
+    return [url.strip().rstrip('/') for url in value.split(',') if url.strip()]
+
 
 SERVICE_URLS = {
-    "baseline": os.getenv('PIPELINE_BASELINE_SERVICE_URL', 'http://pipeline-baseline:8088'),
-    "faq": os.getenv('PIPELINE_FAQ_SERVICE_URL', 'http://pipeline-faq:8088'),
-    "faq_cases": os.getenv('PIPELINE_FAQ_CASES_SERVICE_URL', 'http://pipeline-faq-cases:8088'),
-    "rag_ranker": os.getenv('PIPELINE_RAG_RANKER_SERVICE_URL', 'http://pipeline-rag-ranker:8088'),
+    "baseline": parse_urls(os.getenv('PIPELINE_BASELINE_SERVICE_URL', 'http://pipeline-baseline:8088')),
+    "faq": parse_urls(os.getenv('PIPELINE_FAQ_SERVICE_URL', 'http://pipeline-faq:8088')),
+    "faq_cases": parse_urls(os.getenv('PIPELINE_FAQ_CASES_SERVICE_URL', 'http://pipeline-faq-cases:8088')),
+    "rag_ranker": parse_urls(os.getenv('PIPELINE_RAG_RANKER_SERVICE_URL', 'http://pipeline-rag-ranker:8088')),
 }
 
+# Клиенты пайплайнов с пулами соединений и репликами, открываются на старте приложения
+clients = {pipeline: PipelineClient(pipeline, urls) for pipeline, urls in SERVICE_URLS.items()}
+
+# Одинаковые вопросы к одному пайплайну, заданные одновременно, уходят в пайплайн один раз
+single_flight = SingleFlight()
+
 
 class PipelineAnswer(BaseModel):
     answer: str
     class_1: str
     class_2: str
+    score: Optional[float] = None
     extra_fields: Optional[Dict[str, str]] = None
 
 
-# Получить ответ у пайплайна
-async def get_answer(question: str, pipeline: Optional[str] = None) -> PipelineAnswer:
+# Открыть сессии клиентов пайплайнов
+async def start_clients() -> None:
+    for client in clients.values():
+        await client.start()
+
+
+# Закрыть сессии клиентов пайплайнов
+async def close_clients() -> None:
+    await asyncio.gather(*(client.close() for client in clients.values()))
+
+
+# Статистика пулов соединений и реплик
+def clients_stats() -> Dict[str, Any]:
+    return {pipeline: client.stats() for pipeline, client in clients.items()}
+
+
+# Клиент сервиса пайплайна
+def get_client(pipeline: Optional[str] = None) -> PipelineClient:
     pipeline = pipeline or QNA_SERVICE_DEFAULT_PIPELINE
-    if pipeline not in SERVICE_URLS:
+    if pipeline not in clients:
         raise ValueError(f'Неизвестный пайплайн: {pipeline}')
 
-    service_url = SERVICE_URLS[pipeline]
-    return await get_answer_by_service(question, service_url)
+    return clients[pipeline]
+
+
+# Получить ответ у пайплайна
+async def get_answer(question: str, pipeline: Optional[str] = None) -> PipelineAnswer:
+    client = get_client(pipeline)
+    # Ожидание пайплайна, включая объединённые запросы, повторы и сеть
+    with stage(f'{client.name}.upstream'):
+        return await single_flight.run(
+            (client.name, normalize_question(question)),
+            lambda: get_answer_by_service(question, client),
+        )
 
 
 # Запросить ответ у пайплайн сервиса
-async def get_answer_by_service(question: str, service_url: str) -> PipelineAnswer:
-    async with aiohttp.ClientSession() as session:
-        request = {'question': question}
-        async with session.post(f'{service_url}/api/answers', json=request) as response:
-            if response.status != 200:
-                raise Exception(f"Ошибка получения ответа: {response.status} {await response.text()}")
-            return PipelineAnswer(**await response.json())
+async def get_answer_by_service(question: str, client: PipelineClient) -> PipelineAnswer:
+    request = {'question': question}
+    return PipelineAnswer(**await client.request_json('/api/answers', request))
+
+
+# Получить ответы пайплайна на список вопросов: строки NDJSON разбираются по мере поступления
+async def stream_answers(questions: List[str], pipeline: Optional[str] = None) -> AsyncIterator[dict]:
+    client = get_client(pipeline)
+    # Пакет может обрабатываться долго, ограничивается только ожидание очередной порции ответов
+    timeout = aiohttp.ClientTimeout(total=None, connect=QNA_CONNECT_TIMEOUT, sock_read=QNA_BATCH_READ_TIMEOUT)
+    request = {'questions': questions}
+    async with client.post('/api/answers/batch', request, timeout=timeout) as response:
+        if response.status != 200:
+            raise Exception(f"Ошибка получения ответов: {response.status} {await response.text()}")
+        async for line in response.content:
+            if line.strip():
+                yield json.loads(line)
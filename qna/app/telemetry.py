@@ -0,0 +1,269 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import bisect
+import contextlib
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Формат текстовой выдачи Prometheus
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Значения метрики по кортежам значений меток
+Samples = Dict[Tuple[str, ...], float]
+
+# Все метрики процесса в порядке создания
+registry: List['Metric'] = []
+
+
+def escape(value: str, quotes: bool = True) -> str:
+    # В описании метрики кавычки не экранируются, в значениях меток экранируются
+    value = value.replace('\\', '\\\\').replace('\n', '\\n')
+    return value.replace('"', '\\"') if quotes else value
+
+
+def format_value(value: float) -> str:
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Metric:
+    """
+    Метрика в формате Prometheus, пишется из любых потоков.
+
+    Значения либо накапливаются вызовами метрики, либо считываются при каждом сборе из `function`:
+    она возвращает число для метрики без меток или словарь значений по кортежам значений меток.
+    Так статистика компонентов отдаётся без дублирования счётчиков.
+    """
+    type = 'untyped'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            function: Optional[Callable[[], Union[float, Samples]]] = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self.values: Dict[Tuple[str, ...], Any] = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        if self.function is not None:
+            values = self.function()
+            values = values if isinstance(values, dict) else {(): values}
+        else:
+            with self.lock:
+                values = dict(self.values)
+        for key, value in values.items():
+            yield self.name, self.labelnames, key, value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {escape(self.documentation, quotes=False)}', f'# TYPE {self.name} {self.type}']
+        for name, labelnames, key, value in self.samples():
+            lines.append(f'{name}{format_labels(labelnames, key)} {format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        # Счётчики по корзинам хранятся без накопления, последняя корзина - +Inf
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[position] += 1
+            self.values[key] = counts, total + value
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def samples(self) -> Iterator[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        with self.lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+        labelnames = self.labelnames + ('le',)
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + [math.inf], counts):
+                cumulative += count
+                yield f'{self.name}_bucket', labelnames, key + (format_value(bound),), cumulative
+            yield f'{self.name}_sum', self.labelnames, key, total
+            yield f'{self.name}_count', self.labelnames, key, cumulative
+
+
+def render() -> str:
+    """
+    Все метрики процесса в текстовом формате Prometheus.
+    """
+    return '\n'.join(line for metric in registry for line in metric.render()) + '\n'
+
+
+def register_caches(prefix: str, counts: Callable[[], Dict[str, Tuple[int, int]]]) -> None:
+    """
+    Метрики кэшей: число обращений с попаданием и промахом и доля попаданий.
+
+    Параметры:
+    - prefix (str): Префикс названий метрик.
+    - counts (Callable): Возвращает попадания и промахи по названию кэша, вызывается при каждом сборе.
+    """
+    Counter(
+        f'{prefix}_cache_requests_total', 'Обращения к кэшу', ['cache', 'result'],
+        function=lambda: {
+            (cache, result): value
+            for cache, (hits, misses) in counts().items()
+            for result, value in (('hit', hits), ('miss', misses))
+        },
+    )
+    Gauge(
+        f'{prefix}_cache_hit_ratio', 'Доля попаданий в кэш', ['cache'],
+        function=lambda: {
+            (cache,): hits / (hits + misses) if hits + misses else 0.0
+            for cache, (hits, misses) in counts().items()
+        },
+    )
+
+
+class TrackedExecutor(ThreadPoolExecutor):
+    """
+    Пул потоков, считающий задачи в очереди и в работе для метрик `executor_queue_depth`
+    и `executor_active_tasks`.
+    """
+
+    def __init__(self, name: str, max_workers: Optional[int] = None):
+        super().__init__(max_workers=max_workers, thread_name_prefix=name)
+        self.name = name
+        self.queued = 0
+        self.active = 0
+        self.counter_lock = threading.Lock()
+        executors.append(self)
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self.counter_lock:
+            self.queued += 1
+
+        def run():
+            with self.counter_lock:
+                self.queued -= 1
+                self.active += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.counter_lock:
+                    self.active -= 1
+
+        return super().submit(run)
+
+
+executors: List[TrackedExecutor] = []
+
+Gauge(
+    'executor_queue_depth', 'Задачи, ожидающие свободного потока', ['executor'],
+    function=lambda: {(executor.name,): executor.queued for executor in executors},
+)
+Gauge(
+    'executor_active_tasks', 'Задачи, выполняющиеся в пуле потоков', ['executor'],
+    function=lambda: {(executor.name,): executor.active for executor in executors},
+)
+
+HTTP_IN_FLIGHT = Gauge('http_requests_in_flight', 'Запросы в обработке')
+HTTP_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Время обработки запроса до начала ответа', ['method', 'path', 'status']
+)
+
+
+async def track_request(request, call_next):
+    """
+    HTTP middleware: запросы в обработке и время до начала ответа по шаблону пути.
+    Для потоковых ответов время считается до первых байт.
+    """
+    HTTP_IN_FLIGHT.inc()
+    started_at = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        # Шаблон пути вместо самого пути, чтобы идентификаторы не размножали ряды
+        route = request.scope.get('route')
+        HTTP_SECONDS.observe(
+            time.perf_counter() - started_at,
+            method=request.method,
+            path=getattr(route, 'path', 'unmatched'),
+            status=status,
+        )
@@ -0,0 +1,176 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import socket
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from app import client
+from app.client import CLOSED, HALF_OPEN, OPEN, PipelineClient, PipelineError, Replica
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(client, 'QNA_BREAKER_FAILURES', 3)
+    monkeypatch.setattr(client, 'QNA_BREAKER_OPEN_SECONDS', 10)
+    monkeypatch.setattr(client, 'QNA_BREAKER_HALF_OPEN_RATIO', 0.25)
+
+
+def test_replica_opens_after_consecutive_failures(breaker):
+    replica = Replica('http://replica')
+    replica.record_failure(100)
+    replica.record_failure(100)
+    # Успех сбрасывает счётчик ошибок подряд
+    replica.record_success()
+    replica.record_failure(100)
+    replica.record_failure(100)
+    assert replica.state == CLOSED
+
+    replica.record_failure(100)
+    assert replica.state == OPEN
+    assert not replica.available(105)
+    assert replica.ejections == 1
+
+
+def test_half_open_replica_is_restored_by_successes(breaker, monkeypatch):
+    replica = Replica('http://replica')
+    for _ in range(3):
+        replica.record_failure(100)
+
+    monkeypatch.setattr(client.random, 'random', lambda: 0.2)
+    assert replica.available(111)
+    assert replica.state == HALF_OPEN
+    assert replica.admit_ratio == 0.25
+
+    # Доля запросов удваивается с каждым успехом: 0.5, затем 1.0 и цепь замыкается
+    replica.record_success()
+    assert replica.state == HALF_OPEN
+    monkeypatch.setattr(client.random, 'random', lambda: 0.6)
+    assert not replica.available(112)
+    replica.record_success()
+    assert replica.state == CLOSED
+    assert replica.available(112)
+
+
+def test_half_open_failure_ejects_again(breaker, monkeypatch):
+    replica = Replica('http://replica')
+    for _ in range(3):
+        replica.record_failure(100)
+    monkeypatch.setattr(client.random, 'random', lambda: 0.0)
+    assert replica.available(111)
+
+    replica.record_failure(111)
+    assert replica.state == OPEN
+    assert not replica.available(115)
+    assert replica.ejections == 2
+
+
+def app(delay: float = 0, status: int = 200) -> web.Application:
+    async def answer(request: web.Request) -> web.Response:
+        await asyncio.sleep(delay)
+        if status != 200:
+            return web.Response(status=status, text='error')
+        return web.json_response({'delay': delay})
+
+    application = web.Application()
+    application.router.add_post('/api/answers', answer)
+    return application
+
+
+def closed_port_url() -> str:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return f'http://127.0.0.1:{sock.getsockname()[1]}'
+
+
+async def start(*applications: web.Application):
+    servers = [TestServer(application) for application in applications]
+    for server in servers:
+        await server.start_server()
+    return servers, [str(server.make_url('')).rstrip('/') for server in servers]
+
+
+def first_candidate(monkeypatch):
+    # Выбор среди равных реплик детерминирован: берётся первая в списке
+    monkeypatch.setattr(client.random, 'choice', lambda candidates: candidates[0])
+
+
+def test_slow_request_is_hedged_to_another_replica(monkeypatch):
+    first_candidate(monkeypatch)
+
+    async def main():
+        servers, urls = await start(app(delay=2), app(delay=0))
+        pipeline = PipelineClient('faq', urls, health_interval=0, hedge_percentile=0.95)
+        # Задержка хеджирования считается по последним задержкам пайплайна
+        pipeline.latencies.extend([0.01] * client.HEDGE_MIN_SAMPLES)
+        try:
+            started_at = time.monotonic()
+            body = await pipeline.request_json('/api/answers', {})
+            return body, time.monotonic() - started_at, pipeline.stats()
+        finally:
+            await pipeline.close()
+            for server in servers:
+                await server.close()
+
+    body, elapsed, stats = asyncio.run(main())
+    assert body == {'delay': 0}
+    assert elapsed < 1
+    assert stats['hedged'] == 1
+    assert stats['hedge_wins'] == 1
+
+
+def test_connection_error_is_retried_on_another_replica(monkeypatch):
+    first_candidate(monkeypatch)
+
+    async def main():
+        servers, urls = await start(app())
+        pipeline = PipelineClient('faq', [closed_port_url(), *urls], health_interval=0, retry_backoff_ms=1)
+        try:
+            return await pipeline.request_json('/api/answers', {}), pipeline.stats()
+        finally:
+            await pipeline.close()
+            for server in servers:
+                await server.close()
+
+    body, stats = asyncio.run(main())
+    assert body == {'delay': 0}
+    assert stats['retries'] == 1
+
+
+def test_failing_replica_is_ejected(breaker, monkeypatch):
+    first_candidate(monkeypatch)
+
+    async def main():
+        servers, urls = await start(app(status=500), app())
+        pipeline = PipelineClient('faq', urls, health_interval=0)
+        try:
+            # Ошибка 500 не повторяется, но считается ошибкой реплики
+            for _ in range(3):
+                with pytest.raises(PipelineError):
+                    await pipeline.request_json('/api/answers', {})
+            bodies = [await pipeline.request_json('/api/answers', {}) for _ in range(3)]
+            return bodies, pipeline.replicas
+        finally:
+            await pipeline.close()
+            for server in servers:
+                await server.close()
+
+    bodies, replicas = asyncio.run(main())
+    assert bodies == [{'delay': 0}] * 3
+    assert replicas[0].state == OPEN
+    assert replicas[1].requests == 3
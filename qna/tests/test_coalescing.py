@@ -0,0 +1,147 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+
+import pytest
+
+from app.coalescing import SingleFlight
+
+
+class Upstream:
+    """
+    Запрос в пайплайн, который отвечает по сигналу и считает вызовы.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return self.calls
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    async def main():
+        flight, upstream = SingleFlight(enabled=True), Upstream()
+        tasks = [asyncio.ensure_future(flight.run('q', upstream)) for _ in range(3)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return await asyncio.gather(*tasks), upstream, flight
+
+    results, upstream, flight = asyncio.run(main())
+    assert results == [1, 1, 1]
+    assert upstream.calls == 1
+    assert flight.stats()['coalesced'] == 2
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_cancelled_first_caller_does_not_cancel_others():
+    async def main():
+        flight, upstream = SingleFlight(enabled=True), Upstream()
+        first = asyncio.ensure_future(flight.run('q', upstream))
+        second = asyncio.ensure_future(flight.run('q', upstream))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return await second, first, upstream
+
+    result, first, upstream = asyncio.run(main())
+    assert result == 1
+    assert first.cancelled()
+    assert upstream.cancelled == 0
+
+
+def test_call_is_cancelled_when_all_waiters_leave():
+    async def main():
+        flight, upstream = SingleFlight(enabled=True), Upstream()
+        tasks = [asyncio.ensure_future(flight.run('q', upstream)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0)
+        return upstream, flight
+
+    upstream, flight = asyncio.run(main())
+    assert upstream.cancelled == 1
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_caller_right_after_cancellation_starts_new_call():
+    async def main():
+        flight, upstream = SingleFlight(enabled=True), Upstream()
+        first = asyncio.ensure_future(flight.run('q', upstream))
+        await asyncio.sleep(0)
+        first.cancel()
+        # Следующий шаг цикла: отменённое выполнение ещё не завершилось и колбэк _forget не отработал
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flight.run('q', upstream))
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return await second, upstream
+
+    result, upstream = asyncio.run(main())
+    assert result == 2
+    assert upstream.calls == 2
+
+
+def test_error_is_shared_by_waiters():
+    async def failing():
+        await asyncio.sleep(0)
+        raise ValueError('pipeline failed')
+
+    async def main():
+        flight = SingleFlight(enabled=True)
+        return await asyncio.gather(flight.run('q', failing), flight.run('q', failing), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_disabled_flight_calls_every_time():
+    async def main():
+        flight, upstream = SingleFlight(enabled=False), Upstream()
+        upstream.release.set()
+        return await asyncio.gather(flight.run('q', upstream), flight.run('q', upstream)), upstream
+
+    results, upstream = asyncio.run(main())
+    assert upstream.calls == 2
+    assert sorted(results) == [1, 2]
+
+
+def test_failed_call_is_forgotten():
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ValueError('pipeline failed')
+        return 'ok'
+
+    async def main():
+        flight = SingleFlight(enabled=True)
+        with pytest.raises(ValueError):
+            await flight.run('q', flaky)
+        return await flight.run('q', flaky)
+
+    assert asyncio.run(main()) == 'ok'
@@ -0,0 +1,183 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import time
+
+import pytest
+
+from app.ensemble import CONFIDENT, DEADLINE, MAJORITY, NO_ANSWER, VOTE, Ensemble
+from app.service import PipelineAnswer
+
+PIPELINES = ['rag_ranker', 'faq_cases', 'faq', 'baseline']
+
+
+def reply(answer: str, score: float = None, delay: float = 0.0):
+    return delay, PipelineAnswer(answer=answer, class_1='class_1', class_2='class_2', score=score)
+
+
+def failure(delay: float = 0.0):
+    return delay, RuntimeError('down')
+
+
+class Pipelines:
+    """
+    Пайплайны с заранее заданными ответами и задержками, запоминают отменённые запросы.
+    """
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.cancelled = set()
+
+    async def __call__(self, question: str, pipeline: str) -> PipelineAnswer:
+        delay, answer = self.replies[pipeline]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.add(pipeline)
+            raise
+        if isinstance(answer, BaseException):
+            raise answer
+        return answer
+
+
+def run(ensemble: Ensemble, pipelines: Pipelines):
+    async def main():
+        started_at = time.monotonic()
+        winner, answer = await ensemble.answer('вопрос', pipelines)
+        return winner, answer, time.monotonic() - started_at
+
+    return asyncio.run(main())
+
+
+def ensemble(deadline_ms: float = 1000, confident_scores=None) -> Ensemble:
+    return Ensemble(PIPELINES, deadline_ms, confident_scores or {})
+
+
+def test_not_found_replies_do_not_vote():
+    pipelines = Pipelines({
+        'rag_ranker': reply(NO_ANSWER),
+        'faq_cases': reply('ответ', score=0.5),
+        'faq': reply('Документы не найдены в ответе RAG pipeline.'),
+        'baseline': reply(NO_ANSWER),
+    })
+    voting = ensemble()
+
+    winner, answer, _ = run(voting, pipelines)
+    assert (winner, answer.answer) == ('faq_cases', 'ответ')
+    assert voting.stats()['decisions'] == {VOTE: 1}
+
+
+def test_tie_is_broken_by_score_then_priority():
+    pipelines = Pipelines({
+        'rag_ranker': reply('первый', score=0.3),
+        'faq_cases': reply('второй', score=0.7),
+        'faq': reply('Второй '),
+        'baseline': reply('первый'),
+    })
+
+    winner, answer, _ = run(ensemble(), pipelines)
+    assert (winner, answer.answer) == ('faq_cases', 'второй')
+
+    pipelines.replies['faq_cases'] = reply('второй', score=0.3)
+    winner, _, _ = run(ensemble(), pipelines)
+    assert winner == 'rag_ranker'
+
+
+def test_all_not_found_returns_first_pipeline_reply():
+    pipelines = Pipelines({
+        'rag_ranker': reply(NO_ANSWER, delay=0.02),
+        'faq_cases': reply(NO_ANSWER),
+        'faq': reply('Документы не найдены в ответе RAG pipeline.'),
+        'baseline': reply(NO_ANSWER),
+    })
+
+    winner, answer, _ = run(ensemble(), pipelines)
+    assert (winner, answer.answer) == ('rag_ranker', NO_ANSWER)
+
+
+def test_confident_reply_cancels_the_rest():
+    pipelines = Pipelines({
+        'rag_ranker': reply('уверенный', score=0.95),
+        'faq_cases': reply('другой', score=0.99, delay=5),
+        'faq': reply('другой', delay=5),
+        'baseline': reply('другой', delay=5),
+    })
+    voting = ensemble(confident_scores={'rag_ranker': 0.9, 'faq_cases': 0.95})
+
+    winner, _, elapsed = run(voting, pipelines)
+    assert winner == 'rag_ranker'
+    assert elapsed < 1
+    assert pipelines.cancelled == {'faq_cases', 'faq', 'baseline'}
+    assert voting.stats()['decisions'] == {CONFIDENT: 1}
+
+
+def test_majority_does_not_wait_for_the_rest():
+    pipelines = Pipelines({
+        'rag_ranker': reply('ответ'),
+        'faq_cases': reply(' Ответ'),
+        'faq': reply('ответ'),
+        'baseline': reply('другой', score=1.0, delay=5),
+    })
+    voting = ensemble()
+
+    winner, _, elapsed = run(voting, pipelines)
+    assert winner == 'rag_ranker'
+    assert elapsed < 1
+    assert voting.stats()['decisions'] == {MAJORITY: 1}
+
+
+def test_deadline_bounds_the_vote():
+    pipelines = Pipelines({
+        'rag_ranker': reply('первый', score=0.1),
+        'faq_cases': reply('второй', score=0.2, delay=0.01),
+        'faq': reply('третий', delay=5),
+        'baseline': reply('четвёртый', delay=5),
+    })
+    voting = ensemble(deadline_ms=100)
+
+    winner, _, elapsed = run(voting, pipelines)
+    assert winner == 'faq_cases'
+    assert elapsed < 1
+    assert pipelines.cancelled == {'faq', 'baseline'}
+    assert voting.stats()['decisions'] == {DEADLINE: 1}
+
+
+def test_deadline_applies_before_the_first_reply():
+    pipelines = Pipelines({pipeline: reply('ответ', delay=5) for pipeline in PIPELINES})
+    voting = ensemble(deadline_ms=100)
+
+    winner, answer, elapsed = run(voting, pipelines)
+    assert winner is None
+    assert answer.answer == NO_ANSWER
+    assert elapsed < 1
+    assert pipelines.cancelled == set(PIPELINES)
+
+
+def test_failed_pipelines_are_skipped_and_sole_error_is_raised():
+    pipelines = Pipelines({
+        'rag_ranker': failure(),
+        'faq_cases': reply('ответ'),
+        'faq': failure(),
+        'baseline': failure(),
+    })
+    voting = ensemble()
+
+    winner, _, _ = run(voting, pipelines)
+    assert winner == 'faq_cases'
+    assert voting.stats()['errors'] == {'rag_ranker': 1, 'faq': 1, 'baseline': 1}
+
+    pipelines.replies['faq_cases'] = failure()
+    with pytest.raises(RuntimeError):
+        run(ensemble(), pipelines)
@@ -0,0 +1,78 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import sqlite3
+import time
+
+from app.metrics import INSERT_ANSWER, UPDATE_FEEDBACK, MetricsWriter
+
+
+def answer(answer_id: str):
+    return answer_id, 'вопрос', 'faq', 'ответ', 'класс 1', 'класс 2', None
+
+
+def rows(path):
+    with sqlite3.connect(path) as db:
+        return db.execute('SELECT answer_id, feedback FROM answers ORDER BY answer_id').fetchall()
+
+
+def test_failing_operation_loses_only_itself(tmp_path):
+    path = str(tmp_path / 'metrics.db')
+
+    async def main():
+        writer = MetricsWriter(path, batch_size=10)
+        await writer.start()
+        # Повтор первичного ключа роняет executemany всей пачки
+        for params in (answer('a'), answer('b'), answer('a'), answer('c')):
+            await writer.put(INSERT_ANSWER, params)
+        await writer.put(UPDATE_FEEDBACK, (1, 'c'))
+        await writer.close()
+        return writer.stats()
+
+    stats = asyncio.run(main())
+    assert stats['written'] == 4
+    assert stats['failed'] == 1
+    assert rows(path) == [('a', 0), ('b', 0), ('c', 1)]
+
+
+def test_close_does_not_wait_for_dead_worker(tmp_path):
+    async def main():
+        writer = MetricsWriter(str(tmp_path / 'metrics.db'))
+        await writer.start()
+        writer.worker.cancel()
+        await asyncio.sleep(0)
+        await writer.put(INSERT_ANSWER, answer('a'))
+
+        started_at = time.monotonic()
+        await writer.close(timeout=30)
+        return time.monotonic() - started_at
+
+    assert asyncio.run(main()) < 1
+
+
+def test_close_is_bounded_by_timeout(tmp_path):
+    async def main():
+        writer = MetricsWriter(str(tmp_path / 'metrics.db'))
+        await writer.start()
+        # Фоновая задача жива, но очередь не разбирает
+        writer.worker.cancel()
+        writer.worker = asyncio.create_task(asyncio.sleep(60))
+        await writer.put(INSERT_ANSWER, answer('a'))
+
+        started_at = time.monotonic()
+        await writer.close(timeout=0.1)
+        return time.monotonic() - started_at
+
+    assert asyncio.run(main()) < 1
@@ -0,0 +1,153 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import pytest
+
+from runner import FAKE, REAL
+
+PIPELINES = ['rag_ranker', 'faq', 'faq_cases', 'baseline']
+# Эталон по-умолчанию хранится в кэше pytest, а не в дереве исходников
+BASELINE_CACHE_PATH = Path('benchmarks') / 'baseline.json'
+
+
+def pytest_addoption(parser) -> None:
+    group = parser.getgroup('benchmarks')
+    group.addoption(
+        '--bench-models', choices=[FAKE, REAL, 'all'], default=os.getenv('BENCH_MODELS', FAKE),
+        help='модели пайплайнов: заменители, настоящие или оба варианта',
+    )
+    group.addoption(
+        '--bench-pipelines', default=os.getenv('BENCH_PIPELINES', ','.join(PIPELINES)),
+        help='пайплайны через запятую',
+    )
+    group.addoption('--bench-concurrency', type=int, default=int(os.getenv('BENCH_CONCURRENCY', '8')))
+    group.addoption('--bench-limit', type=int, help='взять только первые N вопросов')
+    group.addoption('--bench-runs', nargs='+', choices=['cold', 'warm'], default=['cold'])
+    group.addoption(
+        '--bench-tolerance', type=float, default=float(os.getenv('BENCH_TOLERANCE', '0.2')),
+        help='допустимое ухудшение относительно эталона, доля',
+    )
+    group.addoption(
+        '--bench-slack-ms', type=float, default=float(os.getenv('BENCH_SLACK_MS', '5')),
+        help='допустимый рост задержек сверх доли, мс',
+    )
+    group.addoption(
+        '--bench-baseline', type=Path, default=os.getenv('BENCH_BASELINE') or None,
+        help='файл эталонных результатов, по-умолчанию в кэше pytest',
+    )
+    group.addoption('--bench-update', action='store_true', help='записать результаты прогона в эталон')
+    group.addoption(
+        '--bench-strict', action='store_true', default=os.getenv('BENCH_STRICT', '') == '1',
+        help='падать, а не пропускать пайплайн без зависимостей, настоящих моделей или эталона',
+    )
+
+
+def pytest_configure(config) -> None:
+    config.addinivalue_line('markers', 'benchmark: бенчмарк пайплайна в процессе')
+
+
+def pytest_generate_tests(metafunc) -> None:
+    config = metafunc.config
+    if 'pipeline' in metafunc.fixturenames:
+        pipelines = [name.strip() for name in config.getoption('--bench-pipelines').split(',') if name.strip()]
+        metafunc.parametrize('pipeline', pipelines)
+    if 'models' in metafunc.fixturenames:
+        models = config.getoption('--bench-models')
+        metafunc.parametrize('models', [FAKE, REAL] if models == 'all' else [models])
+
+
+def baseline_path(config) -> Path:
+    path = config.getoption('--bench-baseline')
+    if path is not None:
+        return Path(path)
+    if getattr(config, 'cache', None) is not None:
+        return config.cache.mkdir(str(BASELINE_CACHE_PATH.parent)) / BASELINE_CACHE_PATH.name
+    # Кэш pytest отключён через `-p no:cacheprovider`
+    return Path(tempfile.gettempdir()) / 'pipeline-benchmarks' / BASELINE_CACHE_PATH.name
+
+
+class Baseline:
+    """
+    Эталонные результаты бенчмарков по ключу `pipeline/models`, хранятся в JSON.
+
+    Файл записывается только после прогона с `--bench-update`.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: Dict[str, Any] = {}
+        if path.exists():
+            with open(path, 'r', encoding='utf-8') as file:
+                self.entries = json.load(file)
+        self.results: Dict[str, Any] = {}
+        # Пропущенные прогоны и причины пропуска для отчёта в конце сессии
+        self.skipped: Dict[str, str] = {}
+        self.changed = False
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get(key)
+
+    def record(self, key: str, summary: Dict[str, Any]) -> None:
+        self.entries[key] = summary
+        self.changed = True
+
+    def save(self) -> None:
+        if not self.changed:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as file:
+            json.dump(dict(sorted(self.entries.items())), file, ensure_ascii=False, indent=2)
+            file.write('\n')
+
+
+BASELINE_KEY = pytest.StashKey[Baseline]()
+
+
+@pytest.fixture(scope='session')
+def baseline(request) -> Baseline:
+    baseline = Baseline(baseline_path(request.config))
+    request.config.stash[BASELINE_KEY] = baseline
+    yield baseline
+    baseline.save()
+
+
+def pytest_terminal_summary(terminalreporter, config) -> None:
+    baseline = config.stash.get(BASELINE_KEY, None)
+    if baseline is None:
+        return
+    if baseline.skipped:
+        # Пропуск пайплайна не должен выглядеть как успешный прогон
+        terminalreporter.section('benchmarks: пропущено', yellow=True, bold=True)
+        for key, reason in baseline.skipped.items():
+            terminalreporter.write_line(f'{key}: {reason}', yellow=True)
+    if not baseline.results:
+        return
+    terminalreporter.section('benchmarks')
+    terminalreporter.write_line(
+        f'{"pipeline":<20} {"run":<5} {"qps":>8} {"p50, ms":>9} {"p95, ms":>9} {"p99, ms":>9}'
+    )
+    for key, summary in baseline.results.items():
+        for run, result in summary['runs'].items():
+            latency = result['latency_ms']
+            terminalreporter.write_line(
+                f'{key:<20} {run:<5} {result["qps"]:>8.1f} {latency["p50"]:>9.1f} '
+                f'{latency["p95"]:>9.1f} {latency["p99"]:>9.1f}'
+            )
+    terminalreporter.write_line(f'эталон: {baseline.path}')
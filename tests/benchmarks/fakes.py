@@ -0,0 +1,285 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Детерминированные заменители моделей пайплайнов для бенчмарков без GPU и скачивания весов.
+
+Заменители повторяют интерфейсы компонентов, которые создают пайплайны (эмбеддеры и ранкер haystack,
+SentenceTransformer, классификаторы), поэтому код пайплайна выполняется без изменений.
+Эмбеддинг текста - нормализованная сумма псевдослучайных векторов его слов с сидом от хэша слова:
+векторы имеют размерность настоящей модели, а похожие вопросы оказываются рядом.
+Оценка кросс-энкодера - доля общих слов вопроса и документа. Время инференса имитируется паузой
+`base + per_item * N` миллисекунд на вызов, пауза отпускает GIL, как и настоящий инференс.
+"""
+
+import dataclasses
+import functools
+import hashlib
+import os
+import re
+import time
+from types import SimpleNamespace
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Размерности эмбеддингов моделей пайплайнов
+DIMENSIONS = {
+    'intfloat/e5-large-v2': 1024,
+    'cointegrated/LaBSE-en-ru': 768,
+    'sentence-transformers/all-MiniLM-L6-v2': 384,
+}
+DEFAULT_DIMENSION = 768
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+@dataclasses.dataclass(frozen=True)
+class Latency:
+    """
+    Имитация времени инференса: постоянная часть на вызов и добавка на каждый элемент батча.
+    """
+
+    base_ms: float
+    per_item_ms: float
+
+    @classmethod
+    def parse(cls, value: str) -> 'Latency':
+        # Формат `base,per_item` в миллисекундах
+        base_ms, per_item_ms = (float(part) for part in value.split(','))
+        return cls(base_ms, per_item_ms)
+
+    def wait(self, items: int) -> None:
+        delay = self.base_ms + self.per_item_ms * items
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+
+# Задержки по порядку величины соответствуют моделям пайплайнов на GPU
+EMBEDDER_LATENCY = Latency.parse(os.getenv('BENCH_EMBEDDER_LATENCY_MS', '6,1'))
+RANKER_LATENCY = Latency.parse(os.getenv('BENCH_RANKER_LATENCY_MS', '8,0.3'))
+CLASSIFIER_LATENCY = Latency.parse(os.getenv('BENCH_CLASSIFIER_LATENCY_MS', '1,0.2'))
+
+
+def words(text: Optional[str]) -> List[str]:
+    return WORD_PATTERN.findall((text or '').lower())
+
+
+def seed(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+@functools.lru_cache(maxsize=100_000)
+def word_vector(word: str, dimension: int) -> np.ndarray:
+    return np.random.default_rng(seed(word)).standard_normal(dimension).astype(np.float32)
+
+
+def embed(text: str, dimension: int) -> np.ndarray:
+    vector = np.zeros(dimension, dtype=np.float32)
+    for word in words(text) or ['']:
+        vector += word_vector(word, dimension)
+    return vector / max(float(np.linalg.norm(vector)), 1e-6)
+
+
+class FakeEmbeddingBackend:
+    """
+    Бэкенд эмбеддингов с интерфейсом `embed` бэкенда sentence-transformers в эмбеддерах haystack.
+    """
+
+    def __init__(self, model: str, latency: Latency = EMBEDDER_LATENCY):
+        self.dimension = DIMENSIONS.get(model, DEFAULT_DIMENSION)
+        self.latency = latency
+
+    def embed(self, data: List[str], batch_size: int = 32, **kwargs) -> List[List[float]]:
+        embeddings = []
+        for start in range(0, len(data), batch_size):
+            batch = data[start:start + batch_size]
+            self.latency.wait(len(batch))
+            embeddings.extend(embed(text, self.dimension).tolist() for text in batch)
+        return embeddings
+
+
+class FakeTextEmbedder:
+    """
+    Заменитель SentenceTransformersTextEmbedder.
+    """
+
+    def __init__(self, model: str, device=None, batch_size: int = 32, **kwargs):
+        self.model = model
+        self.device = device
+        self.prefix = ''
+        self.suffix = ''
+        self.batch_size = batch_size
+        self.normalize_embeddings = False
+        self.precision = 'float32'
+        self.embedding_backend = None
+
+    def warm_up(self) -> None:
+        if self.embedding_backend is None:
+            self.embedding_backend = FakeEmbeddingBackend(self.model)
+
+    def run(self, text: str):
+        self.warm_up()
+        return {'embedding': self.embedding_backend.embed([self.prefix + text + self.suffix])[0]}
+
+
+class FakeDocumentEmbedder(FakeTextEmbedder):
+    """
+    Заменитель SentenceTransformersDocumentEmbedder.
+    """
+
+    def run(self, documents: list):
+        self.warm_up()
+        embeddings = self.embedding_backend.embed(
+            [self.prefix + (document.content or '') + self.suffix for document in documents],
+            batch_size=self.batch_size,
+        )
+        return {
+            'documents': [
+                dataclasses.replace(document, embedding=embedding)
+                for document, embedding in zip(documents, embeddings)
+            ],
+        }
+
+
+class FakeSentenceTransformer:
+    """
+    Заменитель SentenceTransformer для пайплайна baseline.
+    """
+
+    def __init__(self, model: str, device=None, **kwargs):
+        self.backend = FakeEmbeddingBackend(model)
+
+    def encode(
+            self,
+            sentences: Sequence[str],
+            batch_size: int = 32,
+            convert_to_numpy: bool = True,
+            normalize_embeddings: bool = False,
+            **kwargs,
+    ) -> np.ndarray:
+        embeddings = self.backend.embed(list(sentences), batch_size=batch_size)
+        return np.asarray(embeddings, dtype=np.float32).reshape(len(sentences), self.backend.dimension)
+
+
+def overlap(query: str, document: str) -> float:
+    query_words, document_words = set(words(query)), set(words(document))
+    if not query_words or not document_words:
+        return 0.0
+    return len(query_words & document_words) / len(query_words | document_words)
+
+
+class FakeCrossEncoderTokenizer:
+    # Вместо токенов передаёт модели сами пары текстов
+    def __call__(self, pairs: List[List[str]], **kwargs):
+        return FakeFeatures(pairs)
+
+
+class FakeFeatures(dict):
+    def __init__(self, pairs: List[List[str]]):
+        super().__init__(pairs=pairs)
+
+    def to(self, device) -> 'FakeFeatures':
+        return self
+
+
+class FakeCrossEncoderModel:
+    def __init__(self, latency: Latency = RANKER_LATENCY):
+        self.latency = latency
+
+    def __call__(self, pairs: List[List[str]]):
+        # Ранжирование rag_ranker применяет к логитам операции torch, без torch пайплайн не импортируется вовсе
+        import torch
+
+        self.latency.wait(len(pairs))
+        # Логит растёт с долей общих слов, после сигмоиды порог 0.25 проходят пары с общей третью слов
+        logits = [[10.0 * overlap(query, document) - 4.0] for query, document in pairs]
+        return SimpleNamespace(logits=torch.tensor(logits, dtype=torch.float32))
+
+
+class FakeSimilarityRanker:
+    """
+    Заменитель TransformersSimilarityRanker с атрибутами, которые использует батчевое ранжирование пайплайна.
+    """
+
+    def __init__(
+            self,
+            model: str,
+            device=None,
+            top_k: int = 10,
+            query_prefix: str = '',
+            document_prefix: str = '',
+            scale_score: bool = True,
+            calibration_factor: float = 1.0,
+            **kwargs,
+    ):
+        from haystack.utils import ComponentDevice
+
+        self.model_name_or_path = model
+        self.device = device or ComponentDevice.from_str('cpu')
+        self.top_k = top_k
+        self.query_prefix = query_prefix
+        self.document_prefix = document_prefix
+        self.scale_score = scale_score
+        self.calibration_factor = calibration_factor
+        self.tokenizer = None
+        self.model = None
+
+    def warm_up(self) -> None:
+        if self.model is None:
+            self.tokenizer = FakeCrossEncoderTokenizer()
+            self.model = FakeCrossEncoderModel()
+
+
+class FakeVectorizer:
+    def __init__(self, latency: Latency = CLASSIFIER_LATENCY):
+        self.latency = latency
+
+    def transform(self, texts: List[str]) -> List[str]:
+        self.latency.wait(len(texts))
+        return texts
+
+
+class FakeClassifierModel:
+    """
+    Классификатор с меткой по хэшу текста: один и тот же вопрос всегда получает один класс.
+    """
+
+    def __init__(self, level: int, classes: int):
+        self.level = level
+        self.classes = max(classes, 1)
+
+    def predict(self, texts: List[str]) -> np.ndarray:
+        return np.asarray([seed(f'{self.level}:{text}') % self.classes for text in texts])
+
+
+class FakeLabelEncoder:
+    def __init__(self, labels: List[str]):
+        self.labels = np.asarray(labels or [''], dtype=object)
+
+    def inverse_transform(self, indices: np.ndarray) -> np.ndarray:
+        return self.labels[indices]
+
+
+def classifier_models(labels: List[List[str]]) -> List[Tuple[FakeVectorizer, FakeClassifierModel, FakeLabelEncoder]]:
+    """
+    Тройки (векторизатор, модель, кодировщик меток) для ClassifierEngine, по одной на уровень.
+
+    Параметры:
+    - labels (List[List[str]]): Метки каждого уровня классификации.
+    """
+    return [
+        (FakeVectorizer(), FakeClassifierModel(level, len(level_labels)), FakeLabelEncoder(level_labels))
+        for level, level_labels in enumerate(labels)
+    ]
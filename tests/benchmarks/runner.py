@@ -0,0 +1,152 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Прогон одного пайплайна в процессе для бенчмарков, отчёт пишется в JSON.
+
+Каждый пайплайн запускается в отдельном интерпретаторе: у всех пайплайнов пакет называется `app`.
+С `--models fake` компоненты моделей подменяются заменителями из `fakes.py` до инициализации пайплайна,
+эмбеддинги базы знаний считаются во временном каталоге. С `--models real` используются настоящие модели
+и кэш эмбеддингов сервиса. Если зависимости пайплайна не установлены или настоящие модели недоступны,
+процесс завершается с кодом SKIPPED, причина пишется последней строкой в stderr.
+
+    python tests/benchmarks/runner.py --pipeline faq --models fake --output report.json
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import fakes
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / 'pipelines'))
+
+import evaluate  # noqa: E402
+
+# Код выхода для пропуска бенчмарка
+SKIPPED = 77
+
+FAKE = 'fake'
+REAL = 'real'
+
+# Классы компонентов, которые пайплайны создают при загрузке моделей, и их заменители
+FAKE_CLASSES = {
+    'SentenceTransformersDocumentEmbedder': fakes.FakeDocumentEmbedder,
+    'SentenceTransformersTextEmbedder': fakes.FakeTextEmbedder,
+    'TransformersSimilarityRanker': fakes.FakeSimilarityRanker,
+    'SentenceTransformer': fakes.FakeSentenceTransformer,
+}
+
+
+def skip(reason: str) -> None:
+    print(reason, file=sys.stderr)
+    sys.exit(SKIPPED)
+
+
+def load_fake_classifier(classifier) -> None:
+    import pandas as pd
+
+    # Метки классов берутся из базы знаний, чтобы ответы были похожи на настоящие
+    df = pd.read_excel(os.environ['KNOWLEDGE_BASE_FILE_PATH'])
+    labels = [
+        sorted(df[column].dropna().astype(str).unique())
+        for column in ('Классификатор 1 уровня', 'Классификатор 2 уровня')
+    ]
+    classifier.models = fakes.classifier_models(labels)
+    classifier.stop_words = set()
+    # Токенизатору nltk нужны скачиваемые данные, вместо него слова выделяются регулярным выражением
+    classifier.preprocess = lambda text: ' '.join(fakes.words(text))
+
+
+def install_fakes(model) -> None:
+    """
+    Подменяет классы моделей в модуле пайплайна, сама загрузка моделей в `init()` остаётся прежней.
+    """
+    for name, fake in FAKE_CLASSES.items():
+        if hasattr(model, name):
+            setattr(model, name, fake)
+    if hasattr(model, 'classifier'):
+        model.classifier.load = functools.partial(load_fake_classifier, model.classifier)
+
+
+def run(args: argparse.Namespace) -> dict:
+    cases = evaluate.read_questions(args.questions)
+    cases = cases[:args.limit] if args.limit else cases
+
+    try:
+        model = evaluate.import_pipeline(args.pipeline)
+    except ImportError as exception:
+        skip(f'{args.pipeline}: зависимости пайплайна не установлены: {exception}')
+
+    if args.models == FAKE:
+        install_fakes(model)
+    try:
+        model.init()
+    except Exception:
+        if args.models == REAL:
+            skip(f'{args.pipeline}: настоящие модели недоступны: {model.startup.error}')
+        raise
+
+    report = {
+        'pipeline': args.pipeline,
+        'models': args.models,
+        'startup': model.startup.status()['stages'],
+        'runs': {},
+    }
+    for name in args.runs:
+        if name == 'cold':
+            evaluate.reset_caches(model)
+        report['runs'][name] = asyncio.run(evaluate.answer_all(model, cases, args.concurrency))
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pipeline', choices=evaluate.PIPELINES, required=True)
+    parser.add_argument('--models', choices=[FAKE, REAL], default=FAKE)
+    parser.add_argument('--questions', type=Path, default=ROOT / 'tests' / 'questions.txt')
+    parser.add_argument('--limit', type=int, help='взять только первые N вопросов')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--runs', nargs='+', choices=['cold', 'warm'], default=['cold'])
+    parser.add_argument('--output', type=Path, required=True)
+    args = parser.parse_args()
+    # Пути считаются от текущего каталога, до перехода в каталог пайплайна
+    args.questions = args.questions.resolve()
+    args.output = args.output.resolve()
+
+    # Настройки читаются модулями пайплайна при импорте, поэтому задаются до него
+    os.environ.setdefault('HAYSTACK_TELEMETRY_ENABLED', 'False')
+    if args.models == FAKE:
+        # Без обращений к Hugging Face Hub: все модели заменены
+        os.environ['HF_HUB_OFFLINE'] = '1'
+        os.environ['INFERENCE_BACKEND'] = 'torch'
+        os.environ['KB_WATCH_INTERVAL'] = '0'
+        with tempfile.TemporaryDirectory(prefix='bench-embeddings-') as path:
+            os.environ['EMBEDDINGS_CACHE_PATH'] = path
+            report = run(args)
+    else:
+        report = run(args)
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+from runner import FAKE, SKIPPED
+
+RUNNER = Path(__file__).with_name('runner.py')
+# Инициализация с настоящими моделями включает их загрузку и эмбеддинг базы знаний
+TIMEOUT = 1800
+
+PERCENTILES = ('p50', 'p95', 'p99')
+# Повторы калибровки, берётся самый быстрый
+CALIBRATION_REPEATS = 5
+
+
+def calibrate() -> float:
+    """
+    Время фиксированной работы на CPU в миллисекундах: мера скорости машины на момент прогона.
+
+    Эталон, снятый на более быстрой машине или без фоновой нагрузки, сравнивается с поправкой на это отношение.
+    """
+    best = float('inf')
+    for _ in range(CALIBRATION_REPEATS):
+        started_at = time.perf_counter()
+        words = sorted(str(number * 7919 % 100003) for number in range(100000))
+        sum(hash(word) for word in words)
+        best = min(best, time.perf_counter() - started_at)
+    return round(best * 1000, 2)
+
+
+def run_pipeline(config, baseline, key: str, pipeline: str, models: str, output: Path) -> Dict[str, Any]:
+    command = [
+        sys.executable, str(RUNNER),
+        '--pipeline', pipeline,
+        '--models', models,
+        '--concurrency', str(config.getoption('--bench-concurrency')),
+        '--runs', *config.getoption('--bench-runs'),
+        '--output', str(output),
+    ]
+    if config.getoption('--bench-limit'):
+        command += ['--limit', str(config.getoption('--bench-limit'))]
+
+    process = subprocess.run(command, capture_output=True, text=True, timeout=TIMEOUT)
+    if process.returncode == SKIPPED:
+        lines = process.stderr.strip().splitlines()
+        reason = lines[-1] if lines else f'{key}: пропущен без причины'
+        if config.getoption('--bench-strict'):
+            pytest.fail(reason)
+        baseline.skipped[key] = reason
+        pytest.skip(reason)
+    assert process.returncode == 0, f'бенчмарк завершился ошибкой:\n{process.stderr[-4000:]}'
+    with open(output, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def summarize(report: Dict[str, Any], calibration_ms: float) -> Dict[str, Any]:
+    """
+    Результаты для эталона: пропускная способность, перцентили общей задержки, p95 стадий и калибровка машины.
+    """
+    runs = {}
+    for name, run in report['runs'].items():
+        latency = run['latency_ms']
+        runs[name] = {
+            'qps': round(run['qps'], 2),
+            'errors': run['errors'],
+            'latency_ms': {percentile: round(latency['total'][percentile], 2) for percentile in PERCENTILES},
+            'stages_p95_ms': {
+                stage: round(values['p95'], 2) for stage, values in latency.items() if stage != 'total'
+            },
+        }
+    some_run = next(iter(report['runs'].values()))
+    return {
+        'questions': some_run['questions'],
+        'concurrency': some_run['concurrency'],
+        'calibration_ms': calibration_ms,
+        'runs': runs,
+    }
+
+
+def stale(current: Dict[str, Any], expected: Dict[str, Any]) -> Optional[str]:
+    """
+    Описание расхождения, если эталон снят на другом числе вопросов или конкурентных запросов, иначе None.
+    """
+    for field in ('questions', 'concurrency'):
+        if current[field] != expected[field]:
+            return f'{field} {current[field]} != {expected[field]} в эталоне'
+    return None
+
+
+def slowdown(current: Dict[str, Any], expected: Dict[str, Any]) -> float:
+    """
+    Во сколько раз машина текущего прогона медленнее машины эталона, не меньше 1.
+
+    Быстрая машина порогов не ужесточает: заменители моделей ждут фиксированное время, и оно не ускоряется.
+    """
+    if not current.get('calibration_ms') or not expected.get('calibration_ms'):
+        return 1.0
+    return max(1.0, current['calibration_ms'] / expected['calibration_ms'])
+
+
+def compare(current: Dict[str, Any], expected: Dict[str, Any], tolerance: float, slack_ms: float) -> List[str]:
+    """
+    Сравнивает результаты с эталоном и возвращает описания регрессий.
+
+    Сравниваются отношения к эталону: пропускная способность не должна упасть больше чем на долю `tolerance`,
+    перцентили задержки - вырасти больше чем на долю `tolerance` плюс `slack_ms`, чтобы шум на малых задержках
+    не считался регрессией. Если машина медленнее эталонной по калибровке, пороги расширяются в `slowdown` раз.
+    Прогоны должны быть сняты на том же числе вопросов и конкурентных запросов, см. `stale`.
+    """
+    scale = slowdown(current, expected)
+    regressions = []
+    for name, run in current['runs'].items():
+        expected_run = expected['runs'].get(name)
+        if expected_run is None:
+            continue
+        if run['qps'] * scale < expected_run['qps'] * (1 - tolerance):
+            regressions.append(f'{name}: qps {run["qps"]} < {expected_run["qps"]}')
+        for percentile in PERCENTILES:
+            value, limit = run['latency_ms'][percentile], expected_run['latency_ms'][percentile] * scale
+            if value > limit * (1 + tolerance) + slack_ms:
+                regressions.append(f'{name}: {percentile} {value}ms > {round(limit, 2)}ms')
+    return regressions
+
+
+@pytest.mark.benchmark
+def test_pipeline_benchmark(request, baseline, pipeline: str, models: str, tmp_path: Path) -> None:
+    config = request.config
+    key = f'{pipeline}/{models}'
+    calibration_ms = calibrate()
+    report = run_pipeline(config, baseline, key, pipeline, models, tmp_path / 'report.json')
+    summary = summarize(report, calibration_ms)
+    baseline.results[key] = summary
+
+    if models == FAKE:
+        # Заменители моделей детерминированы, ошибка в ответе - ошибка кода пайплайна
+        assert all(run['errors'] == 0 for run in summary['runs'].values()), 'ошибки при ответах на вопросы'
+
+    if config.getoption('--bench-update'):
+        baseline.record(key, summary)
+        return
+    expected = baseline.get(key)
+    if expected is None:
+        if config.getoption('--bench-strict'):
+            pytest.fail(f'{key}: нет эталона в {baseline.path}, запишите его с --bench-update')
+        baseline.skipped[key] = 'нет эталона, запишите его с --bench-update'
+        pytest.skip(f'{key}: нет эталона в {baseline.path}, запишите его с --bench-update')
+    difference = stale(summary, expected)
+    if difference is not None:
+        pytest.fail(f'{key}: эталон устарел ({difference}), обновите его с --bench-update')
+
+    regressions = compare(summary, expected, config.getoption('--bench-tolerance'), config.getoption('--bench-slack-ms'))
+    assert not regressions, f'{key}: регрессия относительно эталона: ' + '; '.join(regressions)
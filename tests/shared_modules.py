@@ -0,0 +1,96 @@
+#  Copyright 2024 AI RnD Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Проверка, что копии общих модулей сервисов совпадают байт в байт.
+
+Каждый сервис собирается в образ из своего каталога (контекст сборки в `.github/workflows/docker.yml`
+и `docker build .`), поэтому общий код не может лежать вне каталога сервиса и копируется в `app` каждого из них.
+Изменение вносится в любую копию и переносится во все файлы группы, затем запускается проверка:
+
+    python tests/shared_modules.py
+"""
+
+import difflib
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+
+PIPELINES = ['rag_ranker', 'faq', 'faq_cases', 'baseline']
+KNOWLEDGE_BASE_PIPELINES = ['rag_ranker', 'faq', 'faq_cases']
+
+
+def pipelines(module: str, names: List[str] = PIPELINES) -> List[str]:
+    return [f'pipelines/{name}/app/{module}' for name in names]
+
+
+# Группы копий: модуль -> файлы, которые должны совпадать.
+# bot/app/tracing.py сюда не входит: это отдельная трассировка сообщения бота на стороне клиента,
+# а не копия трассировки сервисов.
+SHARED_MODULES: Dict[str, List[str]] = {
+    'telemetry.py': ['qna/app/telemetry.py', *pipelines('telemetry.py')],
+    'tracing.py': ['qna/app/tracing.py', *pipelines('tracing.py')],
+    'startup.py': pipelines('startup.py'),
+    'streaming.py': pipelines('streaming.py'),
+    'answers.py': pipelines('answers.py', KNOWLEDGE_BASE_PIPELINES),
+    'cache.py': pipelines('cache.py', KNOWLEDGE_BASE_PIPELINES),
+    'embedding_store.py': pipelines('embedding_store.py', KNOWLEDGE_BASE_PIPELINES),
+    'inference.py': pipelines('inference.py', KNOWLEDGE_BASE_PIPELINES),
+    'reload.py': pipelines('reload.py', KNOWLEDGE_BASE_PIPELINES),
+    'normalizer.py': pipelines('normalizer.py', KNOWLEDGE_BASE_PIPELINES),
+    'batching.py': pipelines('batching.py', ['rag_ranker', 'baseline']),
+    'compaction.py': pipelines('compaction.py', ['rag_ranker', 'faq_cases']),
+}
+
+
+def check(groups: Dict[str, List[str]] = SHARED_MODULES) -> List[str]:
+    """
+    Возвращает:
+    - List[str]: Описания расхождений, пустой список - все копии совпадают.
+    """
+    problems = []
+    for module, paths in groups.items():
+        missing = [path for path in paths if not (ROOT / path).is_file()]
+        if missing:
+            problems.append(f'{module}: нет файлов {", ".join(missing)}')
+            continue
+        reference, *copies = paths
+        expected = (ROOT / reference).read_bytes()
+        for path in copies:
+            actual = (ROOT / path).read_bytes()
+            if actual != expected:
+                diff = difflib.unified_diff(
+                    expected.decode('utf-8').splitlines(keepends=True),
+                    actual.decode('utf-8').splitlines(keepends=True),
+                    fromfile=reference,
+                    tofile=path,
+                )
+                problems.append(f'{module}: {path} отличается от {reference}\n{"".join(diff)}')
+    return problems
+
+
+def main() -> int:
+    problems = check()
+    for problem in problems:
+        print(problem)
+    if problems:
+        return 1
+    print(f'shared modules: {len(SHARED_MODULES)} групп совпадают')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())